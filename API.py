@@ -1,19 +1,199 @@
-from flask import Flask, request, make_response, jsonify
-from os import path
-import json
-import datetime
-
-import cv2
+import time
+IMPORT_START = time.perf_counter() # Cold start is measured from here, see STARTUP_TIMINGS.
 
-from Video import VideoHandler
-from Bunny import BunnyAPI
+from flask import Flask, request, make_response, has_request_context, g
+from email.utils import formatdate
+from os import path, environ, getpid
+from threading import Lock
+import json
+import gzip
+import hmac
+
+try:
+    import orjson
+except ImportError: # Optional, the json module is used instead.
+    orjson = None
+try:
+    import brotli
+except ImportError: # Optional, responses fall back to gzip.
+    brotli = None
+
+from Video import VideoHandler, VIDEO_COLUMNS, UPLOAD_METADATA_REQUIRED_KEYS
+from Feed import FEED_FORMATS
+from Bunny import BREAKER_SETTINGS, BREAKER_STATE_VALUES
+from Thumbnail import ThumbnailProcessor
+from Metrics import REGISTRY, Gauge, HTTP_REQUEST_DURATION, HTTP_REQUEST_ERRORS
 
 HOME_DIR = path.dirname(path.realpath(__file__))
 UPLOAD_DIR = path.join(HOME_DIR, "uploads")
 
+VIDEO_ID_MAX_BATCH = 1000 # IDs per /videos/generate_id request
+UPLOAD_MAX_BATCH = 500 # Entries per /uploads/create-batch request
+WEBHOOK_TOKEN = environ.get("WEBHOOK_TOKEN") # Must match ?token= on webhook calls when set
+FEED_MAX_AGE = int(environ.get("FEED_MAX_AGE", 60)) # Seconds feed consumers may cache /feed without revalidating
+CIRCUIT_OPEN_HEADERS = {"Retry-After": str(int(BREAKER_SETTINGS["open_seconds"]))} # Sent with 503s while a Bunny breaker is open
+
 api = Flask(__name__)
-api_VideoHandle = VideoHandler()
-api_Bunny = BunnyAPI()
+api.config["MAX_CONTENT_LENGTH"] = int(environ.get("MAX_REQUEST_BYTES", 16 * 1024 * 1024)) # Bounds in-memory thumbnail bodies
+
+# Built per process by InitServices() rather than at import, so `gunicorn --preload` never forks a Postgres
+#       connection or a thread, and importing this module stays cheap. Every Bunny call goes through `api_VideoHandle.bunny`.
+api_VideoHandle: None | VideoHandler = None
+api_Thumbnails: None | ThumbnailProcessor = None
+_services_pid: None | int = None
+_services_lock = Lock()
+STARTUP_TIMINGS: dict[str, float] = {} # Seconds per cold start phase: import, services and, under gunicorn.conf.py, worker_boot
+
+def InitServices(start_background: bool = None) -> None:
+    '''Builds this process's VideoHandler and ThumbnailProcessor once. A forked child builds its own.
+
+    `start_background` decides whether this process runs the upload poller and job workers, it defaults to
+    $BACKGROUND_WORKER ("1"). gunicorn.conf.py calls this as each worker boots and sets it for one worker only.'''
+    global api_VideoHandle, api_Thumbnails, _services_pid
+    if _services_pid == getpid():
+        return
+    with _services_lock:
+        if _services_pid == getpid():
+            return
+        if start_background is None:
+            start_background = environ.get("BACKGROUND_WORKER", "1") == "1"
+        services_start = time.perf_counter()
+        api_VideoHandle = VideoHandler(start_background=start_background)
+        api_Thumbnails = ThumbnailProcessor(api_VideoHandle.bunny, purger=api_VideoHandle.purger, database=api_VideoHandle.database)
+        STARTUP_TIMINGS["services"] = time.perf_counter() - services_start
+        REGISTRY.start_exporter()
+        _services_pid = getpid()
+
+# Gauges read the services at scrape time, one that raises before InitServices() ran is just left out.
+REGISTRY.register(Gauge("startup_seconds", "Cold start time of this process by phase (import, services, worker_boot).", lambda: {
+    (phase,): seconds for phase, seconds in STARTUP_TIMINGS.items()
+}, label_names=("phase",)))
+REGISTRY.register(Gauge("background_worker", "1 if this process runs the upload poller and job workers.", lambda: int(api_VideoHandle.background_started)))
+REGISTRY.register(Gauge("uploads_backlog", "Uploads waiting in Public.\"Uploads\".", lambda: api_VideoHandle.uploads_backlog(), per_process=False))
+REGISTRY.register(Gauge("db_pool_connections_in_use", "Postgres connections checked out of the pool.", lambda: api_VideoHandle.database.connections_in_use))
+REGISTRY.register(Gauge("db_pool_connections_max", "Postgres connection pool size.", lambda: api_VideoHandle.database.max_connections))
+REGISTRY.register(Gauge("bunny_pool_connections", "bunnyapi connection pool counters.", lambda: {
+    (key,): value for key, value in api_VideoHandle.bunny.pool_Stats().items() if key in ("requests_sent", "connections_opened", "connections_reused", "idle_connections")
+}, label_names=("kind",)))
+REGISTRY.register(Gauge("bunny_circuit_state", "bunnyapi circuit breaker state per method (0 closed, 1 half-open, 2 open).", lambda: {
+    (method,): BREAKER_STATE_VALUES[stats["state"]] for method, stats in api_VideoHandle.bunny.circuit_Stats().items()
+}, label_names=("method",)))
+REGISTRY.register(Gauge("bunny_circuit_opened", "Times each bunnyapi circuit breaker has opened.", lambda: {
+    (method,): stats["times_opened"] for method, stats in api_VideoHandle.bunny.circuit_Stats().items()
+}, label_names=("method",)))
+REGISTRY.register(Gauge("video_cache_hit_rate", "Share of video object lookups served from the cache.", lambda: api_VideoHandle.video_cache.stats()["hit_rate"]))
+REGISTRY.register(Gauge("video_cache_entries", "Video objects currently cached.", lambda: api_VideoHandle.video_cache.stats()["entries"]))
+REGISTRY.register(Gauge("video_cache_events", "Video object cache counters.", lambda: {
+    (key,): value for key, value in api_VideoHandle.video_cache.stats().items() if key in ("hits", "misses", "evictions", "expirations", "invalidations")
+}, label_names=("kind",)))
+REGISTRY.register(Gauge("warm_pool_videos", "Pre-created Stream Library videos waiting to be claimed.", lambda: len(api_VideoHandle.warm_pool)))
+REGISTRY.register(Gauge("warm_pool_events", "Warm pool counters.", lambda: {
+    (key,): value for key, value in api_VideoHandle.warm_pool_stats.items()
+}, label_names=("kind",)))
+REGISTRY.register(Gauge("jobs", "Durable jobs in Public.\"Jobs\" by kind and status.", lambda: api_VideoHandle.jobs.counts(), label_names=("kind", "status"), per_process=False))
+REGISTRY.register(Gauge("cache_purge_queue_depth", "CDN URLs waiting in this worker's purge queue.", lambda: api_VideoHandle.purger.queue_depth()))
+REGISTRY.register(Gauge("feed_videos", "Videos in this worker's materialized feed.", lambda: len(api_VideoHandle.feed.entries)))
+REGISTRY.register(Gauge("thumbnail_jobs", "Thumbnail jobs known to this process by status.", lambda: {
+    (status,): sum(1 for job in list(api_Thumbnails.jobs.values()) if job["status"] == status) for status in ("queued", "processing", "done", "failed")
+}, label_names=("status",)))
+
+@api.before_request
+def services__Ensure():
+    InitServices() # No-op once this process is initialized, covers servers that skip gunicorn.conf.py.
+
+@api.before_request
+def metrics__RequestStart():
+    g.request_start = time.perf_counter()
+
+@api.after_request
+def metrics__RequestEnd(resp):
+    request_start = g.pop("request_start", None)
+    if request_start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - request_start, route, request.method, resp.status_code)
+        if resp.status_code >= 500:
+            HTTP_REQUEST_ERRORS.inc(route, request.method)
+    return resp
+
+# Headers every JSON response carries, built once instead of per response.
+STATIC_RESPONSE_HEADERS = (
+    ("Content-Type", "application/json"),
+    ("Server", "video"),
+)
+RESPONSE_COMPRESSION_MIN_BYTES = int(environ.get("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+RESPONSE_GZIP_LEVEL = int(environ.get("RESPONSE_GZIP_LEVEL", 5))
+RESPONSE_BROTLI_QUALITY = int(environ.get("RESPONSE_BROTLI_QUALITY", 4))
+
+_http_date_cache = (0, "")
+def HTTPDate() -> str:
+    '''RFC 7231 date for the `Date` header, formatted at most once per second.'''
+    global _http_date_cache
+    now = int(time.time())
+    if _http_date_cache[0] != now:
+        _http_date_cache = (now, formatdate(now, usegmt=True))
+    return _http_date_cache[1]
+
+def SerializeJSON(data, pretty: bool = False) -> bytes:
+    '''Serializes `data` with orjson when it is installed, falling back to the json module.'''
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+        except TypeError: # e.g. non-string dict keys or integers wider than 64 bits
+            pass
+    if pretty:
+        return json.dumps(data, indent=4, default=str).encode()
+    return json.dumps(data, separators=(",", ":"), default=str).encode()
+
+def PrettyOutputRequested() -> bool:
+    '''Compact output unless the client asks for `?pretty=1` or sends a `pretty: true` header.'''
+    if not has_request_context():
+        return False
+    return request.args.get("pretty") in ("1", "true") or request.headers.get("pretty") in ("1", "true")
+
+def PreferredEncoding() -> None | str:
+    '''The best content coding the client accepts, "br", "gzip" or None.'''
+    accepted_encodings = {
+        encoding.split(";")[0].strip().lower()
+        for encoding in request.headers.get("Accept-Encoding", "").split(",")
+        if not encoding.replace(" ", "").endswith(";q=0")
+    }
+    if brotli is not None and "br" in accepted_encodings:
+        return "br"
+    if "gzip" in accepted_encodings:
+        return "gzip"
+    return None
+
+def Compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL)
+
+def CompressResponse(resp) -> None:
+    '''Compresses the body of `resp` with brotli or gzip if it is large enough and the client accepts it.'''
+    if not has_request_context() or resp.content_length is None or resp.content_length < RESPONSE_COMPRESSION_MIN_BYTES:
+        return
+
+    encoding = PreferredEncoding()
+    if encoding is not None:
+        resp.set_data(Compress(resp.get_data(), encoding))
+        resp.headers.set("Content-Encoding", encoding)
+    resp.headers.add("Vary", "Accept-Encoding")
+
+def BuildJSONResponse(data, status_code = 200, headers: dict = None):
+    '''Builds a response for any JSON-serializable `data` through the fast serialization path.'''
+    resp = make_response()
+    resp.status_code = status_code
+
+    for header, value in STATIC_RESPONSE_HEADERS:
+        resp.headers[header] = value
+    resp.headers["Date"] = HTTPDate()
+    if headers is not None:
+        resp.headers.update(dict(headers)) # Copied, callers may pass shared module-level dicts.
+
+    resp.set_data(SerializeJSON(data, pretty=PrettyOutputRequested()))
+    CompressResponse(resp)
+
+    return resp
 
 def BuildHTTPResponse(
         headers: dict = None,
@@ -29,17 +209,6 @@ def BuildHTTPResponse(
 
     object = kwargs.get("object")
 
-
-    resp = make_response()
-    resp.status_code = status_code
-
-    if headers is not None:
-        resp.headers = headers
-    else:
-        resp.headers.set("Content-Type", "application/json")
-        resp.headers.set("Server", "video")
-        resp.headers.set("Date", datetime.datetime.now())
-        
     data = {
         "type": type, # Response type
 
@@ -52,11 +221,7 @@ def BuildHTTPResponse(
         "object": object # Response data object
     }
 
-    resp.set_data(
-        json.dumps(data, indent=4)
-    )
-
-    return resp
+    return BuildJSONResponse(data, status_code=status_code, headers=headers)
 
 def BuildJSONResponseText(type: str, message: str, route: str, method: str):
     data = {
@@ -65,7 +230,7 @@ def BuildJSONResponseText(type: str, message: str, route: str, method: str):
         "route": route,
         "method": method
     }
-    return json.dumps(data, indent=4)
+    return SerializeJSON(data, pretty=PrettyOutputRequested()).decode()
 
 @api.route("/uploads/create", methods=["POST"])
 def uploads__Create():
@@ -94,8 +259,7 @@ def uploads__Create():
         response_data["message"] = "The header \"metadata\" is not set or was set incorrectly"
         response_data["message_name"] = "metadata_missing"
     
-    metadata_required_keys = ["title", "description", "category"]
-    metadata_missing_keys = [key for key in metadata_required_keys if metadata.get(key) is None]
+    metadata_missing_keys = [key for key in UPLOAD_METADATA_REQUIRED_KEYS if metadata.get(key) is None]
     
     if len(metadata_missing_keys) > 0 and len(metadata.keys()) != 0:
         response_data["type"] = "FAIL"
@@ -120,6 +284,8 @@ def uploads__Create():
 
         return BuildHTTPResponse(**response_data, status_code=500)
 
+    if upload_response_data.get("message_name") == "bunny_circuit_open":
+        return BuildHTTPResponse(**upload_response_data, status_code=503, headers=CIRCUIT_OPEN_HEADERS)
     if upload_response_type != "SUCCESS":
         return BuildHTTPResponse(**upload_response_data, status_code=400)
     
@@ -129,6 +295,64 @@ def uploads__Create():
 
     return BuildHTTPResponse(**upload_response_data)
 
+@api.route("/uploads/create-batch", methods=["POST"])
+def uploads__CreateBatch():
+    response_data = {
+        "type": None,
+
+        "message": None,
+        "message_name": None,
+
+        "route": "/uploads/create-batch",
+        "method": request.method,
+
+        "object": None
+    }
+
+    # Body is a JSON list of {"id": ..., "metadata": {...}} entries, each validated on its own.
+    entries = request.get_json(silent=True)
+    if not isinstance(entries, list) or len(entries) == 0:
+        response_data["type"] = "FAIL"
+        response_data["message"] = "The request body must be a non-empty JSON list of {\"id\", \"metadata\"} entries"
+        response_data["message_name"] = "upload_batch_invalid"
+
+        return BuildHTTPResponse(**response_data, status_code=400)
+
+    if len(entries) > UPLOAD_MAX_BATCH:
+        response_data["type"] = "FAIL"
+        response_data["message"] = f"A batch can hold at most {UPLOAD_MAX_BATCH} uploads"
+        response_data["message_name"] = "upload_batch_too_large"
+
+        return BuildHTTPResponse(**response_data, status_code=400)
+
+    results = api_VideoHandle.create_upload_objects(entries)
+
+    items = []
+    for entry, result in zip(entries, results):
+        if result["type"] == "SUCCESS":
+            # Some data is not for external use.
+            result["object"]["metadata"].pop("stream_url")
+            result["object"]["metadata"].pop("library_id")
+        items.append({
+            "id": entry.get("id") if isinstance(entry, dict) else None,
+            **result
+        })
+
+    created = sum(1 for item in items if item["type"] == "SUCCESS")
+    if created == len(items):
+        response_data["type"] = "SUCCESS"
+        response_data["message_name"] = "upload_batch_created"
+    elif created > 0:
+        response_data["type"] = "WARNING"
+        response_data["message_name"] = "upload_batch_partial"
+    else:
+        response_data["type"] = "FAIL"
+        response_data["message_name"] = "upload_batch_failed"
+    response_data["message"] = f"{created} of {len(items)} uploads created"
+    response_data["object"] = items
+
+    return BuildHTTPResponse(**response_data, status_code=200 if created > 0 else 400)
+
 @api.route("/videos/retrieve", methods=["GET"])
 def videos__Retrieve():
     response_data = {
@@ -151,14 +375,16 @@ def videos__Retrieve():
 
         return BuildHTTPResponse(**response_data)
     
-    response = api_Bunny.stream_RetrieveVideo(guid=guid)
+    response = api_VideoHandle.video_retrieve_remote(guid=guid)
     for key in response.keys():
         response_data[key] = response[key]
 
+    if response.get("message_name") == "bunny_circuit_open":
+        return BuildHTTPResponse(**response_data, status_code=503, headers=CIRCUIT_OPEN_HEADERS)
     if response.get("object") is None:
         return BuildHTTPResponse(**response_data)
     
-    return jsonify(response_data["object"])
+    return BuildJSONResponse(response_data["object"])
 
 @api.route("/videos/thumbnail-upload", methods=["POST"])
 def videos__ThumbnailUpload():
@@ -167,8 +393,11 @@ def videos__ThumbnailUpload():
         response_text = BuildJSONResponseText("WARNING", "The header \"target-file-path\" is not set or was set incorrectly", route="/videos/thumbnail-upload", method="POST")
         return make_response(response_text, 400)
 
+    # Images sent in the request body are processed in memory, nothing is read from or written to the upload volume.
+    image_bytes = request.get_data() or None
+
     local_file_path = request.headers.get("local-file-path")
-    if local_file_path is None or local_file_path == "":
+    if image_bytes is None and (local_file_path is None or local_file_path == ""):
         response_text = BuildJSONResponseText("WARNING", "The header \"local-file-path\" is not set or was set incorrectly", route="/videos/thumbnail-upload", method="POST")
         return make_response(response_text, 400)
     
@@ -178,23 +407,241 @@ def videos__ThumbnailUpload():
     else:
         target_image_resolution = (int(target_image_resolution.lower().split('x')[0]), int(target_image_resolution.lower().split('x')[1]))
 
-    # Resizing the thumbnail to the required size for our channel by default, but can be optionally specified
-    thumbnail_image = cv2.imread(local_file_path)
-    try:
-        resized = cv2.resize(thumbnail_image, target_image_resolution)
-        cv2.imwrite(local_file_path, resized)
-    except cv2.error: # and then if this doesn't exist you've got yourself a good ole fashioned error.
-        thumbnail_image = cv2.imread(path.join(UPLOAD_DIR, "THUMBNAIL_DEFAULT.png"))
-        resized = cv2.resize(thumbnail_image, target_image_resolution)
-        cv2.imwrite(local_file_path, resized)
+    job = api_Thumbnails.submit(target_file_path, local_file_path, target_image_resolution, image_bytes=image_bytes)
+    if job is None:
+        response_text = BuildJSONResponseText("FAIL", "Too many thumbnails are being processed, try again later", route="/videos/thumbnail-upload", method="POST")
+        return make_response(response_text, 503)
 
-    upload_request = api_VideoHandle.bunny.file_Upload(target_file_path=target_file_path, local_file_path=local_file_path)
+    response_data = {
+        "type": "SUCCESS",
+        "message": "Thumbnail queued for processing",
+        "message_name": "thumbnail_job_queued",
+        "route": "/videos/thumbnail-upload",
+        "method": request.method,
+        "object": job
+    }
+    return BuildHTTPResponse(**response_data, status_code=202)
+
+@api.route("/videos/thumbnail-status", methods=["GET"])
+def videos__ThumbnailStatus():
+    response_data = {
+        "type": None,
 
-    return BuildHTTPResponse(**upload_request)
+        "message": None,
+        "message_name": None,
+
+        "route": "/videos/thumbnail-status",
+        "method": request.method,
+
+        "object": None
+    }
+
+    job_id = request.headers.get("job-id")
+    if job_id is None or job_id == "":
+        response_data["type"] = "FAIL"
+        response_data["message"] = "The header \"job-id\" is not set or was set incorrectly"
+        response_data["message_name"] = "job_id_missing"
+
+        return BuildHTTPResponse(**response_data, status_code=400)
+
+    job = api_Thumbnails.job_Status(job_id)
+    if job is None:
+        response_data["type"] = "FAIL"
+        response_data["message"] = f"No thumbnail job with id {job_id}"
+        response_data["message_name"] = "thumbnail_job_not_found"
+
+        return BuildHTTPResponse(**response_data, status_code=404)
+
+    response_data["type"] = "SUCCESS"
+    response_data["message"] = f"Thumbnail job is {job['status']}"
+    response_data["message_name"] = "thumbnail_job_status"
+    response_data["object"] = job
+
+    return BuildHTTPResponse(**response_data)
 
 @api.route("/videos/generate_id", methods=["GET"])
 def videos__GenerateID():
+    count = request.args.get("count")
+    if count is None or count == "":
+        response_data = {
+            "id": api_VideoHandle.utility_generate_video_id()
+        }
+        return BuildJSONResponse(response_data)
+
+    if not (count.isascii() and count.isdigit()) or not 0 < int(count) <= VIDEO_ID_MAX_BATCH:
+        response_data = {
+            "type": "FAIL",
+            "message": f"The parameter \"count\" must be a number between 1 and {VIDEO_ID_MAX_BATCH}",
+            "message_name": "count_invalid",
+            "route": "/videos/generate_id",
+            "method": request.method,
+            "object": None
+        }
+        return BuildHTTPResponse(**response_data, status_code=400)
+
+    video_ids = api_VideoHandle.utility_reserve_video_ids(int(count))
+    response_data = {
+        "id": video_ids[0],
+        "ids": video_ids
+    }
+    return BuildJSONResponse(response_data)
+
+@api.route("/videos/list", methods=["GET"])
+def videos__List():
+    response_data = {
+        "type": None,
+
+        "message": None,
+        "message_name": None,
+
+        "route": "/videos/list",
+        "method": request.method,
+
+        "object": None
+    }
+
+    limit = request.headers.get("limit")
+    if limit is None or limit == "":
+        limit = 50
+    elif not (limit.isascii() and limit.isdigit()) or not 0 < int(limit) <= 500:
+        response_data["type"] = "FAIL"
+        response_data["message"] = "The header \"limit\" must be a number between 1 and 500"
+        response_data["message_name"] = "limit_invalid"
+
+        return BuildHTTPResponse(**response_data, status_code=400)
+    limit = int(limit)
+
+    columns = None
+    fields = request.headers.get("fields") # video_metadata,date_created | Comma separated
+    if fields is not None and fields != "":
+        columns = [field.strip() for field in fields.split(",")]
+
+    cursor = request.headers.get("cursor")
+    if cursor == "":
+        cursor = None
+
+    try:
+        rows, next_cursor = api_VideoHandle.videos_list_page(columns=columns, limit=limit, cursor=cursor)
+    except ValueError as error: # Unknown column or malformed cursor
+        response_data["type"] = "FAIL"
+        response_data["message"] = str(error)
+        response_data["message_name"] = "list_parameters_invalid"
+
+        return BuildHTTPResponse(**response_data, status_code=400)
+
+    column_names = ["video_id"] + [column for column in (columns or VIDEO_COLUMNS) if column != "video_id"]
+    videos = []
+    for row in rows:
+        video = dict(zip(column_names, row))
+        if video.get("video_metadata") is not None:
+            # Some data is not for external use.
+            video["video_metadata"].pop("stream_url", None)
+            video["video_metadata"].pop("library_id", None)
+        for column in ("date_created", "date_modified"):
+            if video.get(column) is not None:
+                video[column] = video[column].isoformat()
+        videos.append(video)
+
+    response_data["type"] = "SUCCESS"
+    response_data["message"] = "Video list page retrieved successfully"
+    response_data["message_name"] = "video_list_page_success"
+    response_data["object"] = {
+        "items": videos,
+        "cursor": next_cursor
+    }
+
+    return BuildHTTPResponse(**response_data)
+
+@api.route("/webhooks/stream-status", methods=["POST"])
+def webhooks__StreamStatus():
     response_data = {
-        "id": api_VideoHandle.utility_generate_video_id()
+        "type": None,
+
+        "message": None,
+        "message_name": None,
+
+        "route": "/webhooks/stream-status",
+        "method": request.method,
+
+        "object": None
     }
-    return jsonify(response_data)
\ No newline at end of file
+
+    if WEBHOOK_TOKEN is not None and not hmac.compare_digest(request.args.get("token", ""), WEBHOOK_TOKEN):
+        response_data["type"] = "FAIL"
+        response_data["message"] = "The webhook token is missing or incorrect"
+        response_data["message_name"] = "webhook_token_invalid"
+
+        return BuildHTTPResponse(**response_data, status_code=401)
+
+    payload = request.get_json(silent=True) or {}
+    guid = payload.get("VideoGuid")
+    status = payload.get("Status")
+    if not isinstance(guid, str) or guid == "" or not isinstance(status, int):
+        response_data["type"] = "FAIL"
+        response_data["message"] = "The body must contain \"VideoGuid\" and an integer \"Status\""
+        response_data["message_name"] = "webhook_payload_invalid"
+
+        response_data["object"] = payload
+        return BuildHTTPResponse(**response_data, status_code=400)
+
+    status_response = api_VideoHandle.process_stream_status(guid, status)
+    return BuildHTTPResponse(**status_response, route="/webhooks/stream-status", method=request.method)
+
+def ETagMatches(etag: str) -> bool:
+    '''Weak comparison of `etag` against If-None-Match, as RFC 7232 requires for GET.'''
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [x.strip().removeprefix("W/") for x in if_none_match.split(",")]
+
+@api.route("/feed", methods=["GET"])
+def feed__Retrieve():
+    format = request.args.get("format", "roku").lower()
+    if format not in FEED_FORMATS:
+        response_data = {
+            "type": "FAIL",
+            "message": f"The parameter \"format\" must be one of {list(FEED_FORMATS)}",
+            "message_name": "feed_format_invalid",
+            "route": "/feed",
+            "method": request.method,
+            "object": None
+        }
+        return BuildHTTPResponse(**response_data, status_code=400)
+
+    category = request.args.get("category") or None
+    document = api_VideoHandle.feed.document(format, category)
+
+    # Each encoding is its own representation, so it gets its own strong validator.
+    encoding = PreferredEncoding() if len(document["body"]) >= RESPONSE_COMPRESSION_MIN_BYTES else None
+    etag = document["etag"] if encoding is None else f"{document['etag'][:-1]}-{encoding}\""
+
+    resp = make_response()
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = f"public, max-age={FEED_MAX_AGE}"
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Date"] = HTTPDate()
+    if ETagMatches(etag):
+        resp.status_code = 304
+        return resp
+
+    body = document["body"]
+    if encoding is not None:
+        # Compressed once per rendered document, the dict lives exactly as long as the document does.
+        body = document["encodings"].get(encoding)
+        if body is None:
+            body = Compress(document["body"], encoding)
+            document["encodings"][encoding] = body
+        resp.headers["Content-Encoding"] = encoding
+    resp.headers["Content-Type"] = document["content_type"]
+    resp.set_data(body)
+    return resp
+
+@api.route("/metrics", methods=["GET"])
+def metrics__Export():
+    resp = make_response(REGISTRY.render())
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
+STARTUP_TIMINGS["import"] = time.perf_counter() - IMPORT_START
@@ -1,100 +1,494 @@
 import requests
-from os import environ
+from requests.adapters import HTTPAdapter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os import environ, getpid
+from threading import Lock
+
+import json
+import random
+import time
+
+from Metrics import BUNNY_REQUEST_DURATION, BUNNY_REQUEST_ERRORS, BUNNY_CIRCUIT_REJECTIONS, BUNNY_HEDGED_REQUESTS
+
+# Responses from the bunnyapi sidecar that are worth retrying on idempotent calls.
+RETRYABLE_STATUS_CODES = (502, 503, 504)
+
+# BunnyAPI method behind each sidecar route, circuit breakers and hedging are configured by method name.
+ROUTE_METHODS = {
+    "/files/upload": "file_Upload",
+    "/files/upload-stream": "file_UploadBytes",
+    "/files/list": "file_List",
+    "/files/delete": "file_Delete",
+    "/files/retrieve": "file_Retrieve",
+    "/cache/purge": "cache_Purge",
+    "/stream/create-signature": "upload_CreateSignature",
+    "/stream/create-video": "stream_CreateVideo",
+    "/stream/update-video": "stream_UpdateVideo",
+    "/stream/retrieve-video": "stream_RetrieveVideo",
+    "/stream/videos": "stream_ListVideos",
+    "/stream/delete-video": "stream_DeleteVideo"
+}
+# Defaults for every breaker, each can be overridden per method through BUNNY_BREAKER_OVERRIDES, e.g.
+#       {"stream_CreateVideo": {"slow_call_seconds": 10.0}, "file_UploadBytes": {"enabled": false}}
+BREAKER_SETTINGS = {
+    "enabled": environ.get("BUNNY_BREAKER_ENABLED", "1") == "1",
+    "window_seconds": float(environ.get("BUNNY_BREAKER_WINDOW_SECONDS", 30.0)), # Calls older than this are forgotten
+    "window_size": int(environ.get("BUNNY_BREAKER_WINDOW_SIZE", 100)), # At most this many recent calls are considered
+    "min_calls": int(environ.get("BUNNY_BREAKER_MIN_CALLS", 20)), # Calls needed in the window before it may open
+    "error_rate": float(environ.get("BUNNY_BREAKER_ERROR_RATE", 0.5)), # Share of failed calls that opens it
+    "slow_call_seconds": float(environ.get("BUNNY_BREAKER_SLOW_CALL_SECONDS", 5.0)),
+    "slow_call_rate": float(environ.get("BUNNY_BREAKER_SLOW_CALL_RATE", 0.8)), # Share of slow calls that opens it
+    "open_seconds": float(environ.get("BUNNY_BREAKER_OPEN_SECONDS", 15.0)), # Fail fast for this long before probing
+    "half_open_probes": int(environ.get("BUNNY_BREAKER_HALF_OPEN_PROBES", 3)) # Successful probes that close it again
+}
+BREAKER_OVERRIDES = json.loads(environ.get("BUNNY_BREAKER_OVERRIDES", "{}"))
+BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+def wkw(**kwargs):
+    return kwargs
+
+class RetryBudget:
+    '''Caps retries to a fraction of recent traffic so a struggling sidecar is not hit by a retry storm.
+
+    Every request deposits `ratio` tokens (up to `max_tokens`), every retry withdraws one.'''
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        '''Returns True if a retry may be attempted.'''
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    '''Fails calls to one sidecar route fast while it is erroring or slow, instead of letting workers pile up on it.
+
+    Closed, it tracks the outcome and latency of recent calls and opens once enough of them failed or were slow.
+    Open, every call is rejected until `open_seconds` have passed. Half-open, a few probe calls are let through:
+    `half_open_probes` successes close it again, any failure reopens it.
+
+    Successful call latencies are kept as well, their p95 is what hedged requests wait for.'''
+    def __init__(self, name: str, settings: dict):
+        self.name = name
+        self.settings = settings
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.probes_succeeded = 0
+        self.times_opened = 0
+        self.calls: deque = deque(maxlen=settings["window_size"]) # (monotonic time, failed, slow)
+        self.latencies: deque = deque(maxlen=200) # Seconds, successful calls only
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        '''Returns True if a call may go out. Every allowed call must be followed by `record()`.'''
+        if not self.settings["enabled"]:
+            return True
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.settings["open_seconds"]:
+                    return False
+                self.state = "half_open"
+                self.probes_in_flight = 0
+                self.probes_succeeded = 0
+            if self.state == "half_open":
+                if self.probes_in_flight + self.probes_succeeded >= self.settings["half_open_probes"]:
+                    return False
+                self.probes_in_flight += 1
+            return True
+
+    def is_open(self) -> bool:
+        '''True while calls are being rejected, without claiming a probe slot.'''
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.settings["open_seconds"]
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self.opened_at = now
+        self.times_opened += 1
+        self.calls.clear()
+
+    def record(self, failed: bool, duration: float) -> None:
+        if not self.settings["enabled"]:
+            return
+        now = time.monotonic()
+        slow = duration >= self.settings["slow_call_seconds"]
+        with self._lock:
+            if not failed:
+                self.latencies.append(duration)
+            if self.state == "half_open":
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.probes_succeeded += 1
+                    if self.probes_succeeded >= self.settings["half_open_probes"]:
+                        self.state = "closed"
+                return
+            if self.state == "open":
+                return # A call let through before it opened, its outcome is already accounted for.
+
+            self.calls.append((now, failed, slow))
+            while len(self.calls) > 0 and now - self.calls[0][0] > self.settings["window_seconds"]:
+                self.calls.popleft()
+            if len(self.calls) < self.settings["min_calls"]:
+                return
+            failures = sum(1 for x in self.calls if x[1])
+            slow_calls = sum(1 for x in self.calls if x[2])
+            if failures >= self.settings["error_rate"] * len(self.calls) or slow_calls >= self.settings["slow_call_rate"] * len(self.calls):
+                self._open(now)
+
+    def latency_percentile(self, percentile: float, min_samples: int = 20) -> None | float:
+        '''Latency of successful calls at `percentile` (0-1), or None until `min_samples` were seen.'''
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            state = self.state
+            if state == "open" and time.monotonic() - self.opened_at >= self.settings["open_seconds"]:
+                state = "half_open" # Probing starts with the next call.
+            return {
+                "state": state,
+                "enabled": self.settings["enabled"],
+                "window_calls": len(self.calls),
+                "window_failures": sum(1 for x in self.calls if x[1]),
+                "window_slow_calls": sum(1 for x in self.calls if x[2]),
+                "times_opened": self.times_opened
+            }
 
 class BunnyAPI:
-    def __init__(self):
+    # Shared by every BunnyAPI instance in the process so that connections are reused across them.
+    _session: None | requests.Session = None
+    _session_pid: None | int = None # A forked child must not reuse its parent's sockets.
+    _adapter: None | HTTPAdapter = None
+    _retry_budget: None | RetryBudget = None
+    _session_lock = Lock()
+    # Breakers are per route and shared process-wide too, every caller sees the same sidecar health.
+    _breakers: dict[str, CircuitBreaker] = {}
+    _hedge_executor: None | ThreadPoolExecutor = None
+
+    def __init__(self, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None,
+                 max_retries: int = None, retry_backoff: float = None):
         self.API_Endpoint_URL = environ["BUNNY_ENDPOINT_ADDRESS"]
+
+        self.pool_size = pool_size or int(environ.get("BUNNY_POOL_SIZE", 16))
+        self.connect_timeout = connect_timeout or float(environ.get("BUNNY_CONNECT_TIMEOUT", 3.05))
+        self.read_timeout = read_timeout or float(environ.get("BUNNY_READ_TIMEOUT", 30.0))
+        self.max_retries = max_retries if max_retries is not None else int(environ.get("BUNNY_MAX_RETRIES", 2))
+        self.retry_backoff = retry_backoff or float(environ.get("BUNNY_RETRY_BACKOFF", 0.2)) # Seconds
+
+        # Read-only methods that may send a second attempt when the first is slower than the route's p95.
+        #       Off by default, each hedge costs a retry budget token.
+        self.hedge_methods = {x.strip() for x in environ.get("BUNNY_HEDGE_METHODS", "").split(",") if x.strip() != ""}
+        self.hedge_percentile = float(environ.get("BUNNY_HEDGE_PERCENTILE", 0.95))
+        self.hedge_min_delay = float(environ.get("BUNNY_HEDGE_MIN_DELAY", 0.05)) # Seconds
+
+        self.session = self._get_shared_session(self.pool_size)
+
+    @classmethod
+    def _get_shared_session(cls, pool_size: int) -> requests.Session:
+        with cls._session_lock:
+            if cls._session is None or cls._session_pid != getpid():
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+
+                cls._adapter = adapter
+                cls._session = session
+                cls._session_pid = getpid()
+                cls._breakers = {}
+                cls._retry_budget = RetryBudget(
+                    ratio=float(environ.get("BUNNY_RETRY_BUDGET_RATIO", 0.2))
+                )
+                cls._hedge_executor = ThreadPoolExecutor(
+                    max_workers=int(environ.get("BUNNY_HEDGE_CONCURRENCY", 2 * pool_size)), thread_name_prefix="bunny_hedge"
+                )
+            return cls._session
+
+    @classmethod
+    def _breaker(cls, route: str) -> CircuitBreaker:
+        breaker = cls._breakers.get(route)
+        if breaker is not None:
+            return breaker
+        with cls._session_lock:
+            if route not in cls._breakers:
+                name = ROUTE_METHODS.get(route, route)
+                cls._breakers[route] = CircuitBreaker(name, {**BREAKER_SETTINGS, **BREAKER_OVERRIDES.get(name, {})})
+            return cls._breakers[route]
+
+    def _send(self, method: str, route: str, headers: dict, idempotent: bool = False, **kwargs) -> None | requests.Response:
+        '''Sends a request to the bunnyapi sidecar over the shared session.
+
+        Idempotent calls are retried with jittered exponential backoff while the retry budget allows it.
+        Returns None if the sidecar could not be reached, raises CircuitOpenError if the route's breaker is open.'''
+        breaker = self._breaker(route)
+        if not breaker.allow():
+            BUNNY_CIRCUIT_REJECTIONS.inc(route)
+            raise CircuitOpenError(route)
+
+        request_start = time.perf_counter()
+        try:
+            if idempotent and breaker.name in self.hedge_methods:
+                response = self._send_hedged(breaker, method, route, headers, **kwargs)
+            else:
+                response = self._send_with_retries(method, route, headers, idempotent, **kwargs)
+        except BaseException:
+            breaker.record(True, time.perf_counter() - request_start) # Hands back a half-open probe slot.
+            raise
+
+        duration = time.perf_counter() - request_start
+        failed = response is None or response.status_code >= 500
+        breaker.record(failed, duration)
+        BUNNY_REQUEST_DURATION.observe(duration, route)
+        if failed:
+            BUNNY_REQUEST_ERRORS.inc(route)
+        return response
+
+    def _send_hedged(self, breaker: CircuitBreaker, method: str, route: str, headers: dict, **kwargs) -> None | requests.Response:
+        '''Sends a read, and a second copy of it if the first has not answered within the route's p95 latency.
+
+        The first good response wins. Hedges draw on the retry budget, so they stay a small share of traffic.'''
+        p95 = breaker.latency_percentile(self.hedge_percentile)
+        if p95 is None:
+            return self._send_with_retries(method, route, headers, True, **kwargs)
+
+        attempts = [self._hedge_executor.submit(self._send_with_retries, method, route, headers, True, **kwargs)]
+        done, _ = wait(attempts, timeout=max(self.hedge_min_delay, p95))
+        if len(done) == 0 and self._retry_budget.withdraw():
+            attempts.append(self._hedge_executor.submit(self._send_with_retries, method, route, headers, True, **kwargs))
+            BUNNY_HEDGED_REQUESTS.inc(route, "sent")
+
+        response = None
+        pending = set(attempts)
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                response = attempt.result()
+                if response is not None and response.status_code < 500:
+                    if attempt is not attempts[0]:
+                        BUNNY_HEDGED_REQUESTS.inc(route, "won")
+                    return response # The slower attempt finishes in the background and is dropped.
+        return response
+
+    def _send_with_retries(self, method: str, route: str, headers: dict, idempotent: bool, **kwargs) -> None | requests.Response:
+        url = f"http://{self.API_Endpoint_URL}{route}"
+        budget = self._retry_budget
+        budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(
+                    method, url, headers=headers, timeout=(self.connect_timeout, self.read_timeout), **kwargs
+                )
+                if not (idempotent and response.status_code in RETRYABLE_STATUS_CODES):
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                response = None
+
+            if not idempotent or attempt >= self.max_retries or not budget.withdraw():
+                return response
+            # "Full jitter" backoff, keeps retries from separate workers from lining up.
+            time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+            attempt += 1
+
+    def _unreachable_response(self, route: str) -> dict:
+        return wkw(
+            type = "FAIL",
+            message = f"Could not reach the bunnyapi service at {route}.",
+            message_name = "bunny_service_unreachable",
+            object = None
+        )
+
+    def _circuit_open_response(self, route: str) -> dict:
+        return wkw(
+            type = "FAIL",
+            message = f"Calls to the bunnyapi service at {route} are failing or slow, try again later.",
+            message_name = "bunny_circuit_open",
+            object = None
+        )
+
+    def _send_json(self, method: str, route: str, headers: dict, idempotent: bool = False, **kwargs) -> dict:
+        try:
+            response = self._send(method, route, headers, idempotent=idempotent, **kwargs)
+        except CircuitOpenError:
+            return self._circuit_open_response(route)
+        if response is None:
+            return self._unreachable_response(route)
+        return response.json()
+
+    def _send_status(self, method: str, route: str, headers: dict, idempotent: bool = False, **kwargs) -> None | int:
+        '''Returns the response status code, or None if the sidecar could not be reached or the route's breaker is open.'''
+        try:
+            response = self._send(method, route, headers, idempotent=idempotent, **kwargs)
+        except CircuitOpenError:
+            return None
+        if response is None:
+            return None
+        return response.status_code
+
+    def circuit_IsOpen(self, method_name: str) -> bool:
+        '''True while calls to the BunnyAPI method `method_name` fail fast.'''
+        route = next((route for route, name in ROUTE_METHODS.items() if name == method_name), method_name)
+        return self._breaker(route).is_open()
+
+    def circuit_Stats(self) -> dict:
+        '''Breaker state and recent call counts for every route called so far, keyed by method name.'''
+        return {breaker.name: breaker.stats() for breaker in list(self._breakers.values())}
+
+    def pool_Stats(self) -> dict:
+        '''Reports how many requests were served per opened connection to the bunnyapi service.'''
+        requests_sent = 0
+        connections_opened = 0
+        idle_connections = 0
+
+        pool_manager = self._adapter.poolmanager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+            if pool.pool is not None: # urllib3 pads the idle queue with None placeholders
+                idle_connections += sum(1 for connection in list(pool.pool.queue) if connection is not None)
+
+        return {
+            "pool_size": self.pool_size,
+            "requests_sent": requests_sent,
+            "connections_opened": connections_opened,
+            "idle_connections": idle_connections,
+            "connections_reused": max(0, requests_sent - connections_opened),
+            "retry_budget_tokens": self._retry_budget.tokens
+        }
+
     def file_Upload(self, target_file_path: str, local_file_path: str):
         headers = {
             "target-file-path": target_file_path,
             "local-file-path": local_file_path
         }
-        request = requests.post(f"http://{self.API_Endpoint_URL}/files/upload", headers=headers)
+        return self._send_json("POST", "/files/upload", headers)
+
+    def file_UploadBytes(self, target_file_path: str, data):
+        '''Streams `data` (bytes or a file-like object) to `target_file_path` without touching the local disk.'''
+        headers = {
+            "target-file-path": target_file_path,
+            "Content-Type": "application/octet-stream"
+        }
+        # A file-like object is consumed by the first attempt, so only plain bytes can be retried.
+        return self._send_json("POST", "/files/upload-stream", headers, idempotent=isinstance(data, bytes), data=data)
 
-        return request.json()
-    
     def file_List(self, path: str):
         headers = {
             "path": path
         }
-        request = requests.get(f"http://{self.API_Endpoint_URL}/files/list", headers=headers)
-        requestJson = request.json()
+        requestJson = self._send_json("GET", "/files/list", headers, idempotent=True)
 
         return requestJson.get("object")
-    
+
     def file_Delete(self, target_file_path: str):
         headers = {
             "target-file-path": target_file_path
         }
-        request = requests.delete(f"http://{self.API_Endpoint_URL}/files/delete", headers=headers)
+        return self._send_status("DELETE", "/files/delete", headers, idempotent=True)
 
-        return request.status_code
-    
     def file_Retrieve(self, target_file_path: str):
         headers = {
             "target-file-path": target_file_path
         }
-        request = requests.get(f"http://{self.API_Endpoint_URL}/files/retrieve", headers=headers)
-
-        return request.status_code
+        return self._send_status("GET", "/files/retrieve", headers, idempotent=True)
 
     def cache_Purge(self, target_url: str):
         headers = {
             "target-url": target_url
         }
-        request = requests.post(f"http://{self.API_Endpoint_URL}/cache/purge", headers=headers)
+        return self._send_status("POST", "/cache/purge", headers, idempotent=True)
 
-        return request.status_code
-    
     def upload_CreateSignature(self, videoID: str):
         headers = {
             "videoID": videoID
         }
-        request = requests.get(f"http://{self.API_Endpoint_URL}/stream/create-signature", headers=headers)
-        requestJson = request.json()
+        requestJson = self._send_json("GET", "/stream/create-signature", headers, idempotent=True)
 
         return requestJson.get("object")
-        
+
     def stream_CreateVideo(self, videoTitle: str):
         headers = {
             "title": videoTitle
         }
-        request = requests.get(f"http://{self.API_Endpoint_URL}/stream/create-video", headers=headers)
-        requestJson = request.json()
+        # Not idempotent, a retry could create a second video in the Stream Library.
+        requestJson = self._send_json("GET", "/stream/create-video", headers)
 
         return requestJson.get("object")
-    
+
     def stream_UpdateVideo(self, guid: str, payload: dict):
         headers = {
             "guid": guid,
         }
-        request = requests.post(f"http://{self.API_Endpoint_URL}/stream/update-video", headers=headers, json=payload)
+        return self._send_status("POST", "/stream/update-video", headers, json=payload)
 
-        return request.status_code
-    
     def stream_RetrieveVideo(self, guid: str):
         headers = {
             "guid": guid
         }
-        request = requests.get(f"http://{self.API_Endpoint_URL}/stream/retrieve-video", headers=headers)
-        requestJson = request.json()
-
-        return requestJson
+        return self._send_json("GET", "/stream/retrieve-video", headers, idempotent=True)
 
-    def stream_ListVideos(self, libraryId: str = None):
+    def stream_ListVideos(self, libraryId: str = None, page: int = 1, itemsPerPage: int = 100):
         headers = {
-            "libraryId": libraryId
+            "libraryId": libraryId,
+            "page": str(page),
+            "itemsPerPage": str(itemsPerPage)
         }
-        request = requests.get(f"http://{self.API_Endpoint_URL}/stream/videos", headers=headers)
-        requestJson = request.json()
+        return self._send_json("GET", "/stream/videos", headers, idempotent=True)
+
+    def stream_IterateVideos(self, libraryId: str = None, itemsPerPage: int = 100):
+        '''Pages through the whole Stream Library, yielding one `stream_ListVideos` response per page.
+
+        Relies on the sidecar forwarding the `page` and `itemsPerPage` headers to Bunny and returning Bunny's
+        `currentPage`, `itemsPerPage` and `totalItems` with the page. Bunny may cap `itemsPerPage`, so the page
+        size it reports is used, and a page shorter than that is the last one. A failed page is yielded as-is
+        and ends the iteration, so callers can tell a partial listing apart. So is a page other than the one
+        asked for, i.e. a sidecar that ignores paging.'''
+        page = 1
+        while True:
+            response = self.stream_ListVideos(libraryId=libraryId, page=page, itemsPerPage=itemsPerPage)
+            page_object = response.get("object") or {}
+            if response.get("message_name") == "video_list_retrieve_success" and page_object.get("currentPage", page) != page:
+                response = wkw(
+                    type = "FAIL",
+                    message = f"The bunnyapi service returned page {page_object.get('currentPage')} when asked for page {page}.",
+                    message_name = "video_list_page_mismatch",
+                    object = None
+                )
+            yield response
+            if response.get("message_name") != "video_list_retrieve_success":
+                return
+
+            items = page_object.get("items") or []
+            page_size = page_object.get("itemsPerPage") or itemsPerPage
+            if len(items) < page_size or page * page_size >= page_object.get("totalItems", 0):
+                return
+            page += 1
 
-        return requestJson.get("object")
-    
     def stream_DeleteVideo(self, guid: str):
         headers = {
             "guid": guid
         }
-        request = requests.post(f"http://{self.API_Endpoint_URL}/stream/delete-video", headers=headers)
-        requestJson = request.json()
-
-        return requestJson
\ No newline at end of file
+        return self._send_json("POST", "/stream/delete-video", headers)
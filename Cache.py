@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from os import environ
+from threading import Lock
+
+import time
+
+class VideoObjectCache:
+    '''Bounded in-process LRU cache of `BunnyAPI.stream_RetrieveVideo` responses keyed by guid.
+
+    Entries expire based on the video's status: videos still encoding change quickly, finished ones rarely do.'''
+    def __init__(self, max_entries: int = None, ttl_encoding: float = None, ttl_finished: float = None, ttl_not_found: float = None):
+        self.max_entries = max_entries or int(environ.get("VIDEO_CACHE_MAX_ENTRIES", 10000))
+        self.ttl_encoding = ttl_encoding or float(environ.get("VIDEO_CACHE_TTL_ENCODING", 5)) # Seconds, status 0-3
+        self.ttl_finished = ttl_finished or float(environ.get("VIDEO_CACHE_TTL_FINISHED", 300)) # Seconds, status 4+
+        self.ttl_not_found = ttl_not_found or float(environ.get("VIDEO_CACHE_TTL_NOT_FOUND", 2)) # Seconds
+
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict() # guid -> (expires_at, response)
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _ttl_for(self, response: dict) -> None | float:
+        '''Returns how long `response` may be cached, or None if it must not be.'''
+        if response.get("message_name") == "video_not_found":
+            return self.ttl_not_found
+
+        video_object = response.get("object")
+        if video_object is None:
+            return None # Transport or sidecar failure, never cache those.
+        try:
+            status = int(video_object.get("status"))
+        except (TypeError, ValueError):
+            return self.ttl_encoding
+        if status in [0, 1, 2, 3]:
+            return self.ttl_encoding
+        return self.ttl_finished
+
+    def get(self, guid: str) -> None | dict:
+        '''Returns the cached response for `guid`, or None on a miss. Cached responses must be treated as read-only.'''
+        with self._lock:
+            entry = self._entries.get(guid)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, response = entry
+            if expires_at <= time.monotonic():
+                del self._entries[guid]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(guid)
+            self.hits += 1
+            return response
+
+    def put(self, guid: str, response: dict) -> None:
+        ttl = self._ttl_for(response)
+        if ttl is None:
+            return
+        with self._lock:
+            self._entries[guid] = (time.monotonic() + ttl, response)
+            self._entries.move_to_end(guid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, guid: str) -> None:
+        with self._lock:
+            if self._entries.pop(guid, None) is not None:
+                self.invalidations += 1
+
+    def observe_status(self, guid: str, status: int) -> None:
+        '''Drops the cached entry for `guid` if its status differs from a freshly observed `status`.'''
+        with self._lock:
+            entry = self._entries.get(guid)
+            if entry is None:
+                return
+            video_object = entry[1].get("object")
+            cached_status = None if video_object is None else video_object.get("status")
+            if cached_status is None or status is None or int(cached_status) != int(status):
+                del self._entries[guid]
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
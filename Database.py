@@ -1,60 +1,280 @@
 from os import path, environ
+from contextlib import contextmanager
 import time
+import uuid
+import re
 
 import psycopg2
-from threading import Thread
+import psycopg2.pool
+from threading import BoundedSemaphore, Lock
+
+from Metrics import SQL_QUERY_DURATION, SQL_QUERY_ERRORS
 
 
 HOME_DIR = path.dirname(path.realpath(__file__))
 
+QUERY_VERB_PATTERN = re.compile(r"^\s*(\w+)")
+QUERY_TABLE_PATTERN = re.compile(r'public\."?(\w+)"?')
+_query_names: dict[str, str] = {}
 
-class Database:
-    def __init__(self) -> None:
-        self.postgres_connection: None | psycopg2.extensions.connection = None
-        self._create_connection()
+def query_name(query_string) -> str:
+    '''Short metrics label for a query, e.g. "select_uploads". Cached per distinct query text.
 
-        self.connection_retry_delay: int = 5 # Seconds
-        self.connected = self._check_connection_to_postgres()
+    Composed queries (psycopg2.sql) are unhashable and don't read as SQL, their callers pass `name=` instead.'''
+    if not isinstance(query_string, str):
+        return "other"
+    name = _query_names.get(query_string)
+    if name is None:
+        verb = QUERY_VERB_PATTERN.match(query_string)
+        table = QUERY_TABLE_PATTERN.search(query_string)
+        name = "_".join(x.group(1) for x in (verb, table) if x is not None).lower() or "other"
+        if len(_query_names) < 1000:
+            _query_names[query_string] = name
+    return name
 
-        self.connection_status_poller_thread = Thread(
-            target=self._poller_target, args=(), daemon=True, name="connection_status_poller_thread"
-        ).start()
+class Database:
+    def __init__(self, min_connections: int = None, max_connections: int = None) -> None:
+        self.min_connections: int = min_connections or int(environ.get("POSTGRESDB_POOL_MIN", 1))
+        self.max_connections: int = max_connections or int(environ.get("POSTGRESDB_POOL_MAX", 10))
+        self.checkout_timeout: float = float(environ.get("POSTGRESDB_POOL_TIMEOUT", 30)) # Seconds
+        # Connections idle for longer than this are pinged before being handed out.
+        self.health_check_after: float = float(environ.get("POSTGRESDB_POOL_CHECK_IDLE", 30)) # Seconds
+        self.migration_lock_timeout: float = float(environ.get("POSTGRESDB_MIGRATION_LOCK_TIMEOUT", 5)) # Seconds
 
-    def _poller_target(self):
-        while True:
-            time.sleep(5)
-            self._poll_connection()
+        self.connection_pool: None | psycopg2.pool.ThreadedConnectionPool = None
+        # ThreadedConnectionPool raises when exhausted, the semaphore makes checkouts wait instead.
+        self._checkout_slots = BoundedSemaphore(self.max_connections)
+        self._last_used: dict[int, float] = {}
+        self._stats_lock = Lock()
+        self.connections_in_use: int = 0
+        self.connections_discarded: int = 0
 
-    def _poll_connection(self):
-        self.connected = self._check_connection_to_postgres() 
+        self._create_pool()
+        self.connected: bool = True
 
-        while not self.connected:
-            time.sleep(self.connection_retry_delay)
-            self._create_connection()
-            self.connected = self._check_connection_to_postgres() 
+    def _create_pool(self) -> None:
+        self.connection_pool = psycopg2.pool.ThreadedConnectionPool(
+            self.min_connections,
+            self.max_connections,
+            database=environ["POSTGRESDB_DATABASE"],
+            host=environ["POSTGRESDB_HOST"],
+            user=environ["POSTGRESDB_USER"],
+            password=environ["POSTGRES_PASSWORD"],
+            port=environ["POSTGRESDB_DOCKER_PORT"]
+        )
 
-    def _check_connection_to_postgres(self):
+    def _check_connection_to_postgres(self, connection: psycopg2.extensions.connection) -> bool:
         '''Returns True if the connection is active and usable. Returns False otherwise.'''
-        connection = self.postgres_connection
-        if connection.closed == 0:
-            return True
-        return False
+        if connection.closed != 0:
+            return False
+        try:
+            connection.autocommit = True # Very important for our use case!
+        except psycopg2.Error:
+            return False
+
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_after:
+            return True # Recently used, skip the round-trip.
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _checkout(self) -> psycopg2.extensions.connection:
+        # A pool of N connections can hold at most N broken ones, one extra attempt opens a fresh connection.
+        for _ in range(self.max_connections + 1):
+            try:
+                connection = self.connection_pool.getconn()
+            except psycopg2.OperationalError:
+                self.connected = False
+                raise
+            if self._check_connection_to_postgres(connection):
+                self.connected = True
+                return connection
+            self._discard(connection)
+        self.connected = False
+        raise psycopg2.OperationalError("Could not check out a healthy connection to postgres.")
+
+    def _discard(self, connection: psycopg2.extensions.connection) -> None:
+        self._last_used.pop(id(connection), None)
+        with self._stats_lock:
+            self.connections_discarded += 1
+        self.connection_pool.putconn(connection, close=True)
+
+    @contextmanager
+    def connection(self):
+        '''Checks a healthy autocommit connection out of the pool for the duration of the `with` block.'''
+        if not self._checkout_slots.acquire(timeout=self.checkout_timeout):
+            raise psycopg2.pool.PoolError("Timed out waiting for a postgres connection from the pool.")
+        try:
+            connection = self._checkout()
+        except:
+            self._checkout_slots.release()
+            raise
+
+        with self._stats_lock:
+            self.connections_in_use += 1
+        try:
+            yield connection
+        finally:
+            with self._stats_lock:
+                self.connections_in_use -= 1
+            if connection.closed != 0:
+                self._discard(connection)
+            else:
+                self._last_used[id(connection)] = time.monotonic()
+                self.connection_pool.putconn(connection)
+            self._checkout_slots.release()
+
+    @contextmanager
+    def transaction(self):
+        '''Yields a cursor whose statements are committed together when the `with` block exits, or rolled back if it raises.
+
+        Methods taking an optional `cursor` run on it, inside this transaction, when one is given, and on their own
+        pooled connection otherwise.'''
+        transaction_start = time.perf_counter()
+        with self.connection() as connection:
+            connection.autocommit = False
+            try:
+                with connection.cursor() as pg_cursor:
+                    yield pg_cursor
+                connection.commit()
+            except:
+                SQL_QUERY_ERRORS.inc("transaction")
+                if connection.closed == 0:
+                    connection.rollback()
+                raise
+            finally:
+                if connection.closed == 0:
+                    connection.autocommit = True
+                SQL_QUERY_DURATION.observe(time.perf_counter() - transaction_start, "transaction")
+
+    @contextmanager
+    def migration(self, lock_key: int):
+        '''`transaction()` for idempotent DDL. Processes booting together take turns through the advisory lock `lock_key`,
+        and waiting on any lock gives up after `migration_lock_timeout` (raising psycopg2.errors.LockNotAvailable)
+        rather than queueing every other query on the table behind the DDL's ACCESS EXCLUSIVE lock.
+
+        Callers should check the catalog first, so a schema that is already current takes no lock at all.'''
+        with self.transaction() as pg_cursor:
+            pg_cursor.execute("SELECT set_config('lock_timeout', %s, true)", (f"{int(self.migration_lock_timeout * 1000)}ms",))
+            pg_cursor.execute("SELECT pg_advisory_xact_lock(%s)", (lock_key,))
+            yield pg_cursor
+
+    def pool_Stats(self) -> dict:
+        '''Reports the configured size and current usage of the connection pool.'''
+        return {
+            "min_connections": self.min_connections,
+            "max_connections": self.max_connections,
+            "connections_in_use": self.connections_in_use,
+            "connections_discarded": self.connections_discarded,
+            "connected": self.connected
+        }
+
+    def execute_sql_query(self, query_string: str, args: tuple = None, fetch: str = None, name: str = None):
+        '''Executes the provided `query_string` on a pooled connection.
+
+        Returns the first row for `fetch="one"`, every row for `fetch="all"` and the affected row count otherwise.
+        `name` labels the query in metrics, derived from the statement when omitted.'''
+        name = name or query_name(query_string)
+        query_start = time.perf_counter()
+        try:
+            return self._execute_sql_query(query_string, args, fetch)
+        except:
+            SQL_QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            SQL_QUERY_DURATION.observe(time.perf_counter() - query_start, name)
+
+    def _execute_sql_query(self, query_string: str, args: tuple, fetch: str):
+        with self.connection() as connection:
+            with connection.cursor() as pg_cursor:
+                if args is not None:
+                    pg_cursor.execute(query_string, args)
+                else:
+                    pg_cursor.execute(query_string)
+
+                if fetch == "one":
+                    return pg_cursor.fetchone()
+                if fetch == "all":
+                    return pg_cursor.fetchall()
+                return pg_cursor.rowcount
+
+
+    def iterate_sql_query(self, query_string: str, args: tuple = None, batch_size: int = 1000, name: str = None):
+        '''Yields the rows of `query_string` from a server-side cursor, `batch_size` rows per round-trip.
+
+        Only one batch is held in memory at a time. The connection stays checked out until the generator is exhausted or closed.
+        Metrics time the round-trips only, not the caller's work between batches.'''
+        name = name or query_name(query_string)
+        query_seconds = 0.0
+        try:
+            with self.connection() as connection:
+                connection.autocommit = False # Named cursors only live inside a transaction.
+                try:
+                    with connection.cursor(name=f"iterate_{uuid.uuid4().hex}") as pg_cursor:
+                        fetch_start = time.perf_counter()
+                        pg_cursor.execute(query_string, args)
+                        query_seconds += time.perf_counter() - fetch_start
+                        while True:
+                            fetch_start = time.perf_counter()
+                            rows = pg_cursor.fetchmany(batch_size)
+                            query_seconds += time.perf_counter() - fetch_start
+                            if len(rows) == 0:
+                                break
+                            yield from rows
+                finally:
+                    if connection.closed == 0:
+                        connection.rollback()
+                        connection.autocommit = True
+        except Exception:
+            SQL_QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            SQL_QUERY_DURATION.observe(query_seconds, name)
+
+
+class AdvisoryLock:
+    '''A session-level `pg_try_advisory_lock` held on a dedicated connection, used for leader election.
+
+    The lock lives exactly as long as that connection, so if the holder dies Postgres releases it and
+    the next `try_acquire` from another process takes over.'''
+    def __init__(self, lock_key: int) -> None:
+        self.lock_key = lock_key
+        self.connection: None | psycopg2.extensions.connection = None
+        self.held: bool = False
 
     def _create_connection(self) -> None:
-        self.postgres_connection = psycopg2.connect(
+        self.connection = psycopg2.connect(
             database=environ["POSTGRESDB_DATABASE"],
             host=environ["POSTGRESDB_HOST"],
             user=environ["POSTGRESDB_USER"],
             password=environ["POSTGRES_PASSWORD"],
             port=environ["POSTGRESDB_DOCKER_PORT"]
         )
-        self.postgres_connection.set_session(autocommit=True) # Very important for our use case!
-
-    def execute_sql_query(self, query_string: str, args: tuple = None) -> psycopg2.extensions.cursor:
-        '''Returns a postgres cursor after executing the provided `query_string`.'''
-        pg_cursor = self.postgres_connection.cursor()
-        if args is not None:
-            pg_cursor.execute(query_string, args)
-        else:
-            pg_cursor.execute(query_string)
-        return pg_cursor
\ No newline at end of file
+        self.connection.set_session(autocommit=True)
+
+    def try_acquire(self) -> bool:
+        '''Returns True if this process holds the lock, taking it if it is free. Cheap to call every cycle.'''
+        try:
+            if self.connection is None or self.connection.closed != 0:
+                self.held = False
+                self._create_connection()
+            with self.connection.cursor() as pg_cursor:
+                if self.held:
+                    pg_cursor.execute("SELECT 1") # Still connected means still holding the lock.
+                else:
+                    pg_cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_key,))
+                    self.held = pg_cursor.fetchone()[0]
+        except psycopg2.Error:
+            self.release()
+        return self.held
+
+    def release(self) -> None:
+        '''Gives the lock up by closing its connection.'''
+        self.held = False
+        if self.connection is not None and self.connection.closed == 0:
+            self.connection.close()
+        self.connection = None
@@ -0,0 +1,237 @@
+from email.utils import format_datetime
+from os import environ
+from threading import RLock
+from xml.sax.saxutils import escape, quoteattr
+
+import datetime
+import hashlib
+import json
+import time
+
+from Database import Database
+from Purge import CachePurger
+
+FEED_FORMATS = ("roku", "mrss")
+FEED_CONTENT_TYPES = {
+    "roku": "application/json",
+    "mrss": "application/rss+xml; charset=utf-8"
+}
+ROKU_SHORT_FORM_MAX_LENGTH = 15 * 60 # Seconds, longer videos are listed under Roku "movies"
+
+def utc(value: datetime.datetime) -> datetime.datetime:
+    return value.astimezone(datetime.timezone.utc)
+
+def roku_item(video_id: str, metadata: dict, date_created: datetime.datetime) -> tuple:
+    '''Returns `(section, item)`, a Roku Direct Publisher entry for one Public."Videos" row.'''
+    feed_tags = metadata.get("feedTags") or {}
+    height = int(feed_tags.get("height") or 0)
+    length = int(feed_tags.get("length") or 0)
+    description = feed_tags.get("description") or metadata.get("description") or feed_tags.get("title") or ""
+    item = {
+        "id": video_id,
+        "title": feed_tags.get("title") or metadata.get("title"),
+        "shortDescription": description[:200],
+        "thumbnail": feed_tags.get("poster") or metadata.get("thumbnail_url"),
+        "releaseDate": utc(date_created).strftime("%Y-%m-%d"),
+        "tags": [metadata["category"]] if metadata.get("category") else [],
+        "content": {
+            "dateAdded": utc(date_created).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "duration": length,
+            "videos": [
+                {
+                    "url": feed_tags.get("url") or metadata.get("stream_url"),
+                    "quality": "FHD" if height >= 1080 else "HD" if height >= 720 else "SD",
+                    "videoType": "HLS"
+                }
+            ]
+        }
+    }
+    return ("movies" if length > ROKU_SHORT_FORM_MAX_LENGTH else "shortFormVideos"), item
+
+def mrss_item(video_id: str, metadata: dict, date_created: datetime.datetime) -> str:
+    '''Returns the Media RSS `<item>` for one Public."Videos" row.'''
+    feed_tags = metadata.get("feedTags") or {}
+    title = escape(str(feed_tags.get("title") or metadata.get("title") or ""))
+    description = escape(str(feed_tags.get("description") or metadata.get("description") or ""))
+    media_attributes = " ".join(
+        f"{name}={quoteattr(str(value))}"
+        for name, value in (
+            ("url", feed_tags.get("url") or metadata.get("stream_url") or ""),
+            ("type", "application/x-mpegURL"),
+            ("medium", "video"),
+            ("duration", feed_tags.get("length")),
+            ("width", feed_tags.get("width")),
+            ("height", feed_tags.get("height")),
+            ("framerate", feed_tags.get("framerate"))
+        )
+        if value is not None
+    )
+    thumbnail = quoteattr(str(feed_tags.get("poster") or metadata.get("thumbnail_url") or ""))
+    category = f"<category>{escape(str(metadata['category']))}</category>" if metadata.get("category") else ""
+    return (
+        f"<item><guid isPermaLink=\"false\">{escape(video_id)}</guid><title>{title}</title>"
+        f"<description>{description}</description><pubDate>{format_datetime(utc(date_created), usegmt=True)}</pubDate>{category}"
+        f"<media:content {media_attributes}><media:title>{title}</media:title><media:description>{description}</media:description>"
+        f"<media:thumbnail url={thumbnail}/></media:content></item>"
+    )
+
+class VideoFeed:
+    '''The Public."Videos" catalog as a Roku JSON / Media RSS feed, materialized once and patched as videos come and go.
+
+    Each video is serialized once when it enters the feed, so a render only sorts and concatenates items.
+    Rendered documents are cached per format and category until the next change. Other workers' writes are
+    picked up by comparing the row count and latest `date_modified` with Postgres every FEED_FRESHNESS_INTERVAL.
+
+    When the feed is served through a CDN, its public URLs (FEED_PUBLIC_URLS, comma separated) are purged
+    whenever this process changes the catalog.'''
+    def __init__(self, database: Database, purger: CachePurger = None):
+        self.database = database
+        self.purger = purger
+
+        self.FEED_TITLE = environ.get("FEED_TITLE", "OpenBroadcast")
+        self.FEED_LINK = environ.get("FEED_LINK", "https://openbroadcast.tv")
+        self.FEED_DESCRIPTION = environ.get("FEED_DESCRIPTION", "Videos published on OpenBroadcast.")
+        self.FEED_LANGUAGE = environ.get("FEED_LANGUAGE", "en-us")
+        self.FEED_FRESHNESS_INTERVAL = float(environ.get("FEED_FRESHNESS_INTERVAL", 5.0)) # Seconds
+        self.FEED_MAX_RENDERED = int(environ.get("FEED_MAX_RENDERED", 64)) # Cached (format, category) documents
+        self.FEED_PUBLIC_URLS = [x.strip() for x in environ.get("FEED_PUBLIC_URLS", "").split(",") if x.strip() != ""]
+
+        # video_id -> {"category", "date_created", "date_modified", "roku_section", "roku", "mrss"}
+        self.entries: dict[str, dict] = {}
+        self.materialized = False
+        self.last_freshness_check = 0.0
+        self.rendered: dict[tuple, dict] = {} # (format, category) -> {"body", "etag", "content_type", "encodings"}
+        self.lock = RLock()
+
+    def _entry(self, video_id: str, metadata: dict, date_created: datetime.datetime, date_modified: datetime.datetime) -> dict:
+        roku_section, roku = roku_item(video_id, metadata, date_created)
+        category = metadata.get("category")
+        return {
+            "category": None if category is None else str(category).lower(),
+            "date_created": date_created,
+            "date_modified": date_modified,
+            "roku_section": roku_section,
+            "roku": json.dumps(roku, separators=(",", ":"), default=str),
+            "mrss": mrss_item(video_id, metadata, date_created)
+        }
+
+    def _changed(self) -> None:
+        self.rendered = {}
+
+    def _purge_public(self) -> None:
+        '''Queues the CDN copies of the feed for purging, the purger coalesces bursts of changes into one purge.'''
+        if self.purger is not None and len(self.FEED_PUBLIC_URLS) > 0:
+            self.purger.enqueue_many(self.FEED_PUBLIC_URLS)
+
+    def materialize(self) -> None:
+        '''(Re)builds every entry from Public."Videos".'''
+        sql_query = f"""
+        SELECT video_id, video_metadata, date_created, date_modified FROM public."Videos"
+        """
+        with self.lock:
+            self.entries = {
+                video_id: self._entry(video_id, video_metadata or {}, date_created, date_modified)
+                for video_id, video_metadata, date_created, date_modified in self.database.iterate_sql_query(sql_query)
+            }
+            self.materialized = True
+            self.last_freshness_check = time.monotonic()
+            self._changed()
+
+    def upsert_many(self, videos: list) -> None:
+        '''Adds or replaces `(video_id, video_metadata, date_created, date_modified)` rows that were just committed.'''
+        if len(videos) == 0:
+            return
+        self._purge_public() # Even when not materialized here, the CDN may hold another worker's render.
+        with self.lock:
+            if not self.materialized:
+                return # The first request reads them from Postgres anyway.
+            for video_id, video_metadata, date_created, date_modified in videos:
+                self.entries[video_id] = self._entry(video_id, video_metadata or {}, date_created, date_modified)
+            self._changed()
+
+    def remove_many(self, video_ids: list) -> None:
+        if len(video_ids) == 0:
+            return
+        self._purge_public()
+        with self.lock:
+            removed = [self.entries.pop(video_id) for video_id in video_ids if video_id in self.entries]
+            if len(removed) > 0:
+                self._changed()
+
+    def fingerprint(self) -> tuple:
+        '''`(count, latest date_modified)` of the local entries, comparable with the same figures from Postgres.'''
+        with self.lock:
+            return (len(self.entries), max((x["date_modified"] for x in self.entries.values()), default=None))
+
+    def ensure_fresh(self) -> None:
+        '''Materializes the feed on first use, and again whenever another worker changed the catalog.'''
+        if not self.materialized:
+            with self.lock: # Concurrent first requests wait for a single load.
+                if not self.materialized:
+                    self.materialize()
+            return
+        if time.monotonic() - self.last_freshness_check < self.FEED_FRESHNESS_INTERVAL:
+            return
+        self.last_freshness_check = time.monotonic()
+
+        sql_query = f"""
+        SELECT count(*), max(date_modified) FROM public."Videos"
+        """
+        remote_fingerprint = tuple(self.database.execute_sql_query(sql_query, fetch="one", name="select_videos_fingerprint"))
+        if remote_fingerprint != self.fingerprint():
+            self.materialize()
+
+    def document(self, format: str, category: str = None) -> dict:
+        '''Returns the rendered feed for `format` ("roku" or "mrss"), optionally limited to one `category`.
+
+        The result holds `body` (bytes), a strong `etag`, `content_type` and an `encodings` dict callers may
+        use to keep compressed variants of this exact body.'''
+        self.ensure_fresh()
+        key = (format, None if category is None else category.lower())
+        with self.lock:
+            rendered = self.rendered.get(key)
+            if rendered is not None:
+                return rendered
+
+            entries = [x for x in self.entries.items() if key[1] is None or x[1]["category"] == key[1]]
+            entries.sort(key=lambda x: (x[1]["date_created"], x[0]), reverse=True) # Newest first
+            # Derived from the rows rather than the clock, so every worker renders (and tags) identical bytes.
+            last_updated = utc(max((x[1]["date_modified"] for x in entries), default=datetime.datetime.fromtimestamp(0, datetime.timezone.utc)))
+            if format == "roku":
+                body = self._render_roku([x[1] for x in entries], last_updated)
+            else:
+                body = self._render_mrss([x[1] for x in entries], last_updated)
+
+            rendered = {
+                "body": body,
+                "etag": f"\"{hashlib.sha256(body).hexdigest()[:32]}\"",
+                "content_type": FEED_CONTENT_TYPES[format],
+                "encodings": {}
+            }
+            if len(self.rendered) >= self.FEED_MAX_RENDERED: # Categories come from the query string, keep this bounded.
+                self.rendered = {}
+            self.rendered[key] = rendered
+            return rendered
+
+    def _render_roku(self, entries: list, last_updated: datetime.datetime) -> bytes:
+        header = json.dumps({
+            "providerName": self.FEED_TITLE,
+            "language": self.FEED_LANGUAGE,
+            "lastUpdated": last_updated.strftime("%Y-%m-%dT%H:%M:%SZ")
+        }, separators=(",", ":"))
+        sections = []
+        for section in ("movies", "shortFormVideos"):
+            items = ",".join(x["roku"] for x in entries if x["roku_section"] == section)
+            sections.append(f"\"{section}\":[{items}]")
+        return (header[:-1] + "," + ",".join(sections) + "}").encode()
+
+    def _render_mrss(self, entries: list, last_updated: datetime.datetime) -> bytes:
+        return (
+            "<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+            "<rss version=\"2.0\" xmlns:media=\"http://search.yahoo.com/mrss/\"><channel>"
+            f"<title>{escape(self.FEED_TITLE)}</title><link>{escape(self.FEED_LINK)}</link>"
+            f"<description>{escape(self.FEED_DESCRIPTION)}</description><language>{escape(self.FEED_LANGUAGE)}</language>"
+            f"<lastBuildDate>{format_datetime(last_updated, usegmt=True)}</lastBuildDate>"
+            + "".join(x["mrss"] for x in entries)
+            + "</channel></rss>"
+        ).encode()
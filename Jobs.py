@@ -0,0 +1,279 @@
+from os import environ
+from threading import Thread, Event, Lock
+
+import argparse
+import json
+import random
+import time
+
+import psycopg2
+import psycopg2.extras as psycopg2_extras
+
+from Database import Database
+from Metrics import REGISTRY, Counter
+
+JOBS_SCHEMA_LOCK_KEY = 7277265003 # Database.migration() lock key for JobQueue.ensure_schema()
+
+JOBS_PROCESSED = REGISTRY.register(Counter(
+    "jobs_processed_total", "Durable jobs run, by kind and outcome (done, retry, dead).", ("kind", "outcome")
+))
+
+class JobQueue:
+    '''Durable queue of deferred side effects in Public."Jobs", safe to work from any number of processes.
+
+    Workers claim due jobs in batches with `FOR UPDATE SKIP LOCKED` and lease them for JOBS_LEASE_SECONDS by
+    moving their `run_at`, so no transaction stays open while handlers call out and a worker dying mid-batch
+    hands its jobs back when the lease runs out. Failed jobs are retried with
+    exponential backoff and moved to the `dead` state after `max_attempts`. A `dedup_key` allows a single
+    pending job per key, e.g. one pending delete per guid.'''
+    def __init__(self, database: Database):
+        self.database = database
+
+        self.JOBS_BATCH_SIZE = int(environ.get("JOBS_BATCH_SIZE", 20))
+        self.JOBS_MAX_ATTEMPTS = int(environ.get("JOBS_MAX_ATTEMPTS", 10))
+        self.JOBS_RETRY_BASE_DELAY = float(environ.get("JOBS_RETRY_BASE_DELAY", 5.0)) # Seconds
+        self.JOBS_RETRY_MAX_DELAY = float(environ.get("JOBS_RETRY_MAX_DELAY", 1800.0)) # Seconds
+        self.JOBS_POLL_INTERVAL = float(environ.get("JOBS_POLL_INTERVAL", 2.0)) # Seconds between claims when idle
+        self.JOBS_LEASE_SECONDS = float(environ.get("JOBS_LEASE_SECONDS", 300.0)) # Must outlast a batch's handlers
+
+        self.handlers: dict[str, object] = {} # kind -> callable(payload) returning (done, error)
+        self.wakeup = Event()
+        self.stopping = Event()
+        self.worker_threads: list[Thread] = []
+        self.stats_lock = Lock()
+        self.stats = {"done": 0, "retry": 0, "dead": 0}
+
+        self.ensure_schema()
+
+    def ensure_schema(self) -> None:
+        '''Creates Public."Jobs" and its indexes if they are missing.'''
+        sql_query = f"""
+        SELECT to_regclass('public."Jobs"') IS NOT NULL
+            AND to_regclass('public."Jobs_dedup_key_pending_idx"') IS NOT NULL
+            AND to_regclass('public."Jobs_run_at_pending_idx"') IS NOT NULL
+        """
+        if self.database.execute_sql_query(sql_query, fetch="one", name="select_jobs_schema")[0]:
+            return
+
+        sql_query = f"""
+        CREATE TABLE IF NOT EXISTS public."Jobs" (
+            job_id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            dedup_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_error TEXT,
+            date_created TIMESTAMPTZ NOT NULL DEFAULT now(),
+            date_modified TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS "Jobs_dedup_key_pending_idx" ON public."Jobs" (dedup_key) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS "Jobs_run_at_pending_idx" ON public."Jobs" (run_at) WHERE status = 'pending';
+        """
+        with self.database.migration(JOBS_SCHEMA_LOCK_KEY) as cursor:
+            cursor.execute(sql_query)
+
+    def register(self, kind: str, handler) -> None:
+        '''`handler(payload)` returns `(done, error)`: done=True completes the job, otherwise `error` is recorded and it is retried.'''
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind: str, payload: dict, dedup_key: str = None, delay: float = 0.0, cursor: psycopg2.extensions.cursor = None) -> None | int:
+        '''Queues one job. Returns its job_id, or None if a pending job with the same `dedup_key` already exists.'''
+        job_ids = self.enqueue_many(kind, [(payload, dedup_key)], delay=delay, cursor=cursor)
+        return job_ids[0] if len(job_ids) > 0 else None
+
+    def enqueue_many(self, kind: str, jobs: list, delay: float = 0.0, cursor: psycopg2.extensions.cursor = None) -> list:
+        '''Queues `(payload, dedup_key)` pairs in one statement. Returns the ids of the jobs created, duplicates are skipped.'''
+        if len(jobs) == 0:
+            return []
+        if cursor is None:
+            with self.database.transaction() as cursor:
+                job_ids = self.enqueue_many(kind, jobs, delay=delay, cursor=cursor)
+            self.wakeup.set()
+            return job_ids
+
+        rows = {} # Collapses duplicate keys within the batch, ON CONFLICT can't touch a row twice.
+        for index, (payload, dedup_key) in enumerate(jobs):
+            rows[dedup_key if dedup_key is not None else ("", index)] = (kind, json.dumps(payload), dedup_key, self.JOBS_MAX_ATTEMPTS, time.time() + delay)
+        sql_query = f"""
+        INSERT INTO public."Jobs" (kind, payload, dedup_key, max_attempts, run_at)
+        VALUES %s
+        ON CONFLICT (dedup_key) WHERE status = 'pending' DO NOTHING
+        RETURNING job_id
+        """
+        inserted = psycopg2_extras.execute_values(
+            cursor, sql_query, list(rows.values()), template="(%s, %s, %s, %s, to_timestamp(%s))", page_size=len(rows), fetch=True
+        )
+        return [row[0] for row in inserted]
+
+    def retry_delay(self, attempts: int) -> float:
+        '''Jittered exponential backoff before the next attempt of a job that has failed `attempts` times.'''
+        return random.uniform(0.5, 1.0) * min(self.JOBS_RETRY_MAX_DELAY, self.JOBS_RETRY_BASE_DELAY * (2 ** min(attempts - 1, 20)))
+
+    def run_handler(self, kind: str, payload: dict) -> tuple:
+        handler = self.handlers.get(kind)
+        if handler is None:
+            return False, f"No handler registered for job kind `{kind}`."
+        try:
+            return handler(payload)
+        except Exception as error:
+            return False, f"{type(error).__name__}: {error}"
+
+    def claim_and_run(self, batch_size: int = None) -> int:
+        '''Leases up to `batch_size` due jobs, runs them outside any transaction and then records the outcomes.
+
+        The attempt is counted when the job is leased, so a job whose worker keeps dying still ends up dead.
+        Returns the number of jobs claimed.'''
+        sql_query = f"""
+        UPDATE public."Jobs" SET run_at = now() + make_interval(secs => %s), attempts = attempts + 1, date_modified = now()
+        WHERE job_id IN (
+            SELECT job_id FROM public."Jobs"
+            WHERE status = 'pending' AND run_at <= now()
+            ORDER BY run_at ASC LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING job_id, kind, payload, attempts, max_attempts
+        """ # Jobs claimed by other workers are skipped, not waited on.
+        jobs = self.database.execute_sql_query(sql_query, args=(self.JOBS_LEASE_SECONDS, batch_size or self.JOBS_BATCH_SIZE), fetch="all", name="lease_jobs")
+        if len(jobs) == 0:
+            return 0
+
+        done_ids = []
+        failures = [] # (job_id, run_at, error, dead)
+        for job_id, kind, payload, attempts, max_attempts in jobs:
+            done, error = self.run_handler(kind, payload)
+            if done:
+                done_ids.append(job_id)
+                outcome = "done"
+            else:
+                dead = attempts >= max_attempts
+                failures.append((job_id, time.time() + self.retry_delay(attempts), str(error)[:1000], dead))
+                outcome = "dead" if dead else "retry"
+            JOBS_PROCESSED.inc(kind, outcome)
+            with self.stats_lock:
+                self.stats[outcome] += 1
+
+        with self.database.transaction() as cursor:
+            if len(done_ids) > 0:
+                sql_query = f"""
+                DELETE FROM public."Jobs" WHERE job_id = ANY(%s)
+                """
+                cursor.execute(sql_query, (done_ids,))
+            if len(failures) > 0:
+                sql_query = f"""
+                UPDATE public."Jobs" AS jobs
+                SET run_at = failures.run_at, last_error = failures.last_error,
+                    status = CASE WHEN failures.dead THEN 'dead' ELSE 'pending' END, date_modified = now()
+                FROM (VALUES %s) AS failures (job_id, run_at, last_error, dead)
+                WHERE jobs.job_id = failures.job_id
+                """
+                psycopg2_extras.execute_values(
+                    cursor, sql_query, failures, template="(%s::bigint, to_timestamp(%s), %s, %s::boolean)", page_size=len(failures)
+                )
+        return len(jobs)
+
+    def requeue_dead(self, kind: str = None) -> int:
+        '''Gives dead jobs (of one `kind`, or all) a fresh set of attempts. Returns the number requeued.
+
+        Only the newest dead job per dedup key is requeued, and none where that key already has a pending job.'''
+        sql_query = f"""
+        UPDATE public."Jobs" AS jobs SET status = 'pending', attempts = 0, run_at = now(), date_modified = now()
+        WHERE jobs.job_id IN (
+            SELECT job_id FROM public."Jobs" WHERE status = 'dead' AND (%s::text IS NULL OR kind = %s) AND dedup_key IS NULL
+            UNION ALL
+            SELECT * FROM (
+                SELECT DISTINCT ON (dedup_key) job_id FROM public."Jobs" AS dead
+                WHERE status = 'dead' AND (%s::text IS NULL OR kind = %s) AND dedup_key IS NOT NULL
+                    AND NOT EXISTS (
+                        SELECT 1 FROM public."Jobs" AS pending WHERE pending.dedup_key = dead.dedup_key AND pending.status = 'pending'
+                    )
+                ORDER BY dedup_key, job_id DESC
+            ) AS newest_dead
+        )
+        """ # Several dead jobs can share a key, requeuing two of them would break the pending dedup index.
+        requeued = self.database.execute_sql_query(sql_query, args=(kind, kind, kind, kind))
+        self.wakeup.set()
+        return requeued
+
+    def counts(self) -> dict:
+        '''Number of jobs per `(kind, status)`.'''
+        sql_query = f"""
+        SELECT kind, status, count(*) FROM public."Jobs" GROUP BY kind, status
+        """
+        return {(kind, status): count for kind, status, count in self.database.execute_sql_query(sql_query, fetch="all")}
+
+    def work(self) -> None:
+        '''Worker loop: drains due jobs batch after batch, then waits for new ones.'''
+        while not self.stopping.is_set():
+            try:
+                claimed = self.claim_and_run()
+            except psycopg2.Error:
+                claimed = 0 # Postgres is unreachable, try again after the poll interval.
+            if claimed == 0:
+                self.wakeup.wait(self.JOBS_POLL_INTERVAL * random.uniform(0.8, 1.2))
+                self.wakeup.clear()
+
+    def start(self, workers: int) -> None:
+        for index in range(workers):
+            worker_thread = Thread(target=self.work, name=f"job_worker_{index}", daemon=True)
+            worker_thread.start()
+            self.worker_threads.append(worker_thread)
+
+    def stop(self, timeout: float = None) -> None:
+        self.stopping.set()
+        self.wakeup.set()
+        for worker_thread in self.worker_threads:
+            worker_thread.join(timeout)
+
+def bunny_handlers(bunny) -> dict:
+    '''Job handlers for deferred bunnyapi side effects, keyed by job kind.'''
+    def stream_delete_video(payload: dict) -> tuple:
+        response = bunny.stream_DeleteVideo(payload["guid"])
+        if response.get("type") == "SUCCESS" or response.get("message_name") == "video_not_found":
+            return True, None
+        return False, response.get("message_name") or response.get("message")
+
+    def cache_purge(payload: dict) -> tuple:
+        status_code = bunny.cache_Purge(payload["url"])
+        if status_code is not None and 200 <= status_code < 300:
+            return True, None
+        return False, f"cache_Purge returned {status_code}"
+
+    def file_delete(payload: dict) -> tuple:
+        status_code = bunny.file_Delete(payload["target_file_path"])
+        if status_code is not None and (200 <= status_code < 300 or status_code == 404):
+            return True, None # Already gone counts as deleted.
+        return False, f"file_Delete returned {status_code}"
+
+    return {
+        "stream_delete_video": stream_delete_video,
+        "cache_purge": cache_purge,
+        "file_delete": file_delete
+    }
+
+def main():
+    '''Runs job workers on their own, apart from the API process (set JOBS_WORKERS=0 there).'''
+    from Bunny import BunnyAPI
+
+    parser = argparse.ArgumentParser(description="Work the durable job queue in Public.\"Jobs\".")
+    parser.add_argument("--workers", type=int, default=int(environ.get("JOBS_WORKERS", 4)))
+    parser.add_argument("--requeue-dead", action="store_true", help="Requeue dead jobs, then exit")
+    args = parser.parse_args()
+
+    job_queue = JobQueue(Database(max_connections=args.workers + 1))
+    if args.requeue_dead:
+        print(f"Requeued {job_queue.requeue_dead()} dead job(s).")
+        return
+    for kind, handler in bunny_handlers(BunnyAPI()).items():
+        job_queue.register(kind, handler)
+    job_queue.start(args.workers)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_queue.stop(timeout=30)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+from bisect import bisect_left
+from os import environ, getpid
+from threading import Thread, Lock
+
+import atexit
+import json
+import math
+import os
+import time
+
+# Seconds, covers fast SQL lookups up to slow Bunny calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra != "":
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def add_pid_label(labels: str, pid: int) -> str:
+    if labels == "":
+        return f'{{pid="{pid}"}}'
+    return f'{labels[:-1]},pid="{pid}"}}'
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class Counter:
+    '''Monotonic counter, one series per combination of label values.'''
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, format_labels(self.label_names, labels), value) for labels, value in self._values.items()]
+
+class Histogram:
+    '''Cumulative-bucket histogram, observing is a bisect and three additions under a lock.'''
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series: dict[tuple, list] = {} # labels -> [bucket counts..., sum, count]
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0, 0]
+                self._series[label_values] = series
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> list:
+        with self._lock:
+            series_copy = {labels: list(series) for labels, series in self._series.items()}
+
+        samples = []
+        for labels, series in series_copy.items():
+            cumulative = 0
+            for bucket, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", format_labels(self.label_names, labels, f'le="{format_value(bucket)}"'), cumulative))
+            samples.append((f"{self.name}_sum", format_labels(self.label_names, labels), series[-2]))
+            samples.append((f"{self.name}_count", format_labels(self.label_names, labels), series[-1]))
+        return samples
+
+class Gauge:
+    '''Value read at scrape time from `callback`, which returns a number or a {label values: number} dict.
+
+    Nothing is computed on the hot path. With METRICS_MULTIPROC_DIR set, a `per_process` gauge is exported by
+    every process with a `pid` label, any other (e.g. read from Postgres) only by the process being scraped.'''
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback, label_names: tuple = (), per_process: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.callback = callback
+        self.per_process = per_process
+
+    def samples(self) -> list:
+        try:
+            values = self.callback()
+        except Exception: # A failing gauge must not take the whole scrape down.
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, format_labels(self.label_names, labels), value) for labels, value in values.items()]
+
+class Registry:
+    '''Metrics of this process. Under a multi-process server set METRICS_MULTIPROC_DIR to a directory shared by its
+    processes (gunicorn.conf.py does), then each one snapshots its metrics there and any of them renders all of them:
+    counters and histograms summed, including processes that have exited, and per-process gauges labelled by `pid`.'''
+    def __init__(self):
+        self.metrics: dict[str, object] = {}
+        self._lock = Lock()
+        self.exporter_pid: None | int = None
+
+    @property
+    def multiproc_dir(self) -> str:
+        # Read on use, gunicorn.conf.py may set it after this module was imported.
+        return environ.get("METRICS_MULTIPROC_DIR", "")
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def collect(self, shared_only: bool = False) -> dict:
+        '''Returns {metric name: samples}. `shared_only` leaves out the gauges only the scraped process exports.'''
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name: metric.samples() for metric in metrics
+            if not (shared_only and metric.type == "gauge" and not metric.per_process)
+        }
+
+    def dump(self) -> None:
+        '''Snapshots this process's metrics to METRICS_MULTIPROC_DIR/{pid}.json.'''
+        if self.multiproc_dir == "":
+            return
+        snapshot_path = os.path.join(self.multiproc_dir, f"{getpid()}.json")
+        with open(snapshot_path + ".tmp", "w") as snapshot_file:
+            json.dump(self.collect(shared_only=True), snapshot_file)
+        os.replace(snapshot_path + ".tmp", snapshot_path) # Readers never see a partial snapshot.
+
+    def start_exporter(self) -> None:
+        '''Snapshots this process's metrics every METRICS_EXPORT_INTERVAL seconds (5) and once more at exit.
+
+        Other processes' metrics in a scrape are at most that old. No-op without METRICS_MULTIPROC_DIR.'''
+        if self.multiproc_dir == "" or self.exporter_pid == getpid():
+            return
+        self.exporter_pid = getpid()
+        interval = float(environ.get("METRICS_EXPORT_INTERVAL", 5.0))
+        atexit.register(self.dump)
+        Thread(target=self.export_forever, args=(interval,), name="metrics_exporter", daemon=True).start()
+
+    def export_forever(self, interval: float) -> None:
+        while True:
+            try:
+                self.dump()
+            except Exception: # e.g. the directory was removed, metrics must not take the process down.
+                pass
+            time.sleep(interval)
+
+    def snapshots(self) -> dict:
+        '''Returns {pid: collected metrics} of every other process that left a snapshot.'''
+        snapshots = {}
+        for file_name in os.listdir(self.multiproc_dir):
+            pid, extension = os.path.splitext(file_name)
+            if extension != ".json" or not (pid.isascii() and pid.isdigit()) or int(pid) == getpid():
+                continue
+            try:
+                with open(os.path.join(self.multiproc_dir, file_name)) as snapshot_file:
+                    snapshots[int(pid)] = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        '''Renders every metric in the Prometheus text exposition format (version 0.0.4).'''
+        with self._lock:
+            metrics = list(self.metrics.values())
+        collected = {getpid(): self.collect()}
+        live_pids = {getpid()}
+        if self.multiproc_dir != "":
+            collected.update(self.snapshots())
+            live_pids.update(pid for pid in collected if pid_alive(pid))
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            merged: dict[tuple, float] = {}
+            for pid, process_metrics in collected.items():
+                for name, labels, value in process_metrics.get(metric.name, []):
+                    if metric.type == "gauge" and self.multiproc_dir != "":
+                        if pid not in live_pids:
+                            continue # A gauge of an exited process is stale, unlike its counts.
+                        if metric.per_process:
+                            labels = add_pid_label(labels, pid)
+                    merged[(name, labels)] = merged.get((name, labels), 0.0) + value
+            for (name, labels), value in merged.items():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Flask route latency.", ("route", "method", "status")
+))
+HTTP_REQUEST_ERRORS = REGISTRY.register(Counter(
+    "http_request_errors_total", "Flask requests answered with a 5xx or an unhandled exception.", ("route", "method")
+))
+BUNNY_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "bunny_request_duration_seconds", "bunnyapi sidecar call latency, retries included.", ("endpoint",)
+))
+BUNNY_REQUEST_ERRORS = REGISTRY.register(Counter(
+    "bunny_request_errors_total", "bunnyapi sidecar calls that failed to connect or returned a 5xx.", ("endpoint",)
+))
+BUNNY_CIRCUIT_REJECTIONS = REGISTRY.register(Counter(
+    "bunny_circuit_rejections_total", "bunnyapi calls failed fast because their circuit breaker was open.", ("endpoint",)
+))
+BUNNY_HEDGED_REQUESTS = REGISTRY.register(Counter(
+    "bunny_hedged_requests_total", "Hedged bunnyapi attempts, by outcome (sent, won).", ("endpoint", "outcome")
+))
+SQL_QUERY_DURATION = REGISTRY.register(Histogram(
+    "sql_query_duration_seconds", "Postgres query latency, connection checkout included.", ("query",)
+))
+SQL_QUERY_ERRORS = REGISTRY.register(Counter(
+    "sql_query_errors_total", "Postgres queries that raised.", ("query",)
+))
+POLLER_CYCLE_DURATION = REGISTRY.register(Histogram(
+    "poller_cycle_duration_seconds", "Time taken by one upload poller cycle.",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+))
+POLLER_CYCLE_UPLOADS = REGISTRY.register(Counter(
+    "poller_uploads_processed_total", "Uploads processed by the upload poller."
+))
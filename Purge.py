@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from threading import Thread, Lock, Event
+
+import time
+
+from Bunny import BunnyAPI
+from Jobs import JobQueue
+from Metrics import REGISTRY, Counter, Histogram
+
+CACHE_PURGE_DURATION = REGISTRY.register(Histogram(
+    "cache_purge_duration_seconds", "bunnyapi cache_Purge call latency."
+))
+CACHE_PURGE_DELAY = REGISTRY.register(Histogram(
+    "cache_purge_delay_seconds", "Time from a URL being queued for purging to its purge completing.",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+))
+CACHE_PURGES = REGISTRY.register(Counter(
+    "cache_purges_total", "URLs handled by the purge pipeline, by outcome (purged, coalesced, deferred).", ("outcome",)
+))
+
+class CachePurger:
+    '''Coalesces CDN cache purges and sends them in rate-limited batches.
+
+    A queued URL waits PURGE_DEBOUNCE_SECONDS, during which queuing it again is free. Due URLs are then
+    flushed oldest first, PURGE_BATCH_SIZE at a time and never faster than PURGE_RATE_LIMIT per second.
+    Purges the sidecar refuses, or that overflow the queue, move to the durable job queue.'''
+    def __init__(self, bunny: BunnyAPI, jobs: JobQueue):
+        self.bunny = bunny
+        self.jobs = jobs
+
+        self.PULL_ZONE_ROOT = environ.get("BUNNY_PULL_ZONE_ROOT", "")
+        self.PURGE_DEBOUNCE_SECONDS = float(environ.get("PURGE_DEBOUNCE_SECONDS", 2.0))
+        self.PURGE_BATCH_SIZE = int(environ.get("PURGE_BATCH_SIZE", 50))
+        self.PURGE_RATE_LIMIT = float(environ.get("PURGE_RATE_LIMIT", 20.0)) # Purges per second
+        self.PURGE_MAX_PENDING = int(environ.get("PURGE_MAX_PENDING", 10000))
+
+        self.pending: OrderedDict[str, float] = OrderedDict() # url -> monotonic time first queued, oldest first
+        self.pending_lock = Lock()
+        self.wakeup = Event()
+        self.tokens = float(self.PURGE_BATCH_SIZE)
+        self.tokens_updated = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=int(environ.get("PURGE_CONCURRENCY", 4)), thread_name_prefix="cache_purge")
+
+        self.flusher_thread = None # Started by the first enqueue, processes that never purge don't run one.
+
+    def url_for(self, target_file_path: str) -> str:
+        '''CDN URL of a storage path, e.g. thumbnails/{id}.png -> {PULL_ZONE_ROOT}/thumbnails/{id}.png.'''
+        if target_file_path.startswith(("http://", "https://")):
+            return target_file_path
+        return f"{self.PULL_ZONE_ROOT}/{target_file_path.lstrip('/')}"
+
+    def enqueue_many(self, urls: list) -> None:
+        '''Queues `urls` for purging. URLs already waiting are coalesced into their pending purge.'''
+        overflow = []
+        now = time.monotonic()
+        with self.pending_lock:
+            if self.flusher_thread is None:
+                self.flusher_thread = Thread(target=self.flush_forever, args=(), name="cache_purge_flusher", daemon=True)
+                self.flusher_thread.start()
+            for url in urls:
+                if url in self.pending:
+                    CACHE_PURGES.inc("coalesced")
+                elif len(self.pending) >= self.PURGE_MAX_PENDING:
+                    overflow.append(url)
+                else:
+                    self.pending[url] = now
+        if len(overflow) > 0:
+            self.defer(overflow)
+        self.wakeup.set()
+
+    def enqueue_paths(self, target_file_paths: list) -> None:
+        self.enqueue_many([self.url_for(x) for x in target_file_paths])
+
+    def queue_depth(self) -> int:
+        return len(self.pending)
+
+    def defer(self, urls: list) -> None:
+        '''Hands purges over to the durable job queue, which retries them with backoff.'''
+        self.jobs.enqueue_many("cache_purge", [({"url": url}, f"cache_purge:{url}") for url in urls])
+        CACHE_PURGES.inc("deferred", amount=len(urls))
+
+    def take_due(self) -> list:
+        '''Pops the URLs whose debounce window has passed, as many as the batch size and rate limit allow.'''
+        now = time.monotonic()
+        self.tokens = min(float(self.PURGE_BATCH_SIZE), self.tokens + (now - self.tokens_updated) * self.PURGE_RATE_LIMIT)
+        self.tokens_updated = now
+
+        due = []
+        with self.pending_lock:
+            while len(self.pending) > 0 and len(due) < min(self.PURGE_BATCH_SIZE, int(self.tokens)):
+                url, queued_at = next(iter(self.pending.items()))
+                if now - queued_at < self.PURGE_DEBOUNCE_SECONDS:
+                    break # Oldest first, so nothing after this one is due either.
+                del self.pending[url]
+                due.append((url, queued_at))
+        self.tokens -= len(due)
+        return due
+
+    def seconds_until_due(self) -> float:
+        with self.pending_lock:
+            if len(self.pending) == 0:
+                return 60.0
+            queued_at = next(iter(self.pending.values()))
+        wait = queued_at + self.PURGE_DEBOUNCE_SECONDS - time.monotonic()
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.PURGE_RATE_LIMIT)
+        return max(0.05, wait)
+
+    def purge(self, url: str, queued_at: float) -> bool:
+        purge_start = time.perf_counter()
+        status_code = self.bunny.cache_Purge(url)
+        CACHE_PURGE_DURATION.observe(time.perf_counter() - purge_start)
+        if status_code is None or not 200 <= status_code < 300:
+            return False
+        CACHE_PURGE_DELAY.observe(time.monotonic() - queued_at)
+        CACHE_PURGES.inc("purged")
+        return True
+
+    def flush(self) -> int:
+        '''Purges one batch of due URLs concurrently. Returns the number of URLs taken from the queue.'''
+        due = self.take_due()
+        if len(due) == 0:
+            return 0
+        results = list(self.executor.map(lambda x: self.purge(*x), due))
+        failed = [url for (url, _), purged in zip(due, results) if not purged]
+        if len(failed) > 0:
+            self.defer(failed)
+        return len(due)
+
+    def flush_forever(self) -> None:
+        while True:
+            self.wakeup.wait(self.seconds_until_due())
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception: # e.g. Postgres down while deferring, the flusher must keep running.
+                time.sleep(1.0)
@@ -0,0 +1,341 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import path, environ
+from threading import BoundedSemaphore, Lock
+
+import json
+import logging
+import time
+import uuid
+
+import cv2
+import numpy
+import psycopg2
+
+from Bunny import BunnyAPI
+from Database import Database
+from Purge import CachePurger
+
+LOGGER = logging.getLogger(__name__)
+
+HOME_DIR = path.dirname(path.realpath(__file__))
+UPLOAD_DIR = path.join(HOME_DIR, "uploads")
+DEFAULT_THUMBNAIL_PATH = path.join(UPLOAD_DIR, "THUMBNAIL_DEFAULT.png")
+THUMBNAIL_JOBS_SCHEMA_LOCK_KEY = 7277265004 # Database.migration() lock key for ThumbnailProcessor.ensure_schema()
+
+def parse_resolution(resolution: str) -> tuple:
+    '''Parses "WIDTHxHEIGHT" into (WIDTH, HEIGHT).'''
+    width, height = resolution.lower().strip().split('x')
+    return (int(width), int(height))
+
+# Extra sizes and formats produced next to every thumbnail, e.g. "1280x720,480x270" and "webp,avif".
+#       Formats this OpenCV build can't write are dropped.
+THUMBNAIL_RENDITION_SIZES = [parse_resolution(x) for x in environ.get("THUMBNAIL_RENDITION_SIZES", "1280x720,800x450,480x270,320x180").split(",") if x.strip() != ""]
+THUMBNAIL_RENDITION_FORMATS = [x.strip().lower() for x in environ.get("THUMBNAIL_RENDITION_FORMATS", "webp").split(",") if x.strip() != "" and cv2.haveImageWriter(f".{x.strip().lower()}")]
+
+ENCODE_PARAMS = {
+    "webp": [cv2.IMWRITE_WEBP_QUALITY, int(environ.get("THUMBNAIL_WEBP_QUALITY", 80))],
+    "jpg": [cv2.IMWRITE_JPEG_QUALITY, int(environ.get("THUMBNAIL_JPEG_QUALITY", 85))],
+    "avif": [cv2.IMWRITE_AVIF_QUALITY, int(environ.get("THUMBNAIL_AVIF_QUALITY", 60))] if hasattr(cv2, "IMWRITE_AVIF_QUALITY") else []
+}
+
+def wkw(**kwargs):
+    return kwargs
+
+def rendition_path(thumbnail_path: str, width: int, height: int, format: str) -> str:
+    '''Where a rendition of `thumbnail_path` lives, thumbnails/{id}.png -> thumbnails/{id}_{WIDTH}x{HEIGHT}.{format}.
+
+    Works for storage paths and CDN URLs alike.'''
+    stem = path.splitext(thumbnail_path)[0]
+    return f"{stem}_{width}x{height}.{format}"
+
+def thumbnail_renditions(thumbnail_url: str) -> list:
+    '''Lists the configured renditions of the thumbnail at `thumbnail_url`, largest first.
+
+    `width` and `height` are upper bounds, renditions of a smaller source image are not upscaled to them.'''
+    return [
+        {
+            "url": rendition_path(thumbnail_url, width, height, format),
+            "width": width,
+            "height": height,
+            "format": format
+        }
+        for width, height in sorted(THUMBNAIL_RENDITION_SIZES, reverse=True)
+        for format in THUMBNAIL_RENDITION_FORMATS
+    ]
+
+def resize_image(image, target_image_resolution: tuple):
+    '''Resizes `image` to (WIDTH, HEIGHT), using area interpolation when shrinking (sharper, no aliasing).'''
+    height, width = image.shape[:2]
+    target_width, target_height = target_image_resolution
+    if target_width <= width and target_height <= height:
+        return cv2.resize(image, target_image_resolution, interpolation=cv2.INTER_AREA)
+    return cv2.resize(image, target_image_resolution, interpolation=cv2.INTER_LINEAR)
+
+class ThumbnailProcessor:
+    '''Resizes and uploads thumbnails on a bounded worker pool so request threads only enqueue jobs.
+
+    Given a `purger`, every file it uploads is queued for a CDN purge so replaced thumbnails stop being served stale.
+    Given a `database`, job states are mirrored to Public."ThumbnailJobs" so any worker process can report them.'''
+    def __init__(self, bunny: BunnyAPI, max_workers: int = None, max_pending: int = None, max_finished_jobs: int = None,
+                 purger: CachePurger = None, database: Database = None):
+        self.bunny = bunny
+        self.purger = purger
+        self.database = database
+        self.THUMBNAIL_JOB_RETENTION = float(environ.get("THUMBNAIL_JOB_RETENTION", 86400.0)) # Seconds finished jobs stay queryable
+        self.last_prune_time = 0.0
+        if self.database is not None:
+            self.ensure_schema()
+
+        self.max_workers = max_workers or int(environ.get("THUMBNAIL_WORKERS", 2))
+        self.max_pending = max_pending or int(environ.get("THUMBNAIL_MAX_PENDING", 64))
+        self.max_finished_jobs = max_finished_jobs or int(environ.get("THUMBNAIL_MAX_FINISHED_JOBS", 1000))
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="thumbnail_worker")
+        # Separate from `executor` so a worker waiting on its uploads can never starve them of threads.
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=int(environ.get("THUMBNAIL_UPLOAD_CONCURRENCY", 4)), thread_name_prefix="thumbnail_upload"
+        )
+        self._pending_slots = BoundedSemaphore(self.max_pending)
+
+        self.jobs: OrderedDict[str, dict] = OrderedDict() # job_id -> job, oldest first
+        self._jobs_lock = Lock()
+
+        self._default_thumbnail = None
+        self._default_thumbnail_variants: dict[tuple, object] = {} # (WIDTH, HEIGHT) -> resized default
+        self._default_thumbnail_lock = Lock()
+
+    def ensure_schema(self) -> None:
+        '''Creates Public."ThumbnailJobs" if it is missing.'''
+        sql_query = f"""
+        SELECT to_regclass('public."ThumbnailJobs"') IS NOT NULL
+        """
+        if self.database.execute_sql_query(sql_query, fetch="one", name="select_thumbnail_jobs_schema")[0]:
+            return
+
+        sql_query = f"""
+        CREATE TABLE IF NOT EXISTS public."ThumbnailJobs" (
+            job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            target_file_path TEXT NOT NULL,
+            result JSONB,
+            date_created TIMESTAMPTZ NOT NULL,
+            date_modified TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+        with self.database.migration(THUMBNAIL_JOBS_SCHEMA_LOCK_KEY) as cursor:
+            cursor.execute(sql_query)
+
+    def _store_job(self, job: dict) -> None:
+        '''Writes the current state of `job` to Public."ThumbnailJobs". Failures only cost other workers visibility.'''
+        if self.database is None:
+            return
+        sql_query = f"""
+        INSERT INTO public."ThumbnailJobs" (job_id, status, target_file_path, result, date_created)
+        VALUES (%s, %s, %s, %s, to_timestamp(%s))
+        ON CONFLICT (job_id) DO UPDATE SET status = EXCLUDED.status, result = EXCLUDED.result, date_modified = now()
+        """
+        try:
+            self.database.execute_sql_query(sql_query, args=(
+                job["job_id"], job["status"], job["target_file_path"],
+                None if job["result"] is None else json.dumps(job["result"], default=str), job["date_created"]
+            ), name="upsert_thumbnail_jobs")
+            if job["status"] in ("done", "failed") and time.monotonic() - self.last_prune_time >= self.THUMBNAIL_JOB_RETENTION / 24:
+                self.last_prune_time = time.monotonic()
+                sql_query = f"""
+                DELETE FROM public."ThumbnailJobs" WHERE date_modified < now() - make_interval(secs => %s)
+                """
+                self.database.execute_sql_query(sql_query, args=(self.THUMBNAIL_JOB_RETENTION,))
+        except psycopg2.Error:
+            LOGGER.exception(f"Could not store the state of thumbnail job {job['job_id']}")
+
+    def default_thumbnail(self, target_image_resolution: tuple):
+        '''Returns THUMBNAIL_DEFAULT.png resized to `target_image_resolution`, decoding it only once per process.'''
+        with self._default_thumbnail_lock:
+            resized = self._default_thumbnail_variants.get(target_image_resolution)
+            if resized is not None:
+                return resized
+            if self._default_thumbnail is None:
+                self._default_thumbnail = cv2.imread(DEFAULT_THUMBNAIL_PATH)
+            resized = resize_image(self._default_thumbnail, target_image_resolution)
+            self._default_thumbnail_variants[target_image_resolution] = resized
+            return resized
+
+    def submit(self, target_file_path: str, local_file_path: str, target_image_resolution: tuple, image_bytes: bytes = None) -> None | dict:
+        '''Queues a thumbnail job and returns it right away. Returns None if the queue is full.
+
+        When `image_bytes` is given the image is processed in memory and `local_file_path` is ignored.'''
+        if not self._pending_slots.acquire(blocking=False):
+            return None
+
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "target_file_path": target_file_path,
+            "date_created": time.time(),
+            "result": None
+        }
+        queued_job = dict(job)
+        with self._jobs_lock:
+            self.jobs[job["job_id"]] = job
+        self._store_job(queued_job) # Before it can run, so a quick `done` is never overwritten by `queued`.
+        try:
+            self.executor.submit(self._run, job, local_file_path, target_image_resolution, image_bytes)
+        except:
+            self._pending_slots.release()
+            raise
+        return queued_job
+
+    def job_Status(self, job_id: str) -> None | dict:
+        '''Returns the job from this process, or from Public."ThumbnailJobs" if another worker accepted it.'''
+        with self._jobs_lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        if self.database is None:
+            return None
+        sql_query = f"""
+        SELECT job_id, status, target_file_path, extract(epoch FROM date_created), result FROM public."ThumbnailJobs" WHERE job_id = %s
+        """
+        row = self.database.execute_sql_query(sql_query, args=(job_id,), fetch="one", name="select_thumbnail_jobs")
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "target_file_path": row[2],
+            "date_created": float(row[3]),
+            "result": row[4]
+        }
+
+    def _run(self, job: dict, local_file_path: str, target_image_resolution: tuple, image_bytes: bytes = None) -> None:
+        job["status"] = "processing"
+        self._store_job(job)
+        try:
+            if image_bytes is not None:
+                job["result"] = self.process_bytes(job["target_file_path"], image_bytes, target_image_resolution)
+            else:
+                job["result"] = self.process(job["target_file_path"], local_file_path, target_image_resolution)
+            job["status"] = "done" if job["result"].get("type") == "SUCCESS" else "failed"
+        except Exception as error:
+            job["status"] = "failed"
+            job["result"] = wkw(
+                type = "FAIL",
+                message = f"Thumbnail processing failed: {error}",
+                message_name = "thumbnail_processing_failed",
+                object = None
+            )
+        finally:
+            self._store_job(job)
+            self._pending_slots.release()
+            self._forget_finished_jobs()
+
+    def _forget_finished_jobs(self) -> None:
+        with self._jobs_lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job["status"] in ("done", "failed")]
+            for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+                del self.jobs[job_id]
+
+    def render(self, image, target_image_resolution: tuple) -> tuple:
+        '''Produces the main thumbnail and every configured rendition size from one decoded `image`.
+
+        Each size is resized from the smallest one already rendered that covers it in both dimensions, or from `image`.
+        Renditions are never upscaled: a size bigger than `image` gets the largest smaller rendition (or `image`) instead,
+        so every URL `thumbnail_renditions` lists exists. Returns `(thumbnail, {(WIDTH, HEIGHT): rendition})`.'''
+        area = lambda size: size[0] * size[1]
+        try:
+            image_height, image_width = image.shape[:2]
+            downscaled = {} # Sizes that fit in `image`, the only safe sources for smaller ones.
+            thumbnail = None
+            for size in sorted(set(THUMBNAIL_RENDITION_SIZES) | {target_image_resolution}, key=area, reverse=True):
+                fits = size[0] <= image_width and size[1] <= image_height
+                if not fits and size != target_image_resolution:
+                    continue
+                covering = [x for x in downscaled if x[0] >= size[0] and x[1] >= size[1]]
+                resized = resize_image(downscaled[min(covering, key=area)] if len(covering) > 0 else image, size)
+                if fits:
+                    downscaled[size] = resized
+                if size == target_image_resolution:
+                    thumbnail = resized
+        except (cv2.error, AttributeError): # imread/imdecode give us None for data they can't read.
+            return self.default_thumbnail(target_image_resolution), {size: self.default_thumbnail(size) for size in THUMBNAIL_RENDITION_SIZES}
+
+        renditions = {}
+        for size in THUMBNAIL_RENDITION_SIZES:
+            smaller = [x for x in downscaled if x[0] <= size[0] and x[1] <= size[1]]
+            renditions[size] = downscaled[max(smaller, key=area)] if len(smaller) > 0 else image
+        return thumbnail, renditions
+
+    def _upload_with_renditions(self, target_file_path: str, upload_thumbnail, renditions: dict) -> dict:
+        '''Encodes every rendition and uploads them together with the main thumbnail concurrently.'''
+        thumbnail_upload = self.upload_executor.submit(upload_thumbnail)
+
+        rendition_uploads = []
+        for (width, height), image in renditions.items():
+            for format in THUMBNAIL_RENDITION_FORMATS:
+                encoded, buffer = cv2.imencode(f".{format}", image, ENCODE_PARAMS.get(format, []))
+                if not encoded:
+                    continue
+                target_rendition_path = rendition_path(target_file_path, width, height, format)
+                rendition_uploads.append((
+                    # The actual size, smaller than the one in the path when the source image was.
+                    {"target_file_path": target_rendition_path, "width": image.shape[1], "height": image.shape[0], "format": format},
+                    self.upload_executor.submit(self.bunny.file_UploadBytes, target_rendition_path, buffer.tobytes())
+                ))
+
+        thumbnail_result = thumbnail_upload.result()
+        rendition_results = []
+        for rendition, upload in rendition_uploads:
+            rendition["result"] = upload.result()
+            rendition_results.append(rendition)
+
+        if self.purger is not None:
+            uploaded = [(target_file_path, thumbnail_result)] + [(x["target_file_path"], x["result"]) for x in rendition_results]
+            self.purger.enqueue_paths([file_path for file_path, result in uploaded if result.get("type") == "SUCCESS"])
+
+        failed = [x for x in [thumbnail_result] + [x["result"] for x in rendition_results] if x.get("type") != "SUCCESS"]
+        return wkw(
+            type = "SUCCESS" if len(failed) == 0 else "FAIL",
+            message = "Thumbnail and renditions uploaded" if len(failed) == 0 else f"{len(failed)} thumbnail upload(s) failed",
+            message_name = "thumbnail_upload_success" if len(failed) == 0 else "thumbnail_upload_failed",
+            object = {
+                "thumbnail": thumbnail_result,
+                "renditions": rendition_results
+            }
+        )
+
+    def process(self, target_file_path: str, local_file_path: str, target_image_resolution: tuple) -> dict:
+        '''Resizes the image at `local_file_path` in place and uploads it, plus its renditions, to `target_file_path`.'''
+        # Resizing the thumbnail to the required size for our channel by default, but can be optionally specified
+        thumbnail, renditions = self.render(cv2.imread(local_file_path), target_image_resolution)
+        cv2.imwrite(local_file_path, thumbnail)
+
+        return self._upload_with_renditions(
+            target_file_path,
+            lambda: self.bunny.file_Upload(target_file_path=target_file_path, local_file_path=local_file_path),
+            renditions
+        )
+
+    def process_bytes(self, target_file_path: str, image_bytes: bytes, target_image_resolution: tuple) -> dict:
+        '''Decodes, resizes and re-encodes an image entirely in memory and streams it, plus its renditions, to `target_file_path`.
+
+        The output format follows the extension of `target_file_path` (PNG if it has none).'''
+        image = cv2.imdecode(numpy.frombuffer(image_bytes, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+        thumbnail, renditions = self.render(image, target_image_resolution)
+
+        extension = path.splitext(target_file_path)[1] or ".png"
+        encoded, buffer = cv2.imencode(extension, thumbnail, ENCODE_PARAMS.get(extension[1:].lower(), []))
+        if not encoded:
+            return wkw(
+                type = "FAIL",
+                message = f"Could not encode the thumbnail as {extension}.",
+                message_name = "thumbnail_encode_failed",
+                object = None
+            )
+        thumbnail_bytes = buffer.tobytes()
+
+        return self._upload_with_renditions(
+            target_file_path,
+            lambda: self.bunny.file_UploadBytes(target_file_path=target_file_path, data=thumbnail_bytes),
+            renditions
+        )
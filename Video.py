@@ -1,119 +1,530 @@
 from os import path, environ
-from threading import Thread
+from threading import Thread, Lock, Event
+from concurrent.futures import ThreadPoolExecutor
 
+import logging
 import random
+import secrets
+import heapq
 import json
+import math
+import re
 import time
 
+import psycopg2
 import psycopg2.errors as psycopg2_errors
+import psycopg2.extras as psycopg2_extras
+from psycopg2 import sql as psycopg2_sql
 import datetime
+import base64
 
 from Bunny import BunnyAPI
-from Database import Database
+from Database import Database, AdvisoryLock
+from Cache import VideoObjectCache
+from Feed import VideoFeed
+from Jobs import JobQueue, bunny_handlers
+from Purge import CachePurger
+from Thumbnail import thumbnail_renditions
+from Metrics import POLLER_CYCLE_DURATION, POLLER_CYCLE_UPLOADS
+
+LOGGER = logging.getLogger(__name__)
 
 SERVICE_DIR = path.dirname(path.realpath(__file__))
 HOME_DIR = SERVICE_DIR.rsplit(path.sep, 1)[0]
 
-PULL_ZONE_ROOT = environ["BUNNY_PULL_ZONE_ROOT"]
-LIBRARY_CDN_HOSTNAME = environ["LIBRARY_CDN_HOSTNAME"]
+# Fields of a Stream Library video object the poller and `create_video_object` rely on.
+STREAM_INDEX_FIELDS = ("guid", "status", "length", "width", "height", "framerate")
+
+VIDEO_ID_ALPHABET = "AaBbCcDdEeFfGgHhIiJjKkLlMmNnOoPpQqRrSsTtUuVvWwXxYyZz1234567890"
+VIDEO_ID_LENGTH = 12
+VIDEO_ID_PATTERN = re.compile(r"[A-Za-z0-9]{12}")
+
+# Bunny webhook statuses (Finished, ResolutionFinished, Failed, PresignedUploadFailed) that can end an upload.
+#       Queued/Processing/Encoding callbacks only invalidate the cache.
+WEBHOOK_ACTIONABLE_STATUSES = (3, 4, 5, 8)
+
+UPLOAD_METADATA_REQUIRED_KEYS = ("title", "description", "category")
+
+# Title of pre-created Stream Library videos waiting in the warm pool, they carry no video_id metaTag until claimed.
+WARM_POOL_TITLE = "openbroadcast-warm-pool"
+
+SCHEMA_MIGRATION_LOCK_KEY = 7277265002 # Database.migration() lock key for ensure_upload_schedule_schema()
+
+# Columns callers may project when listing, anything else is rejected before it reaches SQL.
+VIDEO_COLUMNS = ("video_id", "video_metadata", "date_created", "date_modified")
+UPLOAD_COLUMNS = ("video_id", "video_metadata", "signature_metadata", "date_creation")
 
 def wkw(**kwargs):
     return kwargs
 
+def parse_stream_date(value) -> None | float:
+    '''Unix timestamp of a Stream Library date such as "2024-01-31T12:00:00.123" (UTC). None if missing or malformed.'''
+    try:
+        return datetime.datetime.strptime(str(value)[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=datetime.timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+def encode_page_cursor(values: list) -> str:
+    '''Packs the keyset of the last row of a page into an opaque token.'''
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_page_cursor(token: str) -> None | list:
+    '''Reverses `encode_page_cursor`. Returns None for malformed tokens.'''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list):
+        return None
+    return values
+
+def projection(columns: None | list, allowed_columns: tuple) -> psycopg2_sql.Composed:
+    '''Builds a safe SELECT column list. `video_id` is always included first since pagination is keyed on it.'''
+    if columns is None:
+        columns = allowed_columns
+    for column in columns:
+        if column not in allowed_columns:
+            raise ValueError(f"Unknown column `{column}`.")
+    columns = ["video_id"] + [column for column in columns if column != "video_id"]
+    return psycopg2_sql.SQL(", ").join(psycopg2_sql.Identifier(column) for column in columns)
+
 class VideoHandler:
-    def __init__(self):
+    def __init__(self, start_background: bool = True):
+        '''With `start_background=False` the upload poller and job workers are left to another process, see `start_background_workers()`.'''
+        self.PULL_ZONE_ROOT = environ["BUNNY_PULL_ZONE_ROOT"]
+        self.LIBRARY_CDN_HOSTNAME = environ["LIBRARY_CDN_HOSTNAME"]
+
         self.bunny = BunnyAPI() # Initialization args loaded from env
         self.database = Database() # same
+        self.video_cache = VideoObjectCache() # same
+
+        # Bunny side effects that must survive the sidecar being down go through the durable job queue.
+        #       Its workers can also run apart from the API (`python Jobs.py`) with JOBS_WORKERS=0 here.
+        self.jobs = JobQueue(self.database)
+        for kind, handler in bunny_handlers(self.bunny).items():
+            self.jobs.register(kind, handler)
+        self.JOBS_WORKERS = int(environ.get("JOBS_WORKERS", 2))
+
+        self.purger = CachePurger(self.bunny, self.jobs) # CDN purges for replaced thumbnails and changed feeds
+        self.feed = VideoFeed(self.database, purger=self.purger) # Materialized on the first /feed request
 
         self.UPLOAD_FOLDER = path.join(HOME_DIR, "uploads")
+
+        self.POLLER_BATCH_MODE = environ.get("POLLER_BATCH_MODE", "1") == "1"
+        self.POLLER_BATCH_THRESHOLD = int(environ.get("POLLER_BATCH_THRESHOLD", 10)) # Pending uploads, until the library size is known
+        self.stream_library_pages: None | int = None # Pages in the latest Stream Library listing
+        self.STREAM_LIBRARY_PAGE_SIZE = int(environ.get("STREAM_LIBRARY_PAGE_SIZE", 1000))
+        self.CLEANUP_BATCH_SIZE = int(environ.get("CLEANUP_BATCH_SIZE", 100))
+        self.cleanup_report: dict = {}
+
+        # With Bunny webhooks driving completions, polling is only a slow safety net for missed callbacks.
+        self.WEBHOOKS_ENABLED = environ.get("WEBHOOKS_ENABLED", "0") == "1"
+        self.POLLER_INTERVAL_MIN = float(environ.get("POLLER_INTERVAL_MIN", 120.0 if self.WEBHOOKS_ENABLED else 10.0)) # Seconds
+        self.POLLER_INTERVAL_MAX = float(environ.get("POLLER_INTERVAL_MAX", 300.0 if self.WEBHOOKS_ENABLED else 30.0)) # Seconds
+
+        # Only the leader across all workers reconciles the Stream Library, uploads are sharded between everyone.
+        self.leader_lock = AdvisoryLock(int(environ.get("POLLER_LEADER_LOCK_KEY", 7277265001)))
+        self.CLEANUP_INTERVAL = float(environ.get("CLEANUP_INTERVAL", 600.0)) # Seconds
+        self.last_cleanup_time = 0.0
+
+        # Each upload carries a next-check time: quick early checks, exponential backoff while encoding,
+        #       and a wake-up right at signature expiry. The heap mirrors due times so the poller can sleep until the next one.
+        self.UPLOAD_CHECK_BASE_DELAY = float(environ.get("UPLOAD_CHECK_BASE_DELAY", 60.0 if self.WEBHOOKS_ENABLED else 5.0)) # Seconds
+        self.UPLOAD_CHECK_MAX_DELAY = float(environ.get("UPLOAD_CHECK_MAX_DELAY", 900.0 if self.WEBHOOKS_ENABLED else 300.0)) # Seconds
+        self.SCHEDULE_HEAP_MAX = int(environ.get("SCHEDULE_HEAP_MAX", 100000))
+        self.schedule_heap: list[tuple[float, str]] = [] # (next check timestamp, video_id)
+        self.schedule_lock = Lock()
+        self.schedule_wakeup = Event()
+        self.ensure_upload_schedule_schema()
+
+        # Each upload is handled start to finish by a single worker, so its transitions stay ordered.
+        self.POLLER_CONCURRENCY = int(environ.get("POLLER_CONCURRENCY", 8))
+        self.POLLER_MAX_UPLOADS_PER_CYCLE = int(environ.get("POLLER_MAX_UPLOADS_PER_CYCLE", 1000))
+        self.POLLER_LEASE_SECONDS = float(environ.get("POLLER_LEASE_SECONDS", 300.0)) # Must outlast a cycle's Bunny calls
+        self.poller_executor = ThreadPoolExecutor(max_workers=self.POLLER_CONCURRENCY, thread_name_prefix="upload_poller")
+        self.poller_stats_lock = Lock()
+        self.poller_stats = {
+            "cycles": 0,
+            "last_cycle_seconds": 0.0,
+            "last_cycle_uploads": 0,
+            "total_uploads_processed": 0,
+            "concurrency": self.POLLER_CONCURRENCY
+        }
+
+        # Bunny calls that only need the guid of a new upload run side by side on this pool.
+        self.upload_executor = ThreadPoolExecutor(max_workers=int(environ.get("UPLOAD_CREATE_CONCURRENCY", 16)), thread_name_prefix="upload_create")
+        # Uploads of a batch are set up this many at a time. Separate from `upload_executor`, which they submit to.
+        self.upload_batch_executor = ThreadPoolExecutor(max_workers=int(environ.get("UPLOAD_BATCH_CONCURRENCY", 8)), thread_name_prefix="upload_batch")
+
+        # Optional pool of pre-created Stream Library videos, so creating an upload only has to retitle one.
+        #       Warm videos older than WARM_POOL_MAX_AGE are never handed out, cleanup deletes any left behind.
+        self.WARM_POOL_SIZE = int(environ.get("WARM_POOL_SIZE", 0)) # 0 disables the pool
+        self.WARM_POOL_MAX_AGE = float(environ.get("WARM_POOL_MAX_AGE", 3600.0)) # Seconds
+        self.WARM_POOL_MIN_SIGNATURE_LIFETIME = float(environ.get("WARM_POOL_MIN_SIGNATURE_LIFETIME", 1800.0)) # Seconds
+        self.warm_pool: list[dict] = [] # {"guid", "date_created", "signature"}, oldest first
+        self.warm_pool_lock = Lock()
+        self.warm_pool_refill = Event()
+        self.warm_pool_stats = {"claimed": 0, "missed": 0, "created": 0, "expired": 0}
+        # The pool lives in this process's memory and serves its requests, so every process keeps its own.
+        if self.WARM_POOL_SIZE > 0:
+            self.warm_pool_thread = Thread(target=self.maintain_warm_pool, args=(), daemon=True).start()
+
+        self.background_started = False
+        if start_background:
+            self.start_background_workers()
+    def start_background_workers(self) -> None:
+        '''Starts the upload poller and the job workers. Under gunicorn only one designated worker runs them (see gunicorn.conf.py).'''
+        if self.background_started:
+            return
+        self.background_started = True
+        self.jobs.start(self.JOBS_WORKERS)
         self.poller_thread = Thread(target=self.poll_upload_progress, args=(), daemon=True).start()
     def poll_upload_progress(self):
-        poller_delay_seconds = random.uniform(10.0, 30.0) # 10.0 -> 30.0
+        poller_delay_seconds = random.uniform(self.POLLER_INTERVAL_MIN, self.POLLER_INTERVAL_MAX) # 10.0 -> 30.0 by default
+        # Uploads created by other processes never reach this heap, waking up every base delay bounds how late their first check runs.
+        poller_delay_seconds = min(poller_delay_seconds, self.UPLOAD_CHECK_BASE_DELAY)
+        processed_uploads = 0
         while True:
-            time.sleep(poller_delay_seconds)
+            if processed_uploads >= self.POLLER_MAX_UPLOADS_PER_CYCLE:
+                time.sleep(0.1) # More uploads are already due, keep draining.
+            else:
+                # Sleep until the earliest known upload is due, re-evaluated whenever an earlier one is scheduled.
+                while self.schedule_wakeup.wait(self.seconds_until_next_check(poller_delay_seconds)):
+                    self.schedule_wakeup.clear()
+
+            # Nothing may end this thread: Postgres being down, a pool checkout timing out or a bug in
+            #       one cycle only costs that cycle.
+            try:
+                processed_uploads = self.poll_upload_progress_cycle()
+
+                if not self.leader_lock.try_acquire():
+                    continue # Another worker is the leader and does the reconciliation.
+                if time.monotonic() - self.last_cleanup_time < self.CLEANUP_INTERVAL:
+                    continue # A run pages the whole library and scans both tables, however many uploads were due.
+                self.last_cleanup_time = time.monotonic()
+                self.cleanup_stream_library()
+            except Exception:
+                LOGGER.exception("Upload poller cycle failed, retrying next cycle")
+                processed_uploads = 0
+    def poll_upload_progress_cycle(self) -> int:
+        '''Resolves a batch of pending uploads against Bunny once. Returns the number of uploads processed.
+
+        Due rows are leased in a short transaction, so concurrent workers each take a disjoint shard of Public."Uploads".
+        Bunny is called outside any transaction, and the cycle's transitions are then applied together in a second one.'''
+        cycle_start = time.perf_counter()
+        self.schedule_pop_due()
+        # Only due uploads, most overdue first, capped so a single cycle can't run away with a huge backlog.
+        uploads = self.uploads_lease_due(self.POLLER_MAX_UPLOADS_PER_CYCLE)
+        if len(uploads) == 0:
+            return 0
 
+        # Listing the library costs a call per page and per-guid lookups a call per upload, so only list it when that's fewer calls.
+        stream_library_index = {}
+        if self.POLLER_BATCH_MODE and len(uploads) >= self.POLLER_BATCH_THRESHOLD and len(uploads) > (self.stream_library_pages or 0):
+            stream_library_index = self.build_stream_library_index()
+
+        transitions = list(self.poller_executor.map(lambda upload: self.poll_upload(upload, stream_library_index), uploads))
+        self.apply_upload_transitions(transitions)
+
+        POLLER_CYCLE_DURATION.observe(time.perf_counter() - cycle_start)
+        POLLER_CYCLE_UPLOADS.inc(amount=len(uploads))
+        with self.poller_stats_lock:
+            self.poller_stats["cycles"] += 1
+            self.poller_stats["last_cycle_seconds"] = time.perf_counter() - cycle_start
+            self.poller_stats["last_cycle_uploads"] = len(uploads)
+            self.poller_stats["total_uploads_processed"] += len(uploads)
+        return len(uploads)
+    def ensure_upload_schedule_schema(self) -> None:
+        '''Adds the scheduling columns and their index to Public."Uploads" if they are missing.'''
+        sql_query = f"""
+        SELECT (
+            SELECT count(*) FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = 'Uploads' AND column_name IN ('next_check_at', 'check_attempts')
+        ) = 2 AND to_regclass('public."Uploads_next_check_at_idx"') IS NOT NULL
+        """
+        if self.database.execute_sql_query(sql_query, fetch="one", name="select_uploads_schema")[0]:
+            return # Already migrated, ALTER TABLE would still queue for an ACCESS EXCLUSIVE lock.
+
+        sql_query = f"""
+        ALTER TABLE public."Uploads" ADD COLUMN IF NOT EXISTS next_check_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        ALTER TABLE public."Uploads" ADD COLUMN IF NOT EXISTS check_attempts INTEGER NOT NULL DEFAULT 0;
+        CREATE INDEX IF NOT EXISTS "Uploads_next_check_at_idx" ON public."Uploads" (next_check_at);
+        """
+        with self.database.migration(SCHEMA_MIGRATION_LOCK_KEY) as cursor:
+            cursor.execute(sql_query)
+    def next_check_time(self, check_attempts: int, signature_expiration_time: None | float) -> float:
+        '''When to look at a still-pending upload again, as a unix timestamp.'''
+        delay = min(self.UPLOAD_CHECK_MAX_DELAY, self.UPLOAD_CHECK_BASE_DELAY * (2 ** min(check_attempts, 16)))
+        next_check = time.time() + delay * random.uniform(0.9, 1.1) # Jitter spreads out uploads created together.
+
+        # Wake up right after the signature expires, that's when a stalled upload can be dropped.
+        if signature_expiration_time is not None and time.time() < signature_expiration_time < next_check:
+            next_check = signature_expiration_time + 1.0
+        return next_check
+    def schedule_push(self, next_check: float, video_id: str) -> None:
+        if not self.background_started:
+            return # Nothing pops the heap in a process that doesn't poll.
+        with self.schedule_lock:
+            if len(self.schedule_heap) >= self.SCHEDULE_HEAP_MAX:
+                return
+            earliest = len(self.schedule_heap) == 0 or next_check < self.schedule_heap[0][0]
+            heapq.heappush(self.schedule_heap, (next_check, video_id))
+        if earliest:
+            self.schedule_wakeup.set() # The poller may be sleeping past this upload's due time.
+    def seconds_until_next_check(self, max_delay: float) -> float:
+        '''How long the poller can sleep before an upload it knows of becomes due, at most `max_delay`.'''
+        with self.schedule_lock:
+            if len(self.schedule_heap) == 0:
+                return max_delay
+            return max(0.0, min(max_delay, self.schedule_heap[0][0] - time.time()))
+    def schedule_pop_due(self) -> None:
+        '''Forgets heap entries that are due, the cycle's indexed query picks the rows themselves up.'''
+        now = time.time()
+        with self.schedule_lock:
+            while len(self.schedule_heap) > 0 and self.schedule_heap[0][0] <= now:
+                heapq.heappop(self.schedule_heap)
+    def poll_upload(self, upload: tuple, stream_library_index: dict) -> dict:
+        '''Looks up the Bunny status of a single upload and returns its transition.
+
+        An upload that raises is only rescheduled, so one bad row can't roll back the rest of the cycle.'''
+        try:
+            return self._poll_upload(upload, stream_library_index)
+        except Exception:
+            LOGGER.exception(f"Polling upload {upload[0]} failed, checking it again later")
+            return wkw(
+                video_id = upload[0],
+                delete_upload = False,
+                video_metadata = None,
+                next_check_at = self.next_check_time(upload[4], None)
+            )
+    def _poll_upload(self, upload: tuple, stream_library_index: dict) -> dict:
+        video_metadata = upload[1]
+        remote_video_object = stream_library_index.get(video_metadata.get("guid"))
+        if remote_video_object is not None:
+            self.video_cache.observe_status(video_metadata.get("guid"), remote_video_object.get("status"))
+            remote_video_object_response = wkw(message_name = "video_retrieve_success", object = remote_video_object)
+        else:
+            # Not in the index (newer than the listing, or batch mode is off) -> ask Bunny directly.
+            remote_video_object_response = self.video_retrieve_remote(video_metadata.get("guid"))
+        return self.resolve_upload(upload, remote_video_object_response)
+    def build_stream_library_index(self) -> dict:
+        '''Pages through the Stream Library once and returns a guid -> video object index.
+
+        Only the fields the poller needs are kept, so the index stays small for large libraries.'''
+        index = {}
+        for page in self.bunny.stream_IterateVideos(itemsPerPage=self.STREAM_LIBRARY_PAGE_SIZE):
+            if page.get("message_name") != "video_list_retrieve_success":
+                break # Partial index is fine, anything missing falls back to stream_RetrieveVideo.
+            self.remember_stream_library_size(page.get("object"))
+            for video in page.get("object")["items"]:
+                index[video.get("guid")] = {key: video.get(key) for key in STREAM_INDEX_FIELDS}
+        return index
+    def remember_stream_library_size(self, page_object: dict) -> None:
+        page_size = page_object.get("itemsPerPage") or self.STREAM_LIBRARY_PAGE_SIZE
+        self.stream_library_pages = math.ceil(page_object.get("totalItems", 0) / page_size)
+    def resolve_upload(self, upload: tuple, remote_video_object_response: dict) -> dict:
+        '''Decides the Uploads -> Videos transition for one upload given its Bunny video object response.
+
+        Returns `delete_upload` (bool), `video_metadata` (the Videos row to create, or None)
+        and `next_check_at` (unix timestamp of the next check for uploads that stay pending).'''
+        video_id, video_metadata, check_attempts = upload[0], upload[1], upload[4]
+        # Rows written without a signature (stored as JSON null) can never be uploaded to, they count as expired.
+        signature_expiration_time = (upload[2] or {}).get("signature_expiration_time")
+        transition = wkw(
+            video_id = video_id,
+            delete_upload = False,
+            video_metadata = None,
+            next_check_at = self.next_check_time(check_attempts, signature_expiration_time)
+        )
+
+        # Checking the message name guarantees that we are only deleting
+        #       uploads that were never registered in the Stream Library
+        if remote_video_object_response.get("message_name") == "video_not_found":
+            transition["delete_upload"] = True
+            return transition
+
+        remote_video_object = remote_video_object_response.get("object")
+        if remote_video_object is None:
+            # Unknown issue occurred, but this does not necessarily mean the video
+            #       doesn't exist, just that the response did not give us it.
+            #               (Could be connection issues to bunnyapi service or Bunny's API)
+            return transition
+
+        upload_status_code = int(remote_video_object.get("status"))
+        if upload_status_code in [0, 1, 2, 3]:
+            if signature_expiration_time is None or signature_expiration_time < datetime.datetime.now().timestamp():
+                transition["delete_upload"] = True
+        elif upload_status_code == 4:
+            transition["delete_upload"] = True
+            transition["video_metadata"] = self.build_video_metadata(video_metadata, file_data = remote_video_object)
+        elif upload_status_code > 4:
+            transition["delete_upload"] = True
+        return transition
+    def apply_upload_transitions(self, transitions: list, cursor: psycopg2.extensions.cursor = None) -> list:
+        '''Applies a cycle's worth of transitions in one transaction (the caller's, when a `cursor` is given).
+
+        An upload is never removed from Public."Uploads" without its Public."Videos" row being created alongside it.
+        Transitions of uploads that are gone by now, e.g. resolved by a webhook while their lease ran, are dropped.
+        Returns the Public."Videos" rows created, which callers passing a `cursor` hand to the feed once they commit.'''
+        if cursor is not None and len(transitions) > 0:
             sql_query = f"""
-            SELECT * FROM public."Uploads" ORDER BY date_creation ASC
-            """ # Earliest first.
-            cursor = self.database.execute_sql_query(sql_query)
+            SELECT video_id FROM public."Uploads" WHERE video_id = ANY(%s) FOR UPDATE
+            """
+            cursor.execute(sql_query, ([x["video_id"] for x in transitions],))
+            pending_ids = {row[0] for row in cursor.fetchall()}
+            transitions = [x for x in transitions if x["video_id"] in pending_ids]
+        delete_upload_ids = [x["video_id"] for x in transitions if x["delete_upload"]]
+        new_videos = [(x["video_id"], x["video_metadata"]) for x in transitions if x["video_metadata"] is not None]
+        rescheduled = [(x["video_id"], x["next_check_at"]) for x in transitions if not x["delete_upload"]]
+        if len(delete_upload_ids) == 0 and len(new_videos) == 0 and len(rescheduled) == 0:
+            return []
+        if cursor is None:
+            with self.database.transaction() as cursor:
+                inserted_videos = self.apply_upload_transitions(transitions, cursor=cursor)
+            self.feed.upsert_many(inserted_videos)
+            return inserted_videos
 
-            uploads = cursor.fetchall()
-            if len(uploads) == 0:
-                continue
+        self.uploads_delete_by_ids(delete_upload_ids, cursor=cursor)
+        inserted_videos = self.videos_insert_many(new_videos, cursor=cursor)
+        self.uploads_reschedule(rescheduled, cursor=cursor)
+        for video_id, next_check_at in rescheduled:
+            self.schedule_push(next_check_at, video_id)
+        return inserted_videos
+    def process_stream_status(self, guid: str, webhook_status: int) -> dict:
+        '''Applies the poller's Uploads -> Videos transition to the single upload a Bunny status webhook is about.'''
+        # Whatever the callback says, the cached video object is now stale.
+        self.video_cache.invalidate(guid)
 
-            for upload in uploads:
-                video_id, video_metadata, signature_metadata = upload[0], upload[1], upload[2]
-                
-                remote_video_object_response = self.bunny.stream_RetrieveVideo(video_metadata.get("guid"))
-                # Checking the message name guarantees that we are only deleting
-                #       uploads that were never registered in the Stream Library
-                if remote_video_object_response.get("message_name") == "video_not_found":
-                    self.video_delete_by_id(video_id=video_id)
-                    continue
+        if webhook_status not in WEBHOOK_ACTIONABLE_STATUSES:
+            return wkw(
+                type = "SUCCESS",
+                message = f"Status {webhook_status} does not change the upload.",
+                message_name = "stream_status_ignored",
+                object = None
+            )
+
+        upload = self.uploads_lease_by_guid(guid)
+        if upload is None:
+            return wkw(
+                type = "SUCCESS",
+                message = f"No pending upload for guid {guid} (or a poller is handling it).",
+                message_name = "upload_not_found",
+                object = None
+            )
+
+        # Webhook status codes differ from video object status codes, so the video object is the source of truth.
+        transition = self.resolve_upload(upload, self.video_retrieve_remote(guid))
+        self.apply_upload_transitions([transition])
 
-                remote_video_object = remote_video_object_response.get("object")
-                if remote_video_object is None:
-                    # Unknown issue occurred, but this does not necessarily mean the video
-                    #       doesn't exist, just that the response did not give us it.
-                    #               (Could be connection issues to bunnyapi service or Bunny's API)
+        return wkw(
+            type = "SUCCESS",
+            message = "Upload status processed.",
+            message_name = "stream_status_processed",
+            object = {
+                "video_id": transition["video_id"],
+                "upload_deleted": transition["delete_upload"],
+                "video_created": transition["video_metadata"] is not None
+            }
+        )
+    def cleanup_stream_library(self) -> dict:
+        '''Reconciles the whole Stream Library against Public."Videos" and Public."Uploads".
+
+        The remote library is streamed page by page and diffed against guid/id sets, so only
+        identifiers (never full objects) are held in memory. Returns a report of the run, where
+        `remote_deleted` counts Stream Library deletes queued on the durable job queue.'''
+        report = {
+            "pages_read": 0,
+            "remote_videos_seen": 0,
+            "remote_deleted": 0,
+            "local_deleted": 0,
+            "complete": False
+        }
+
+        # Uploads first: an upload that finishes while we read Videos is then still known as an upload.
+        sql_query = f"""
+        SELECT video_id FROM public."Uploads"
+        """
+        upload_ids = {row[0] for row in self.database.iterate_sql_query(sql_query)}
+
+        sql_query = f"""
+        SELECT video_id, video_metadata->>'guid' FROM public."Videos"
+        """
+        local_videos = {row[1]: row[0] for row in self.database.iterate_sql_query(sql_query)} # guid -> video_id
+
+        stream_library_guids = set()
+        orphan_candidates = [] # (video_id, guid) uploaded in Bunny but unknown locally
+        failed_guids = [] # Upload failed or warm video abandoned, we can remove the video from the Stream Library.
+        stale_warm_cutoff = time.time() - 2 * self.WARM_POOL_MAX_AGE # Well past the age any worker would still claim it at.
+        for page in self.bunny.stream_IterateVideos(itemsPerPage=self.STREAM_LIBRARY_PAGE_SIZE):
+            if page.get("message_name") != "video_list_retrieve_success":
+                break
+            report["pages_read"] += 1
+            self.remember_stream_library_size(page.get("object"))
+
+            for video in page.get("object")['items']:
+                video_guid = video.get("guid")
+                stream_library_guids.add(video_guid)
+                report["remote_videos_seen"] += 1
+
+                video_id = None
+                for tag in video.get("metaTags") or []:
+                    if tag['property'] == "video_id":
+                        video_id = tag['value']
+                if video_id is None: # For some reason this video does not have video_id metaTag.
+                    # Unclaimed warm pool videos of a worker that went away, or whose retitle failed.
+                    date_uploaded = parse_stream_date(video.get("dateUploaded"))
+                    if video.get("title") == WARM_POOL_TITLE and date_uploaded is not None and date_uploaded < stale_warm_cutoff:
+                        failed_guids.append(video_guid)
                     continue
 
-                upload_status_code = int(remote_video_object.get("status"))
-                if upload_status_code in [0, 1, 2, 3]:
-                    if signature_metadata.get("signature_expiration_time") < datetime.datetime.now().timestamp():
-                        self.uploads_delete_by_id(video_id=video_id)
-                elif upload_status_code == 4:
-                    self.uploads_delete_by_id(video_id=video_id)
-                    self.create_video_object(
-                        id = video_id,
-                        video_metadata = video_metadata
-                    )
-                elif upload_status_code > 4:
-                    self.uploads_delete_by_id(video_id=video_id)
-            self.cleanup_stream_library()
-    def cleanup_stream_library(self):
-        stream_library_videos_response = self.bunny.stream_ListVideos()
-        if stream_library_videos_response.get("message_name") != "video_list_retrieve_success":
-            return
-        
-        stream_library_videos = stream_library_videos_response.get("object")['items']
-        stream_library_guids = [x.get("guid") for x in stream_library_videos]
+                video_upload_status = video.get("status")
+                if video_upload_status == 4 and video_guid not in local_videos and video_id not in upload_ids:
+                    # This video is marked as "Uploaded" in Bunny but does not exist in our local guids.
+                    #       It may have been created after our snapshot, so it is re-checked before deletion.
+                    orphan_candidates.append((video_id, video_guid))
+                if video_upload_status in [5, 6]:
+                    failed_guids.append(video_guid)
+        else:
+            report["complete"] = True
 
-        local_videos = self.videos_list()
-        local_guids = [x[1].get("guid") for x in local_videos]
+        # Deleting while still paging would shift later pages and skip videos, so deletes are queued until now.
+        for batch_start in range(0, len(orphan_candidates), self.CLEANUP_BATCH_SIZE):
+            report["remote_deleted"] += self._delete_remote_orphans(orphan_candidates[batch_start:batch_start + self.CLEANUP_BATCH_SIZE])
+        for batch_start in range(0, len(failed_guids), self.CLEANUP_BATCH_SIZE):
+            report["remote_deleted"] += self._delete_remote_videos(failed_guids[batch_start:batch_start + self.CLEANUP_BATCH_SIZE])
 
-        for video in local_videos:
-            video_id = video[0]
-            video_guid = video[1].get('guid')
-            if video_guid not in stream_library_guids:
+        # A partial listing says nothing about which local videos are gone, so only diff a complete one.
+        if report["complete"]:
+            dead_video_ids = []
+            for video_guid, video_id in local_videos.items():
+                if video_guid in stream_library_guids:
+                    continue
+                # Pages can shift while we read them, confirm the video is really gone first.
+                if self.bunny.stream_RetrieveVideo(video_guid).get("message_name") != "video_not_found":
+                    continue
                 # Video exists in our database but is not in the Stream Library
                 #       -> Remove from database, this is a "dead" entry.
-                self.video_delete_by_id(video_id=video_id)
-        
-        for video in stream_library_videos:
-            video_guid = video.get("guid")
-
-            video_id = None
-            for tag in video.get("metaTags"):
-                if tag['property'] == "video_id":
-                    video_id = tag['value']
-            if video_id is None: # For some reason this video does not have video_id metaTag.
-                continue
+                dead_video_ids.append(video_id)
+                if len(dead_video_ids) >= self.CLEANUP_BATCH_SIZE:
+                    report["local_deleted"] += self.videos_delete_by_ids(dead_video_ids)
+                    dead_video_ids = []
+            report["local_deleted"] += self.videos_delete_by_ids(dead_video_ids)
 
+        self.cleanup_report = report
+        return report
+    def _delete_remote_orphans(self, orphan_candidates: list) -> int:
+        '''Deletes Stream Library videos that are still unknown locally after a batched re-check.'''
+        if len(orphan_candidates) == 0:
+            return 0
+        known_ids = self.utility_existing_video_ids([video_id for video_id, _ in orphan_candidates])
+        return self._delete_remote_videos([guid for video_id, guid in orphan_candidates if video_id not in known_ids])
+    def _delete_remote_videos(self, guids: list) -> int:
+        '''Queues durable deletes for a batch of Stream Library videos. Returns the number of deletes newly queued.
 
-            video_upload_status = video.get("status")
-            if video_upload_status == 4 and video_guid not in local_guids:
-                # This video is marked as "Uploaded" in Bunny but does not exist in our local guids.
-                #       There is a race condition here. A video can be "Uploaded" in Bunny
-                #           but could be in our "Uploads" still (did not poll upload progess quickly enough)
-                #               So, we check if it's in our uploads before deleting it.
-                if self.uploads_retrieve_by_id(video_id=video_id) is None:
-                    self.bunny.stream_DeleteVideo(video_guid)
-            if video_upload_status in [5, 6]: # Upload failed, we can remove the video from the Stream Library.
-                self.bunny.stream_DeleteVideo(video_guid)
-            
-
-            
+        A guid that already has a pending delete is not queued twice.'''
+        for guid in guids:
+            self.video_cache.invalidate(guid)
+        return len(self.jobs.enqueue_many("stream_delete_video", [({"guid": guid}, f"stream_delete_video:{guid}") for guid in guids]))
 
 
 
@@ -124,24 +535,105 @@ class VideoHandler:
         sql_query = f"""
         SELECT video_id, video_metadata, date_created, date_modified FROM public."Videos" WHERE video_id = %s
         """
-        cursor = self.database.execute_sql_query(sql_query, args=(video_id,))
-        return cursor.fetchone()
+        return self.database.execute_sql_query(sql_query, args=(video_id,), fetch="one")
+    def video_retrieve_remote(self, guid: str) -> dict:
+        '''Retrieves a video object from the Stream Library, served from `video_cache` when fresh.'''
+        response = self.video_cache.get(guid)
+        if response is not None:
+            return response
+        response = self.bunny.stream_RetrieveVideo(guid)
+        self.video_cache.put(guid, response)
+        return response
     def video_delete_by_id(self, video_id: str) -> None:
         '''Deletes a video object using a `video_id` from Public."Videos"'''
         sql_query = f"""
         DELETE FROM public."Videos" WHERE video_id = %s
         """
         self.database.execute_sql_query(sql_query, args=(video_id,))
+        self.feed.remove_many([video_id])
+    def videos_delete_by_ids(self, video_ids: list, cursor: psycopg2.extensions.cursor = None) -> int:
+        '''Deletes every video object in `video_ids` from Public."Videos" in one statement. Returns the number deleted.'''
+        if len(video_ids) == 0:
+            return 0
+        sql_query = f"""
+        DELETE FROM public."Videos" WHERE video_id = ANY(%s)
+        """
+        # Within a caller's transaction a rollback would leave the feed short, its freshness check reloads it then.
+        if cursor is not None:
+            cursor.execute(sql_query, (list(video_ids),))
+            self.feed.remove_many(video_ids)
+            return cursor.rowcount
+        deleted = self.database.execute_sql_query(sql_query, args=(list(video_ids),))
+        self.feed.remove_many(video_ids)
+        return deleted
+    def videos_insert_many(self, videos: list, cursor: psycopg2.extensions.cursor = None) -> list:
+        '''Inserts `(video_id, video_metadata)` pairs into Public."Videos" in one statement, skipping existing ids. Returns the inserted rows.'''
+        if len(videos) == 0:
+            return []
+        if cursor is None:
+            with self.database.transaction() as cursor:
+                return self.videos_insert_many(videos, cursor=cursor)
+
+        sql_query = f"""
+        SELECT video_id FROM public."Videos" WHERE video_id = ANY(%s)
+        """
+        cursor.execute(sql_query, ([video_id for video_id, _ in videos],))
+        existing_ids = {row[0] for row in cursor.fetchall()}
+        rows = {} # Also collapses duplicate ids within the batch, last one wins.
+        for video_id, video_metadata in videos:
+            if video_id not in existing_ids:
+                rows[video_id] = (video_id, json.dumps(video_metadata))
+        if len(rows) == 0:
+            return []
+
+        sql_query = f"""
+        INSERT INTO public."Videos" (video_id, video_metadata)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING video_id, video_metadata, date_created, date_modified
+        """
+        return psycopg2_extras.execute_values(cursor, sql_query, list(rows.values()), page_size=len(rows), fetch=True)
     def videos_list(self) -> list:
         '''Retrieves a list of all video objects in Public."Videos"'''
         sql_query = f"""
         SELECT * FROM public."Videos"
         ORDER BY video_id ASC
         """
-        cursor = self.database.execute_sql_query(sql_query)
-
-        videos = cursor.fetchall()
+        videos = self.database.execute_sql_query(sql_query, fetch="all")
         return videos
+    def videos_iter(self, columns: list = None, batch_size: int = 1000):
+        '''Yields video objects from Public."Videos" in `video_id` order, only selecting `columns`.
+
+        Rows are streamed from a server-side cursor, `batch_size` at a time.'''
+        sql_query = psycopg2_sql.SQL("""
+        SELECT {columns} FROM public."Videos"
+        ORDER BY video_id ASC
+        """).format(columns=projection(columns, VIDEO_COLUMNS))
+        yield from self.database.iterate_sql_query(sql_query, batch_size=batch_size, name="select_videos_iter")
+    def videos_list_page(self, columns: list = None, limit: int = 50, cursor: str = None) -> tuple:
+        '''Retrieves one keyset page of video objects from Public."Videos".
+
+        Returns `(rows, next_cursor)`, `next_cursor` is None on the last page. Raises ValueError for a bad `cursor`.'''
+        after_video_id = ""
+        if cursor is not None:
+            cursor_values = decode_page_cursor(cursor)
+            if cursor_values is None or len(cursor_values) != 1 or not isinstance(cursor_values[0], str):
+                raise ValueError("Malformed page cursor.")
+            after_video_id = cursor_values[0]
+
+        sql_query = psycopg2_sql.SQL("""
+        SELECT {columns} FROM public."Videos"
+        WHERE video_id > %s
+        ORDER BY video_id ASC
+        LIMIT %s
+        """).format(columns=projection(columns, VIDEO_COLUMNS))
+        # One extra row tells us if there is a next page.
+        rows = self.database.execute_sql_query(sql_query, args=(after_video_id, limit + 1), fetch="all", name="select_videos_page")
+
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_page_cursor([rows[-1][0]])
 
 
 
@@ -150,105 +642,323 @@ class VideoHandler:
         sql_query = f"""
         SELECT video_id, video_metadata, signature_metadata, date_creation FROM public."Uploads" WHERE video_id = %s
         """
-        cursor = self.database.execute_sql_query(sql_query, args=(video_id,))
-        return cursor.fetchone()
+        return self.database.execute_sql_query(sql_query, args=(video_id,), fetch="one")
+    def uploads_retrieve_by_guid(self, guid: str) -> tuple:
+        '''Retrieves an upload using its Bunny `guid` from Public."Uploads"'''
+        sql_query = f"""
+        SELECT video_id, video_metadata, signature_metadata, date_creation, check_attempts FROM public."Uploads" WHERE video_metadata->>'guid' = %s
+        """
+        return self.database.execute_sql_query(sql_query, args=(guid,), fetch="one")
+    def uploads_lease_due(self, limit: int) -> list:
+        '''Leases up to `limit` due uploads, most overdue first, by moving their `next_check_at` POLLER_LEASE_SECONDS ahead.
+
+        Rows being leased elsewhere are skipped. If the holder dies, the upload is simply due again once the lease runs out.'''
+        sql_query = f"""
+        UPDATE public."Uploads" SET next_check_at = now() + make_interval(secs => %s)
+        WHERE video_id IN (
+            SELECT video_id FROM public."Uploads"
+            WHERE next_check_at <= now()
+            ORDER BY next_check_at ASC LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING video_id, video_metadata, signature_metadata, date_creation, check_attempts
+        """
+        return self.database.execute_sql_query(sql_query, args=(self.POLLER_LEASE_SECONDS, limit), fetch="all", name="lease_uploads")
+    def uploads_lease_by_guid(self, guid: str) -> tuple:
+        '''Leases the upload with Bunny `guid` like `uploads_lease_due`, whether it is due or not. Returns None if it is being leased elsewhere.'''
+        sql_query = f"""
+        UPDATE public."Uploads" SET next_check_at = now() + make_interval(secs => %s)
+        WHERE video_id IN (
+            SELECT video_id FROM public."Uploads" WHERE video_metadata->>'guid' = %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING video_id, video_metadata, signature_metadata, date_creation, check_attempts
+        """
+        return self.database.execute_sql_query(sql_query, args=(self.POLLER_LEASE_SECONDS, guid), fetch="one", name="lease_uploads_by_guid")
     def uploads_delete_by_id(self, video_id: str) -> None:
         '''Deletes an upload using a `video_id` from Public."Uploads"'''
         sql_query = f"""
         DELETE FROM public."Uploads" WHERE video_id = %s
         """
         self.database.execute_sql_query(sql_query, args=(video_id,))
+    def uploads_delete_by_ids(self, video_ids: list, cursor: psycopg2.extensions.cursor = None) -> int:
+        '''Deletes every upload in `video_ids` from Public."Uploads" in one statement. Returns the number deleted.'''
+        if len(video_ids) == 0:
+            return 0
+        sql_query = f"""
+        DELETE FROM public."Uploads" WHERE video_id = ANY(%s)
+        """
+        if cursor is not None:
+            cursor.execute(sql_query, (list(video_ids),))
+            return cursor.rowcount
+        return self.database.execute_sql_query(sql_query, args=(list(video_ids),))
+    def uploads_insert_many(self, uploads: list, cursor: psycopg2.extensions.cursor = None) -> set:
+        '''Inserts `(video_id, video_metadata json, signature_metadata json, next_check_at timestamp)` rows into
+        Public."Uploads" in one statement. Returns the ids actually inserted, existing ids are skipped.'''
+        if len(uploads) == 0:
+            return set()
+        if cursor is None:
+            with self.database.transaction() as cursor:
+                return self.uploads_insert_many(uploads, cursor=cursor)
+
+        sql_query = f"""
+        INSERT INTO public."Uploads" (video_id, video_metadata, signature_metadata, next_check_at)
+        VALUES %s
+        ON CONFLICT (video_id) DO NOTHING
+        RETURNING video_id
+        """
+        inserted = psycopg2_extras.execute_values(
+            cursor, sql_query, uploads, template="(%s, %s, %s, to_timestamp(%s))", page_size=len(uploads), fetch=True
+        )
+        return {row[0] for row in inserted}
+    def uploads_reschedule(self, schedule: list, cursor: psycopg2.extensions.cursor = None) -> int:
+        '''Sets `next_check_at` from `(video_id, unix timestamp)` pairs and counts the check, in one statement.'''
+        if len(schedule) == 0:
+            return 0
+        if cursor is None:
+            with self.database.transaction() as cursor:
+                return self.uploads_reschedule(schedule, cursor=cursor)
+
+        sql_query = f"""
+        UPDATE public."Uploads" AS uploads
+        SET next_check_at = to_timestamp(schedule.next_check_at), check_attempts = uploads.check_attempts + 1
+        FROM (VALUES %s) AS schedule (video_id, next_check_at)
+        WHERE uploads.video_id = schedule.video_id
+        """
+        psycopg2_extras.execute_values(cursor, sql_query, schedule, template="(%s, %s::double precision)", page_size=len(schedule))
+        return cursor.rowcount
+    def uploads_backlog(self) -> int:
+        '''Counts the uploads still pending in Public."Uploads".'''
+        sql_query = f"""
+        SELECT count(*) FROM public."Uploads"
+        """
+        return self.database.execute_sql_query(sql_query, fetch="one")[0]
     def uploads_list(self) -> list:
         '''Retrieves a list of all upload objects in Public."Uploads"'''
         sql_query = f"""
         SELECT * FROM public."Uploads" ORDER BY date_creation ASC
         """
-        cursor = self.database.execute_sql_query(sql_query)
-        return cursor.fetchall()
+        return self.database.execute_sql_query(sql_query, fetch="all")
+    def uploads_iter(self, columns: list = None, batch_size: int = 1000):
+        '''Yields upload objects from Public."Uploads" oldest first, only selecting `columns`.
+
+        Rows are streamed from a server-side cursor, `batch_size` at a time.'''
+        sql_query = psycopg2_sql.SQL("""
+        SELECT {columns} FROM public."Uploads"
+        ORDER BY date_creation ASC, video_id ASC
+        """).format(columns=projection(columns, UPLOAD_COLUMNS))
+        yield from self.database.iterate_sql_query(sql_query, batch_size=batch_size, name="select_uploads_iter")
     
 
 
     def utility_generate_video_id(self) -> str:
-        '''Provides a unique video ID compatible with our service. (12-char alphanumeric)'''
-        def gen():
-            seq = "AaBbCcDdEeFfGgHhIiJjKkLlMmNnOoPpQqRrSsTtUuVvWwXxYyZz1234567890"
-            _id = ""
-            for x in range(0, 12):
-                _id += random.choice(seq)
-            return _id
-        
-        id = gen()
-        while self.utility_does_video_id_exist(id):
-            id = gen()
-        return id
+        '''Provides a unique video ID compatible with our service. (12-char alphanumeric)
+
+        IDs come from a CSPRNG over 62^12 (~3.2e21) values, so no database lookup is needed to avoid collisions.
+        The primary key still rejects the astronomically unlikely duplicate at insert time (`duplicate_id`).'''
+        return "".join(secrets.choice(VIDEO_ID_ALPHABET) for _ in range(VIDEO_ID_LENGTH))
+    def utility_reserve_video_ids(self, count: int) -> list:
+        '''Provides `count` distinct video IDs in one call, for batch ingest clients.'''
+        video_ids = set()
+        while len(video_ids) < count:
+            video_ids.add(self.utility_generate_video_id())
+        return list(video_ids)
     def utility_is_video_id_valid(self, video_id: str) -> bool:
         '''Checks if a video_id is properly formatted.'''
-        if len(video_id) != 12:
-            return False
-        seq = "AaBbCcDdEeFfGgHhIiJjKkLlMmNnOoPpQqRrSsTtUuVvWwXxYyZz1234567890"
-        for char in video_id:
-            if char not in seq:
-                return False
-        return True
+        return isinstance(video_id, str) and VIDEO_ID_PATTERN.fullmatch(video_id) is not None
     def utility_does_video_id_exist(self, video_id: str) -> bool:
-        '''Checks if a video with video_id already exists in Public."Videos"'''
-        if self.video_retrieve_by_id(video_id=video_id) is not None:
-            return True
-        return False
+        '''Checks if a video or upload with video_id already exists in Public."Videos" or Public."Uploads"'''
+        sql_query = f"""
+        SELECT EXISTS(SELECT 1 FROM public."Videos" WHERE video_id = %s)
+            OR EXISTS(SELECT 1 FROM public."Uploads" WHERE video_id = %s)
+        """
+        return self.database.execute_sql_query(sql_query, args=(video_id, video_id), fetch="one")[0]
+    def utility_existing_video_ids(self, video_ids: list) -> set:
+        '''Returns which of `video_ids` are already taken in Public."Videos" or Public."Uploads", in one query.'''
+        if len(video_ids) == 0:
+            return set()
+        sql_query = f"""
+        SELECT video_id FROM public."Uploads" WHERE video_id = ANY(%s)
+        UNION
+        SELECT video_id FROM public."Videos" WHERE video_id = ANY(%s)
+        """
+        return {row[0] for row in self.database.execute_sql_query(sql_query, args=(video_ids, video_ids), fetch="all")}
 
 
 
-    def create_upload_object(self, id: str, video_metadata: dict) -> dict:
-        if not self.utility_is_video_id_valid(id):
-            function_response = wkw(
-                type = "FAIL",
-                message = "`id` is formatted incorrectly.",
-                message_name = "invalid_video_id",
-                object = f"{id}"
-            )
-            return function_response
-        
-        remote_video_object = self.bunny.stream_CreateVideo(
-            videoTitle = video_metadata["title"]
-        )
-        self.bunny.stream_UpdateVideo(remote_video_object["guid"], payload = {
+    def maintain_warm_pool(self):
+        while True:
+            self.warm_pool_fill()
+            self.warm_pool_refill.wait(timeout=self.WARM_POOL_MAX_AGE / 10) # Also wakes up to replace aging videos.
+            self.warm_pool_refill.clear()
+    def warm_pool_fill(self) -> int:
+        '''Deletes expired warm videos and creates new ones until the pool is full. Returns the number created.'''
+        cutoff = time.time() - self.WARM_POOL_MAX_AGE
+        with self.warm_pool_lock:
+            expired = [x for x in self.warm_pool if x["date_created"] < cutoff]
+            self.warm_pool = [x for x in self.warm_pool if x["date_created"] >= cutoff]
+            missing = self.WARM_POOL_SIZE - len(self.warm_pool)
+            self.warm_pool_stats["expired"] += len(expired)
+        self._delete_remote_videos([x["guid"] for x in expired])
+
+        created = [x for x in self.upload_executor.map(lambda _: self.warm_pool_create(), range(max(0, missing))) if x is not None]
+        with self.warm_pool_lock:
+            self.warm_pool.extend(created)
+            self.warm_pool_stats["created"] += len(created)
+        return len(created)
+    def warm_pool_create(self) -> None | dict:
+        '''Creates one placeholder Stream Library video, along with its upload signature.'''
+        remote_video_object = self.bunny.stream_CreateVideo(videoTitle = WARM_POOL_TITLE)
+        if remote_video_object is None or remote_video_object.get("guid") is None:
+            return None # bunnyapi is struggling, the next refill tries again.
+        return {
+            "guid": remote_video_object["guid"],
+            "date_created": time.time(),
+            "signature": self.bunny.upload_CreateSignature(remote_video_object["guid"])
+        }
+    def warm_pool_claim(self) -> None | dict:
+        '''Takes the oldest warm video that is still young enough out of the pool. Returns None if there is none.'''
+        cutoff = time.time() - self.WARM_POOL_MAX_AGE
+        claimed = None
+        with self.warm_pool_lock:
+            for index, warm_video in enumerate(self.warm_pool):
+                if warm_video["date_created"] >= cutoff: # Expired ones stay behind for warm_pool_fill() to delete.
+                    claimed = self.warm_pool.pop(index)
+                    break
+            self.warm_pool_stats["claimed" if claimed is not None else "missed"] += 1
+        self.warm_pool_refill.set()
+        return claimed
+    def signature_is_fresh(self, signature: None | dict) -> bool:
+        '''True if a pre-generated upload signature stays valid long enough to hand out.'''
+        if signature is None or signature.get("signature_expiration_time") is None:
+            return False
+        return signature["signature_expiration_time"] - time.time() >= self.WARM_POOL_MIN_SIGNATURE_LIFETIME
+    def create_upload_remote(self, id: str, video_metadata: dict, use_warm_pool: bool = True) -> dict:
+        '''Creates (or claims from the warm pool) the Stream Library video of an upload, tags it and signs the upload.
+
+        Nothing is written to Postgres. On success `object` holds the upload's `metadata` and `signature`.'''
+        description = video_metadata.get("description", "A video uploaded to OpenBroadcast.")
+        update_payload = {
             "metaTags": [
                 {
                     "property": "description",
-                    "value": video_metadata.get("description", "A video uploaded to OpenBroadcast.")
+                    "value": description
                 },
                 {
                     "property": "video_id",
                     "value": id
                 }
             ]
-        })
-        video_metadata["guid"] = remote_video_object["guid"]
+        }
+
+        warm_video = self.warm_pool_claim() if use_warm_pool and self.WARM_POOL_SIZE > 0 else None
+        if warm_video is not None:
+            guid = warm_video["guid"]
+            update_payload["title"] = video_metadata["title"] # Warm videos are created under WARM_POOL_TITLE.
+        else:
+            remote_video_object = self.bunny.stream_CreateVideo(
+                videoTitle = video_metadata["title"]
+            )
+            if remote_video_object is None or remote_video_object.get("guid") is None:
+                circuit_open = self.bunny.circuit_IsOpen("stream_CreateVideo")
+                function_response = wkw(
+                    type = "FAIL",
+                    message = "The Stream Library is failing or slow, try again later." if circuit_open else "The video could not be created in the Stream Library.",
+                    message_name = "bunny_circuit_open" if circuit_open else "stream_create_video_failed",
+                    object = f"{id}"
+                )
+                return function_response
+            guid = remote_video_object["guid"]
+
+        # Tagging the video and generating a TUS signature hash for the upload only need the guid, so they run concurrently.
+        #       The signature requires information unavailable on this service.
+        update_request = self.upload_executor.submit(self.bunny.stream_UpdateVideo, guid, payload = update_payload)
+        signature = None if warm_video is None else warm_video["signature"]
+        signature_request = None
+        if not self.signature_is_fresh(signature):
+            signature_request = self.upload_executor.submit(self.bunny.upload_CreateSignature, guid)
+
+        update_status = update_request.result()
+        if signature_request is not None:
+            signature = signature_request.result()
+        if warm_video is not None and (update_status is None or not 200 <= update_status < 300):
+            # The warm video keeps its placeholder title and no video_id, cleanup removes it. Start over with a fresh one.
+            return self.create_upload_remote(id, video_metadata, use_warm_pool=False)
+        if signature is None or signature.get("signature_expiration_time") is None:
+            # Without a signature the client can never upload. Cleanup leaves pending videos tagged with a video_id alone, so delete it now.
+            self._delete_remote_videos([guid])
+            circuit_open = self.bunny.circuit_IsOpen("upload_CreateSignature")
+            function_response = wkw(
+                type = "FAIL",
+                message = "The Stream Library is failing or slow, try again later." if circuit_open else "The upload signature could not be created.",
+                message_name = "bunny_circuit_open" if circuit_open else "upload_signature_failed",
+                object = f"{id}"
+            )
+            return function_response
+
+        video_metadata["guid"] = guid
         metadata = {
             "title": video_metadata.get("title"),
-            "description": video_metadata.get("description", "A video uploaded to OpenBroadcast."),
+            "description": description,
             "category": video_metadata.get("category"),
             "guid": video_metadata['guid'],
             "library_id": environ["BUNNY_STREAMLIBRARY_ID"],
             "id": id,
-            "thumbnail_url": f"{PULL_ZONE_ROOT}/thumbnails/{id}.png",
-            "stream_url": f"{LIBRARY_CDN_HOSTNAME}/{video_metadata['guid']}/playlist.m3u8",
+            "thumbnail_url": f"{self.PULL_ZONE_ROOT}/thumbnails/{id}.png",
+            "thumbnails": thumbnail_renditions(f"{self.PULL_ZONE_ROOT}/thumbnails/{id}.png"),
+            "stream_url": f"{self.LIBRARY_CDN_HOSTNAME}/{video_metadata['guid']}/playlist.m3u8",
         }
 
-        # Generating a TUS signature hash for the upload.
-        #       Requires information unavailable on this service.
-        signature = self.bunny.upload_CreateSignature(video_metadata["guid"])
+        function_response = wkw(
+            type = "SUCCESS",
+            message = "Stream Library video ready for upload",
+            message_name = "upload_remote_ready",
+            object = {
+                "signature": signature,
+                "metadata": metadata
+            }
+        )
+        return function_response
+    def create_upload_remote_isolated(self, id: str, video_metadata: dict) -> dict:
+        '''`create_upload_remote` for one entry of a batch. An entry that raises only fails itself, not the batch.'''
+        try:
+            return self.create_upload_remote(id, video_metadata)
+        except Exception:
+            LOGGER.exception(f"Setting up upload {id} in the Stream Library failed")
+            return wkw(
+                type = "FAIL",
+                message = "The video could not be set up in the Stream Library.",
+                message_name = "upload_remote_failed",
+                object = f"{id}"
+            )
+    def create_upload_object(self, id: str, video_metadata: dict) -> dict:
+        if not self.utility_is_video_id_valid(id):
+            function_response = wkw(
+                type = "FAIL",
+                message = "`id` is formatted incorrectly.",
+                message_name = "invalid_video_id",
+                object = f"{id}"
+            )
+            return function_response
+        
+        remote_response = self.create_upload_remote(id, video_metadata)
+        if remote_response["type"] != "SUCCESS":
+            return remote_response
+        metadata = remote_response["object"]["metadata"]
+        signature = remote_response["object"]["signature"]
     
         video_json = json.dumps(metadata)
         signature_json = json.dumps(signature)
 
         sql_query = f"""
-        INSERT INTO public."Uploads" (video_id, video_metadata, signature_metadata)
-        VALUES (%s, %s, %s);
+        INSERT INTO public."Uploads" (video_id, video_metadata, signature_metadata, next_check_at)
+        VALUES (%s, %s, %s, to_timestamp(%s));
         """
+        first_check = time.time() + self.UPLOAD_CHECK_BASE_DELAY
         try:
-            self.database.execute_sql_query(sql_query, args=(id, video_json, signature_json))
+            self.database.execute_sql_query(sql_query, args=(id, video_json, signature_json, first_check))
         except psycopg2_errors.UniqueViolation:
+            self._delete_remote_videos([metadata["guid"]]) # Lost the race for this id, its Stream Library video would never be used.
             function_response = wkw(
                 type = "FAIL",
                 message = f"Upload object with id {id} already exists.",
@@ -273,6 +983,8 @@ class VideoHandler:
             )
             return function_response
         
+        self.schedule_push(first_check, id)
+
         function_response = wkw(
             type = "SUCCESS",
             message = "Upload Created Successfully",
@@ -284,16 +996,112 @@ class VideoHandler:
         )
 
         return function_response
-    def create_video_object(self, id: str, video_metadata: dict) -> None:
-        if self.video_retrieve_by_id(id) is not None:
-            return # Video already exists. 
-        
-        video_guid = video_metadata["guid"]
-        
-        file_data = self.bunny.stream_RetrieveVideo(video_guid).get("object")
-        if file_data is None:
-            return # Video does not exist on Bunny or the connection with Bunny's API was lost.
-        
+    def validate_upload_entry(self, entry) -> None | dict:
+        '''Checks one `{"id", "metadata"}` entry of an upload batch. Returns the failure response, or None if it is valid.'''
+        id = entry.get("id") if isinstance(entry, dict) else None
+        metadata = entry.get("metadata") if isinstance(entry, dict) else None
+        if not isinstance(id, str) or not self.utility_is_video_id_valid(id):
+            return wkw(
+                type = "FAIL",
+                message = "`id` is missing or formatted incorrectly.",
+                message_name = "invalid_video_id",
+                object = None if id is None else f"{id}"
+            )
+        if not isinstance(metadata, dict) or len(metadata.keys()) == 0:
+            return wkw(
+                type = "FAIL",
+                message = "`metadata` is not set or was set incorrectly.",
+                message_name = "metadata_missing",
+                object = f"{id}"
+            )
+        metadata_missing_keys = [key for key in UPLOAD_METADATA_REQUIRED_KEYS if metadata.get(key) is None]
+        if len(metadata_missing_keys) > 0:
+            return wkw(
+                type = "FAIL",
+                message = f"Upload metadata did not contain [{metadata_missing_keys}].",
+                message_name = "metadata_missing_keys",
+                object = f"{id}"
+            )
+        return None
+    def create_upload_objects(self, entries: list) -> list:
+        '''Creates a batch of uploads from `{"id", "metadata"}` entries, returning one response per entry in the same order.
+
+        Every entry is validated and its id checked against both tables before any Bunny call is made, so
+        rejected entries cost nothing remote. The Bunny setup runs UPLOAD_BATCH_CONCURRENCY uploads at a time
+        and all Public."Uploads" rows are written with a single INSERT.'''
+        results = [None] * len(entries)
+        pending = {} # id -> index into `entries`
+        for index, entry in enumerate(entries):
+            failure = self.validate_upload_entry(entry)
+            if failure is None and entry["id"] in pending:
+                failure = wkw(
+                    type = "FAIL",
+                    message = f"Upload id {entry['id']} appears more than once in the batch.",
+                    message_name = "duplicate_id",
+                    object = f"{entry['id']}"
+                )
+            if failure is not None:
+                results[index] = failure
+                continue
+            pending[entry["id"]] = index
+
+        for id in self.utility_existing_video_ids(list(pending.keys())):
+            results[pending.pop(id)] = wkw(
+                type = "FAIL",
+                message = f"Upload object with id {id} already exists.",
+                message_name = "duplicate_id",
+                object = f"{id}"
+            )
+
+        remote_responses = self.upload_batch_executor.map(
+            lambda id: self.create_upload_remote_isolated(id, entries[pending[id]]["metadata"]), list(pending.keys())
+        )
+        first_check = time.time() + self.UPLOAD_CHECK_BASE_DELAY
+        uploads = {} # id -> remote response, for uploads ready to be inserted
+        for id, remote_response in zip(list(pending.keys()), remote_responses):
+            if remote_response["type"] != "SUCCESS":
+                results[pending[id]] = remote_response
+                continue
+            uploads[id] = remote_response
+
+        rows = [
+            (id, json.dumps(response["object"]["metadata"]), json.dumps(response["object"]["signature"]), first_check)
+            for id, response in uploads.items()
+        ]
+        try:
+            inserted_ids = self.uploads_insert_many(rows)
+        except psycopg2.Error:
+            inserted_ids = None
+        if inserted_ids is not None:
+            # Ids created by someone else since the existence check, their Stream Library videos would never be used.
+            self._delete_remote_videos([response["object"]["metadata"]["guid"] for id, response in uploads.items() if id not in inserted_ids])
+
+        for id, remote_response in uploads.items():
+            if inserted_ids is None:
+                results[pending[id]] = wkw(
+                    type = "FAIL",
+                    message = f"Transaction with database failed.",
+                    message_name = "database_tx_failed_misc",
+                    object = None
+                )
+            elif id not in inserted_ids: # Created by someone else since the existence check.
+                results[pending[id]] = wkw(
+                    type = "FAIL",
+                    message = f"Upload object with id {id} already exists.",
+                    message_name = "duplicate_id",
+                    object = f"{id}"
+                )
+            else:
+                self.schedule_push(first_check, id)
+                results[pending[id]] = wkw(
+                    type = "SUCCESS",
+                    message = "Upload Created Successfully",
+                    message_name = "upload_creation_success",
+                    object = remote_response["object"]
+                )
+        return results
+    def build_video_metadata(self, video_metadata: dict, file_data: dict) -> dict:
+        '''Adds the Roku-style `feedTags` for a finished upload to its metadata.'''
         metadata = video_metadata
         metadata["feedTags"] = {
             "releasedate": datetime.datetime.now().strftime("%B %d %Y"),
@@ -301,6 +1109,7 @@ class VideoHandler:
             "description": video_metadata.get("description"),
             "url": video_metadata['stream_url'],
             "poster": video_metadata['thumbnail_url'],
+            "posters": video_metadata.get("thumbnails", []), # Smaller/WebP renditions of `poster`
             "streamformat": "hls",
             
             "length": file_data.get("length"),
@@ -308,12 +1117,25 @@ class VideoHandler:
             "height": file_data.get("height"),
             "framerate": file_data.get("framerate")
         }
-
+        return metadata
+    def create_video_object(self, id: str, video_metadata: dict, file_data: dict = None) -> None:
+        if self.video_retrieve_by_id(id) is not None:
+            return # Video already exists. 
+        
+        video_guid = video_metadata["guid"]
+        
+        if file_data is None: # Callers that already hold the Bunny video object can skip this round-trip.
+            file_data = self.video_retrieve_remote(video_guid).get("object")
+        if file_data is None:
+            return # Video does not exist on Bunny or the connection with Bunny's API was lost.
+        
+        metadata = self.build_video_metadata(video_metadata, file_data)
         video_json = json.dumps(metadata)
         
         sql_query = f"""
         INSERT INTO public."Videos" (video_id, video_metadata)
-        VALUES (%s, %s);
+        VALUES (%s, %s)
+        RETURNING date_created, date_modified;
         """
-        self.database.execute_sql_query(sql_query, args=(id, video_json))
-        
\ No newline at end of file
+        date_created, date_modified = self.database.execute_sql_query(sql_query, args=(id, video_json), fetch="one")
+        self.feed.upsert_many([(id, metadata, date_created, date_modified)])
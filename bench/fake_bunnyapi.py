@@ -0,0 +1,178 @@
+'''Stand-in for the bunnyapi sidecar, implementing every route `BunnyAPI` calls against an in-memory library.
+
+    python bench/fake_bunnyapi.py --port 8081 --latency-ms 20 --jitter-ms 10 --error-rate 0.01
+
+Videos move from status 0 to 4 `--encode-seconds` after creation. Benchmarks control it through:
+    POST /_bench/seed   {"count": 1000, "status": 4, "video_id_prefix": "b"}  -> adds videos, returns their guids
+    POST /_bench/reset  drops the library and counters
+    GET  /_bench/stats  request counts per route
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock
+
+import argparse
+import json
+import random
+import time
+import uuid
+
+class FakeBunnyLibrary:
+    def __init__(self, encode_seconds: float = 5.0):
+        self.encode_seconds = encode_seconds
+        self.videos: dict[str, dict] = {} # guid -> video object, insertion ordered like Bunny's listing
+        self.created_at: dict[str, float] = {}
+        self.request_counts: dict[str, int] = {}
+        self.lock = Lock()
+
+    def count(self, route: str) -> None:
+        with self.lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+
+    def create(self, title: str, status: int = 0, video_id: str = None) -> dict:
+        guid = str(uuid.uuid4())
+        video = {
+            "guid": guid,
+            "title": title,
+            "status": status,
+            "metaTags": [] if video_id is None else [{"property": "video_id", "value": video_id}],
+            "length": 60,
+            "width": 1920,
+            "height": 1080,
+            "framerate": 30.0,
+            "dateUploaded": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) # UTC, like Bunny
+        }
+        with self.lock:
+            self.videos[guid] = video
+            self.created_at[guid] = time.monotonic()
+        return video
+
+    def get(self, guid: str) -> None | dict:
+        with self.lock:
+            video = self.videos.get(guid)
+            # Encoding finishes on its own after a while, like the real library.
+            if video is not None and video["status"] < 4 and time.monotonic() - self.created_at[guid] >= self.encode_seconds:
+                video["status"] = 4
+            return video
+
+class FakeBunnyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so connection reuse in BunnyAPI is exercised.
+    disable_nagle_algorithm = True # Headers and body go out in separate writes, don't let delayed ACKs add 40ms.
+    library: FakeBunnyLibrary = None
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, payload: dict, status_code: int = 200) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self) -> None:
+        content_length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(content_length) if content_length > 0 else b""
+        route = self.path.split("?")[0]
+        library = self.library
+
+        if route.startswith("/_bench/"):
+            return self.handle_bench(route, body)
+        library.count(route)
+
+        delay = (self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < self.error_rate:
+            return self.reply({"type": "FAIL", "message": "Injected error", "message_name": "injected_error", "object": None}, 503)
+
+        headers = self.headers
+        if route == "/stream/create-video":
+            video = library.create(headers.get("title"))
+            return self.reply({"type": "SUCCESS", "message_name": "video_create_success", "object": video})
+        if route == "/stream/update-video":
+            video = library.get(headers.get("guid"))
+            if video is not None:
+                video.update(json.loads(body or b"{}"))
+            return self.reply({"type": "SUCCESS", "message_name": "video_update_success", "object": None})
+        if route == "/stream/retrieve-video":
+            video = library.get(headers.get("guid"))
+            if video is None:
+                return self.reply({"type": "FAIL", "message_name": "video_not_found", "object": None})
+            return self.reply({"type": "SUCCESS", "message_name": "video_retrieve_success", "object": video})
+        if route == "/stream/videos":
+            page = int(headers.get("page") or 1)
+            items_per_page = int(headers.get("itemsPerPage") or 100)
+            with library.lock:
+                guids = list(library.videos.keys())
+            items = [library.get(guid) for guid in guids[(page - 1) * items_per_page:page * items_per_page]]
+            return self.reply({"type": "SUCCESS", "message_name": "video_list_retrieve_success", "object": {
+                "totalItems": len(guids), "currentPage": page, "itemsPerPage": items_per_page, "items": [x for x in items if x is not None]
+            }})
+        if route == "/stream/delete-video":
+            with library.lock:
+                library.videos.pop(headers.get("guid"), None)
+            return self.reply({"type": "SUCCESS", "message_name": "video_delete_success", "object": None})
+        if route == "/stream/create-signature":
+            return self.reply({"type": "SUCCESS", "message_name": "signature_create_success", "object": {
+                "signature": uuid.uuid4().hex, "signature_expiration_time": time.time() + 86400, "video_id": headers.get("videoID")
+            }})
+        if route in ("/files/upload", "/files/upload-stream", "/cache/purge", "/files/delete", "/files/retrieve", "/files/list"):
+            return self.reply({"type": "SUCCESS", "message_name": "success", "object": [] if route == "/files/list" else None})
+        return self.reply({"type": "FAIL", "message_name": "route_not_found", "object": None}, 404)
+
+    def handle_bench(self, route: str, body: bytes) -> None:
+        library = self.library
+        if route == "/_bench/seed":
+            options = json.loads(body or b"{}")
+            prefix = options.get("video_id_prefix")
+            guids = []
+            for index in range(int(options.get("count", 0))):
+                video_id = None if prefix is None else f"{prefix}{index:0{12 - len(prefix)}d}"
+                guids.append(library.create(f"bench {index}", status=int(options.get("status", 4)), video_id=video_id)["guid"])
+            return self.reply({"type": "SUCCESS", "object": guids})
+        if route == "/_bench/reset":
+            with library.lock:
+                library.videos.clear()
+                library.created_at.clear()
+                library.request_counts.clear()
+            return self.reply({"type": "SUCCESS", "object": None})
+        if route == "/_bench/stats":
+            with library.lock:
+                return self.reply({"type": "SUCCESS", "object": dict(library.request_counts)})
+        return self.reply({"type": "FAIL", "object": None}, 404)
+
+    do_GET = do_POST = do_DELETE = handle_request
+
+def serve(host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+          error_rate: float = 0.0, encode_seconds: float = 5.0) -> ThreadingHTTPServer:
+    '''Builds the server, call `serve_forever()` on it (port 0 picks a free port, see `server_port`).'''
+    handler = type("ConfiguredFakeBunnyHandler", (FakeBunnyHandler,), {
+        "library": FakeBunnyLibrary(encode_seconds=encode_seconds),
+        "latency_ms": latency_ms,
+        "jitter_ms": jitter_ms,
+        "error_rate": error_rate
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added to every call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- around --latency-ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with a 503")
+    parser.add_argument("--encode-seconds", type=float, default=5.0, help="Seconds until a created video reaches status 4")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.encode_seconds)
+    print(f"Fake bunnyapi listening on {args.host}:{server.server_port}", flush=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
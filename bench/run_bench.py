@@ -0,0 +1,481 @@
+'''Reproducible benchmarks for the video service against a fake bunnyapi sidecar and a throwaway Postgres database.
+
+    python bench/run_bench.py --postgres local --concurrency 1,8,32 --rows 1000,10000,100000
+    python bench/run_bench.py --postgres ephemeral --latency-ms 25 --error-rate 0.01 --update-baseline
+
+HTTP scenarios start the service under gunicorn (with gunicorn.conf.py, recording its cold start) and drive /uploads/create, /videos/retrieve,
+/videos/generate_id and /videos/thumbnail-upload (timed until its job is done) at each concurrency level. Cycle scenarios time one
+poller cycle and one Stream Library cleanup pass in-process with 1k/10k/100k seeded rows.
+
+`--postgres local` uses the server in POSTGRESDB_* but always works in its own `--bench-database`,
+which is dropped and recreated; `--postgres ephemeral` starts a disposable postgres container with docker.
+Results are written to `--output` and compared with `--baseline`, exiting with status 1 on a regression or a
+missing baseline. bench/baseline.json is the reference run, its `meta` records the machine and settings it was
+generated with. Regenerate it with `--update-baseline` on the same settings after an intended performance change.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from os import path, environ, cpu_count
+from threading import local
+
+import argparse
+import json
+import platform
+import secrets
+import socket
+import subprocess
+import sys
+import time
+
+import psycopg2
+import psycopg2.extras as psycopg2_extras
+import requests
+
+BENCH_DIR = path.dirname(path.realpath(__file__))
+SERVICE_DIR = path.dirname(BENCH_DIR)
+
+HTTP_SCENARIOS = ("generate_id", "uploads_create", "videos_retrieve", "thumbnail_upload")
+CYCLE_SCENARIOS = ("poller", "cleanup")
+
+# Per metric: which direction is worse. Anything not listed is informational.
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "seconds")
+HIGHER_IS_BETTER = ("throughput_rps", "rows_per_second")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for(check, timeout: float, what: str) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {what}.")
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def postgres_env(host: str, port: str, user: str, password: str, database: str) -> dict:
+    return {
+        "POSTGRESDB_HOST": host,
+        "POSTGRESDB_DOCKER_PORT": str(port),
+        "POSTGRESDB_USER": user,
+        "POSTGRES_PASSWORD": password,
+        "POSTGRESDB_DATABASE": database
+    }
+
+def connect(env: dict, database: str = None):
+    return psycopg2.connect(
+        database=database or env["POSTGRESDB_DATABASE"],
+        host=env["POSTGRESDB_HOST"],
+        user=env["POSTGRESDB_USER"],
+        password=env["POSTGRES_PASSWORD"],
+        port=env["POSTGRESDB_DOCKER_PORT"]
+    )
+
+@contextmanager
+def local_postgres(bench_database: str):
+    '''Recreates `bench_database` on the POSTGRESDB_* server, the service database itself is never touched.'''
+    server_env = postgres_env(
+        environ["POSTGRESDB_HOST"], environ.get("POSTGRESDB_DOCKER_PORT", 5432),
+        environ["POSTGRESDB_USER"], environ.get("POSTGRES_PASSWORD", ""), environ["POSTGRESDB_DATABASE"]
+    )
+    if bench_database == server_env["POSTGRESDB_DATABASE"]:
+        raise SystemExit("--bench-database must differ from POSTGRESDB_DATABASE, it is dropped on every run.")
+
+    admin = connect(server_env)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{bench_database}"')
+        cursor.execute(f'CREATE DATABASE "{bench_database}"')
+    try:
+        yield dict(server_env, POSTGRESDB_DATABASE=bench_database)
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{bench_database}" WITH (FORCE)')
+        admin.close()
+
+@contextmanager
+def ephemeral_postgres(image: str):
+    '''Runs a disposable postgres container for the duration of the `with` block.'''
+    password = secrets.token_hex(8)
+    container_id = subprocess.check_output([
+        "docker", "run", "--rm", "-d", "-e", f"POSTGRES_PASSWORD={password}", "-p", "127.0.0.1::5432", image
+    ], text=True).strip()
+    try:
+        port = subprocess.check_output(["docker", "port", container_id, "5432/tcp"], text=True).strip().splitlines()[0].rsplit(":", 1)[1]
+        env = postgres_env("127.0.0.1", port, "postgres", password, "postgres")
+        wait_for(lambda: connect(env).close() is None, 60, "the postgres container")
+        yield env
+    finally:
+        subprocess.run(["docker", "stop", container_id], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def apply_schema(env: dict) -> None:
+    with open(path.join(BENCH_DIR, "schema.sql")) as schema_file:
+        schema = schema_file.read()
+    connection = connect(env)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(schema)
+    connection.close()
+
+def reset_tables(env: dict) -> None:
+    connection = connect(env)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute('TRUNCATE public."Uploads", public."Videos"')
+    connection.close()
+
+@contextmanager
+def fake_bunnyapi(latency_ms: float, jitter_ms: float, error_rate: float):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, path.join(BENCH_DIR, "fake_bunnyapi.py"), "--port", str(port),
+        "--latency-ms", str(latency_ms), "--jitter-ms", str(jitter_ms), "--error-rate", str(error_rate)
+    ], stdout=subprocess.DEVNULL)
+    address = f"127.0.0.1:{port}"
+    try:
+        wait_for(lambda: requests.get(f"http://{address}/_bench/stats", timeout=1).ok, 30, "the fake bunnyapi")
+        yield address
+    finally:
+        process.terminate()
+        process.wait()
+
+def bunny_control(address: str, route: str, payload: dict = None):
+    response = requests.post(f"http://{address}/_bench/{route}", json=payload or {}, timeout=600)
+    response.raise_for_status()
+    return response.json()["object"]
+
+def service_env(postgres: dict, bunny_address: str) -> dict:
+    return dict(
+        environ,
+        **postgres,
+        BUNNY_ENDPOINT_ADDRESS=bunny_address,
+        BUNNY_PULL_ZONE_ROOT=environ.get("BUNNY_PULL_ZONE_ROOT", "https://bench.b-cdn.net"),
+        LIBRARY_CDN_HOSTNAME=environ.get("LIBRARY_CDN_HOSTNAME", "https://bench-library.b-cdn.net"),
+        BUNNY_STREAMLIBRARY_ID=environ.get("BUNNY_STREAMLIBRARY_ID", "1"),
+    )
+
+@contextmanager
+def running_service(env: dict, workers: int, threads: int, startup: dict = None):
+    '''Runs the service under gunicorn.conf.py. `startup` receives the seconds until it answered and its workers' boot times.'''
+    port = free_port()
+    service_start = time.perf_counter()
+    process = subprocess.Popen([
+        sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", str(workers), "--threads", str(threads),
+        "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "API:api"
+    ], cwd=SERVICE_DIR, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(lambda: requests.get(f"{base_url}/metrics", timeout=1).ok, 60, "the service")
+        if startup is not None:
+            startup["seconds"] = round(time.perf_counter() - service_start, 4)
+            startup.update(scrape_startup(base_url))
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+def scrape_startup(base_url: str) -> dict:
+    '''Startup phases reported by the worker that answered, from its startup_seconds gauge.'''
+    phases = {}
+    for line in requests.get(f"{base_url}/metrics", timeout=5).text.splitlines():
+        if line.startswith("startup_seconds{"):
+            phase = line.split('phase="', 1)[1].split('"', 1)[0]
+            phases[f"{phase}_seconds"] = round(float(line.rsplit(" ", 1)[1]), 4)
+    return phases
+
+def sample_thumbnail() -> bytes:
+    '''A 1920x1080 JPEG of seeded noise, so every run resizes and encodes the same worst-case image.'''
+    import cv2
+    import numpy
+    image = numpy.random.default_rng(0).integers(0, 256, (1080, 1920, 3), dtype=numpy.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+def build_request(scenario: str, base_url: str, context: dict):
+    '''Returns (method, url, keyword arguments) for one request of `scenario`.'''
+    if scenario == "generate_id":
+        return "GET", f"{base_url}/videos/generate_id", {}
+    if scenario == "uploads_create":
+        video_id = "".join(secrets.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(12))
+        return "POST", f"{base_url}/uploads/create", {
+            "headers": {"id": video_id},
+            "json": {"title": f"bench {video_id}", "description": "benchmark upload", "category": "bench"}
+        }
+    if scenario == "videos_retrieve":
+        return "GET", f"{base_url}/videos/retrieve", {"headers": {"guid": secrets.choice(context["guids"])}}
+    if scenario == "thumbnail_upload":
+        return "POST", f"{base_url}/videos/thumbnail-upload", {
+            "headers": {"target-file-path": f"thumbnails/bench_{secrets.token_hex(6)}.png", "Content-Type": "image/jpeg"},
+            "data": context["thumbnail"]
+        }
+    raise ValueError(f"Unknown scenario `{scenario}`.")
+
+def wait_for_thumbnail_job(session: requests.Session, base_url: str, job_id: str) -> None | int:
+    '''Polls a queued thumbnail job until it finishes, so the scenario times the whole job and never outruns the
+    service's THUMBNAIL_MAX_PENDING backpressure. Returns 200 when it is done and None when it failed or timed out.
+
+    Jobs queue behind each other at high concurrency, hence the generous deadline.'''
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        response = session.get(f"{base_url}/videos/thumbnail-status", headers={"job-id": job_id}, timeout=60)
+        status = response.json()["object"]["status"] if response.status_code == 200 else None
+        if status == "done":
+            return 200
+        if status == "failed":
+            return None
+        time.sleep(0.05) # Polling faster only takes CPU from the jobs.
+    return None
+
+def run_http_scenario(scenario: str, base_url: str, concurrency: int, request_count: int, context: dict) -> dict:
+    sessions = local()
+    def send(_):
+        session = getattr(sessions, "session", None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        method, url, kwargs = build_request(scenario, base_url, context)
+        request_start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=60, **kwargs)
+            status_code = response.status_code
+            if scenario == "thumbnail_upload" and status_code == 202:
+                status_code = wait_for_thumbnail_job(session, base_url, response.json()["object"]["job_id"])
+        except requests.RequestException:
+            status_code = None
+        return time.perf_counter() - request_start, status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(min(request_count, concurrency * 2)))) # Warm connections and caches.
+        scenario_start = time.perf_counter()
+        samples = list(executor.map(send, range(request_count)))
+        elapsed = time.perf_counter() - scenario_start
+
+    latencies = sorted(x[0] * 1000 for x in samples)
+    errors = sum(1 for _, status_code in samples if status_code is None or status_code >= 300)
+    return {
+        "requests": request_count,
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "throughput_rps": round(request_count / elapsed, 2),
+        "error_rate": round(errors / request_count, 4)
+    }
+
+def run_http_benchmarks(args, env: dict, bunny_address: str) -> dict:
+    results = {}
+    context = {
+        "guids": bunny_control(bunny_address, "seed", {"count": 1000, "status": 4, "video_id_prefix": "r"}),
+        "thumbnail": sample_thumbnail() if "thumbnail_upload" in args.http_scenarios else None
+    }
+    startup = {}
+    with running_service(env, args.workers, args.threads, startup=startup) as base_url:
+        results["startup.service"] = startup
+        print(f"startup.service: {startup}", flush=True)
+        for scenario in args.http_scenarios:
+            for concurrency in args.concurrency:
+                key = f"http.{scenario}.c{concurrency}"
+                results[key] = run_http_scenario(scenario, base_url, concurrency, args.requests, context)
+                print(f"{key}: {results[key]}", flush=True)
+    return results
+
+def seed_uploads(env: dict, guids: list, video_id_prefix: str) -> None:
+    '''One pending upload per guid, all due now and with signatures far from expiring.'''
+    expiration = time.time() + 86400
+    rows = []
+    for index, guid in enumerate(guids):
+        video_id = f"{video_id_prefix}{index:0{12 - len(video_id_prefix)}d}"
+        metadata = { # Same shape as VideoHandler.create_upload_object() stores.
+            "title": f"bench {index}",
+            "description": "benchmark upload",
+            "category": "bench",
+            "guid": guid,
+            "library_id": "1",
+            "id": video_id,
+            "thumbnail_url": f"https://bench.b-cdn.net/thumbnails/{video_id}.png",
+            "thumbnails": [],
+            "stream_url": f"https://bench-library.b-cdn.net/{guid}/playlist.m3u8"
+        }
+        rows.append((video_id, json.dumps(metadata), json.dumps({"signature": "bench", "signature_expiration_time": expiration})))
+    connection = connect(env)
+    with connection, connection.cursor() as cursor:
+        psycopg2_extras.execute_values(cursor, '''
+        INSERT INTO public."Uploads" (video_id, video_metadata, signature_metadata, next_check_at)
+        VALUES %s
+        ''', rows, template="(%s, %s, %s, now() - interval '1 second')", page_size=1000)
+    connection.close()
+
+def seed_dead_videos(env: dict, count: int) -> None:
+    '''Public."Videos" rows whose guid is not in the Stream Library, which cleanup has to confirm and remove.'''
+    rows = [(f"d{index:011d}", json.dumps({"guid": f"dead-{secrets.token_hex(8)}"})) for index in range(count)]
+    connection = connect(env)
+    with connection, connection.cursor() as cursor:
+        psycopg2_extras.execute_values(cursor, '''
+        INSERT INTO public."Videos" (video_id, video_metadata) VALUES %s
+        ''', rows, page_size=1000)
+    connection.close()
+
+def run_cycle_benchmarks(args, env: dict, bunny_address: str) -> dict:
+    '''Times one poller cycle and one cleanup pass per row count, against an in-process VideoHandler.'''
+    environ.update(service_env(env, bunny_address))
+    sys.path.insert(0, SERVICE_DIR)
+    from Video import VideoHandler
+
+    handler = VideoHandler(start_background=False) # Cycles are driven by hand, no poller thread competing for rows.
+    results = {}
+    for rows in args.rows:
+        reset_tables(env)
+        bunny_control(bunny_address, "reset")
+        handler.video_cache = type(handler.video_cache)() # Cold cache for every size.
+
+        guids = bunny_control(bunny_address, "seed", {"count": rows, "status": 4, "video_id_prefix": "u"})
+        seed_uploads(env, guids, "u")
+        handler.POLLER_MAX_UPLOADS_PER_CYCLE = rows
+
+        if "poller" in args.cycle_scenarios:
+            cycle_start = time.perf_counter()
+            processed = handler.poll_upload_progress_cycle()
+            elapsed = time.perf_counter() - cycle_start
+            results[f"cycle.poller.{rows}"] = {
+                "rows": rows,
+                "processed": processed,
+                "seconds": round(elapsed, 4),
+                "rows_per_second": round(processed / elapsed, 2)
+            }
+            print(f"cycle.poller.{rows}: {results[f'cycle.poller.{rows}']}", flush=True)
+
+        if "cleanup" in args.cycle_scenarios:
+            # 1% remote orphans and 1% dead local rows so the deletion paths are part of the measurement.
+            drift = max(1, rows // 100)
+            bunny_control(bunny_address, "seed", {"count": drift, "status": 4, "video_id_prefix": "o"})
+            seed_dead_videos(env, drift)
+            cycle_start = time.perf_counter()
+            report = handler.cleanup_stream_library()
+            elapsed = time.perf_counter() - cycle_start
+            results[f"cycle.cleanup.{rows}"] = {
+                "rows": rows,
+                "seconds": round(elapsed, 4),
+                "rows_per_second": round(report["remote_videos_seen"] / elapsed, 2),
+                "remote_deleted": report["remote_deleted"],
+                "local_deleted": report["local_deleted"]
+            }
+            print(f"cycle.cleanup.{rows}: {results[f'cycle.cleanup.{rows}']}", flush=True)
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    '''Returns a line per metric that got worse than `baseline` by more than `tolerance` (a fraction).'''
+    regressions = []
+    for key, metrics in results.items():
+        baseline_metrics = baseline.get(key)
+        if baseline_metrics is None:
+            continue
+        for metric, value in metrics.items():
+            previous = baseline_metrics.get(metric)
+            if not previous:
+                continue
+            if metric in LOWER_IS_BETTER and value > previous * (1 + tolerance):
+                regressions.append(f"{key} {metric}: {previous} -> {value} (+{(value / previous - 1) * 100:.1f}%)")
+            elif metric in HIGHER_IS_BETTER and value < previous * (1 - tolerance):
+                regressions.append(f"{key} {metric}: {previous} -> {value} ({(value / previous - 1) * 100:.1f}%)")
+        if metrics.get("error_rate", 0) > baseline_metrics.get("error_rate", 0) + 0.01:
+            regressions.append(f"{key} error_rate: {baseline_metrics.get('error_rate', 0)} -> {metrics['error_rate']}")
+    return regressions
+
+def comma_list(cast):
+    return lambda value: [cast(x) for x in value.split(",") if x.strip() != ""]
+
+def run_settings(args) -> dict:
+    '''The arguments a run's results depend on, stored with them so runs are only compared like for like.'''
+    return {
+        "postgres": args.postgres,
+        "http_scenarios": args.http_scenarios,
+        "cycle_scenarios": args.cycle_scenarios,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "rows": args.rows,
+        "workers": args.workers,
+        "threads": args.threads,
+        "bunny_latency_ms": args.latency_ms,
+        "bunny_jitter_ms": args.jitter_ms,
+        "bunny_error_rate": args.error_rate
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--postgres", choices=("local", "ephemeral"), default="local")
+    parser.add_argument("--bench-database", default="openbroadcast_bench", help="Database created (and dropped) for --postgres local")
+    parser.add_argument("--postgres-image", default="postgres:16", help="Image used for --postgres ephemeral")
+    parser.add_argument("--http-scenarios", type=comma_list(str), default=list(HTTP_SCENARIOS))
+    parser.add_argument("--cycle-scenarios", type=comma_list(str), default=list(CYCLE_SCENARIOS))
+    parser.add_argument("--concurrency", type=comma_list(int), default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario and concurrency level")
+    parser.add_argument("--rows", type=comma_list(int), default=[1000, 10000, 100000])
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Fake bunnyapi latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake bunnyapi calls answered with a 503")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", default=path.join(BENCH_DIR, "baseline.json"))
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging, as a fraction")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline")
+    args = parser.parse_args()
+    for scenario in args.http_scenarios + args.cycle_scenarios:
+        if scenario not in HTTP_SCENARIOS + CYCLE_SCENARIOS:
+            parser.error(f"Unknown scenario `{scenario}`.")
+
+    postgres = ephemeral_postgres(args.postgres_image) if args.postgres == "ephemeral" else local_postgres(args.bench_database)
+    results = {}
+    with postgres as env, fake_bunnyapi(args.latency_ms, args.jitter_ms, args.error_rate) as bunny_address:
+        apply_schema(env)
+        if len(args.http_scenarios) > 0:
+            results.update(run_http_benchmarks(args, service_env(env, bunny_address), bunny_address))
+        if len(args.cycle_scenarios) > 0:
+            results.update(run_cycle_benchmarks(args, env, bunny_address))
+
+    output = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": cpu_count(),
+            "settings": run_settings(args)
+        },
+        "results": results
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(output, output_file, indent=4)
+    print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(output, baseline_file, indent=4)
+        print(f"Baseline updated at {args.baseline}")
+        return
+    if not path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to store one.")
+        sys.exit(1)
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    baseline_settings = baseline.get("meta", {}).get("settings", {})
+    for setting, value in run_settings(args).items():
+        if baseline_settings.get(setting) != value:
+            print(f"Warning: {setting} is {value} but the baseline was generated with {baseline_settings.get(setting)}.")
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    if len(regressions) > 0:
+        print(f"{len(regressions)} regression(s) against {args.baseline}:")
+        for line in regressions:
+            print(f"    {line}")
+        sys.exit(1)
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance * 100:.0f}%).")
+
+if __name__ == "__main__":
+    main()
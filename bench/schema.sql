@@ -0,0 +1,14 @@
+-- Tables the service expects, created in the throwaway benchmark database.
+--       Scheduling columns on Public."Uploads" are added by VideoHandler.ensure_upload_schedule_schema().
+CREATE TABLE IF NOT EXISTS public."Uploads" (
+    video_id VARCHAR(12) PRIMARY KEY,
+    video_metadata JSONB NOT NULL,
+    signature_metadata JSONB NOT NULL,
+    date_creation TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS public."Videos" (
+    video_id VARCHAR(12) PRIMARY KEY,
+    video_metadata JSONB NOT NULL,
+    date_created TIMESTAMPTZ NOT NULL DEFAULT now(),
+    date_modified TIMESTAMPTZ NOT NULL DEFAULT now()
+);
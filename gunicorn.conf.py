@@ -0,0 +1,71 @@
+'''gunicorn settings for the video service.
+
+    gunicorn -c gunicorn.conf.py API:api
+
+API.py builds nothing at import, so the app is preloaded once in the master and every worker initializes its
+own Postgres pool and Bunny session as it boots. Exactly one worker at a time is designated to run the upload
+poller and job workers. When it exits the next worker forked takes over, and a reload designates one of the
+new workers. Workers share their metrics through METRICS_MULTIPROC_DIR, so whichever worker answers a scrape
+of /metrics reports all of them.
+'''
+from os import environ
+
+import glob
+import os
+import signal
+import tempfile
+import time
+
+bind = environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(environ.get("GUNICORN_WORKERS", 2))
+threads = int(environ.get("GUNICORN_THREADS", 8))
+timeout = int(environ.get("GUNICORN_TIMEOUT", 60))
+preload_app = environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# "0" leaves the poller and job workers to other processes (e.g. `python Jobs.py`) in every worker.
+BACKGROUND_WORKER = environ.get("BACKGROUND_WORKER", "1") == "1"
+
+def on_starting(server):
+    # Workers inherit this before exporting anything. Snapshots left by a previous run must not add to this run's counters.
+    if environ.get("METRICS_MULTIPROC_DIR", "") == "":
+        environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="video_service_metrics_")
+    os.makedirs(environ["METRICS_MULTIPROC_DIR"], exist_ok=True)
+    for file_name in glob.glob(os.path.join(environ["METRICS_MULTIPROC_DIR"], "*.json")):
+        os.remove(file_name)
+
+def pre_fork(server, worker):
+    # Runs in the master, which keeps track of the designated worker across forks.
+    worker.forked_at = time.monotonic()
+    worker.background = BACKGROUND_WORKER and getattr(server, "background_worker", None) is None
+    if worker.background:
+        server.background_worker = worker
+
+def post_fork(server, worker):
+    if worker.background:
+        server.log.info(f"Worker {worker.pid} runs the upload poller and job workers")
+
+def post_worker_init(worker):
+    # Initializing here rather than on the first request keeps cold start out of request latency.
+    import API
+    API.InitServices(start_background=worker.background)
+    API.STARTUP_TIMINGS["worker_boot"] = time.monotonic() - worker.forked_at
+    worker.log.info(
+        f"Worker {worker.pid} ready in {API.STARTUP_TIMINGS['worker_boot']:.3f}s "
+        f"(services {API.STARTUP_TIMINGS['services']:.3f}s, import {API.STARTUP_TIMINGS['import']:.3f}s)"
+    )
+
+def on_reload(server):
+    # A reload (HUP) forks a full new set of workers while the old ones still run, so the new set designates its own.
+    #       The old designated worker overlapping it until it exits is harmless, uploads and jobs are claimed with SKIP LOCKED.
+    server.background_worker = None
+
+def child_exit(server, worker):
+    if getattr(server, "background_worker", None) is not worker:
+        return
+    server.background_worker = None
+    server.log.info(f"Designated background worker {worker.pid} exited")
+    if len(server.LISTENERS) == 0 or len(server.WORKERS) < server.num_workers:
+        return # Shutting down, or a replacement is about to be forked and designated.
+    # Nothing will be forked (e.g. TTOU removed this worker), so gracefully restart the youngest worker for its replacement to take over.
+    youngest_pid = max(server.WORKERS.items(), key=lambda x: x[1].age)[0]
+    server.kill_worker(youngest_pid, signal.SIGTERM)
@@ -0,0 +1,39 @@
+'''Local stand-in for Bunny's status webhooks, posts callbacks to /webhooks/stream-status.
+
+    python tools/webhook_standin.py http://localhost:5000 <guid> --status 3
+    python tools/webhook_standin.py http://localhost:5000 <guid> --sequence 0,1,2,3 --interval 2
+'''
+import argparse
+import time
+
+import requests
+
+def post_stream_status(service_url: str, guid: str, status: int, library_id: int = 0, token: str = None) -> requests.Response:
+    payload = {
+        "VideoLibraryId": library_id,
+        "VideoGuid": guid,
+        "Status": status
+    }
+    params = {"token": token} if token is not None else None
+    return requests.post(f"{service_url}/webhooks/stream-status", json=payload, params=params, timeout=10)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("service_url", help="Base URL of the video service")
+    parser.add_argument("guid", help="VideoGuid to report on")
+    parser.add_argument("--status", type=int, default=3, help="Bunny webhook status code (3 = Finished)")
+    parser.add_argument("--sequence", help="Comma separated statuses to send one after another, overrides --status")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between callbacks in a --sequence")
+    parser.add_argument("--library-id", type=int, default=0)
+    parser.add_argument("--token", help="Value of WEBHOOK_TOKEN on the service, if set")
+    args = parser.parse_args()
+
+    statuses = [int(x) for x in args.sequence.split(",")] if args.sequence else [args.status]
+    for index, status in enumerate(statuses):
+        if index > 0:
+            time.sleep(args.interval)
+        response = post_stream_status(args.service_url, args.guid, status, library_id=args.library_id, token=args.token)
+        print(f"Status {status} -> HTTP {response.status_code} {response.text}")
+
+if __name__ == "__main__":
+    main()